@@ -1,52 +1,121 @@
 import RPi.GPIO as GPIO;
+import time;
+import queue;
+import threading;
 
-# A class responsible for watching for button presses by the user and reporting
-# them to the Controller when asked.
+# A class responsible for watching for button presses by the user. Each press
+# and release is caught by a GPIO edge callback the moment it happens (not
+# whenever the main loop gets around to checking), debounced, timestamped and
+# put on a queue, for a GestureRecognizer (or anyone else) to pick up.
 class ButtonManager:
-    
+
     # ButtonManager properties:
     #   pins       An array holding the GPIO input pins of the buttons. The pins
-    #              come in the order of these buttons: "power", "capture"        
-    #   durations  The current number of consecutive times each button has been
-    #              held down (useful for click/hold button actions)
-    
-    # Constructor: set up the pins as input pins
+    #              come in the order of these buttons: "power", "capture"
+    #   states     An array of booleans: whether or not each button is down
+    #              (after debouncing)
+    #   lastEdges  An array of the monotonic times each button's state last
+    #              changed
+    #   events     A queue of (button index, pressed, monotonic time) tuples,
+    #              one for each press and release
+    #   signal     A threading.Event set whenever an event is queued
+    #   lock       A lock guarding 'states' and 'lastEdges' (the callbacks run
+    #              on RPi.GPIO's own thread)
+
+    # ButtonManager constants:
+    #   POWER      The index of the power button
+    #   CAPTURE    The index of the capture button
+    #   DEBOUNCE   The time (in seconds) after a change in a button's state
+    #              during which any more changes are taken as contact bounce
+
+    # Constructor: set up the pins as input pins, and watch them for edges
     def __init__(self):
+        self.POWER = 0;
+        self.CAPTURE = 1;
+        self.DEBOUNCE = 0.02;
+
         # set up the pins
         self.pins = [16, 5];
-        self.durations = [0, 0];
+        self.states = [False, False];
+        self.lastEdges = [0.0, 0.0];
+        self.events = queue.Queue();
+        self.signal = threading.Event();
+        self.lock = threading.Lock();
 
         # set up GPIO pin layout/settings
         GPIO.setmode(GPIO.BCM);
         GPIO.setwarnings(False);
 
-        # set up each GPIO pin to be input pins
+        # set up each GPIO pin to be input pins, calling edge() whenever one
+        # rises or falls
         for i in range(0, len(self.pins)):
             GPIO.setup(self.pins[i], GPIO.IN);
-    
-    
+            GPIO.add_event_detect(self.pins[i], GPIO.BOTH, callback = self.edge);
+
+
     # Destructor: resets the GPIO pins
     def __del__(self):
         # clean up pins
         GPIO.cleanup();
 
-    
+
     # ------------------ Button-checking Functions ----------------- #
     # Determines if the power button is pressed, and returns a boolean value
     # accordingly
     def isPowerPressed(self):
-        buttonDown = not GPIO.input(self.pins[0]);
-        # increment the power button's duration
-        self.durations[0] = int(buttonDown) * (self.durations[0] + 1);
-        return buttonDown;
-    
+        return self.states[self.POWER];
+
 
     # Determines if the capture button is pressed, and returns a boolean value
     # accordingly
     def isCapturePressed(self):
-        buttonDown = not GPIO.input(self.pins[1]);
-        # increment the capture button's duration
-        self.durations[1] = int(buttonDown) * (self.durations[1] + 1);
-        return buttonDown;
-    
+        return self.states[self.CAPTURE];
+
+
+    # Returns (and removes) a list of the queued (button index, pressed, time)
+    # events, oldest first
+    def popEvents(self):
+        events = [];
+        while (True):
+            try:
+                events.append(self.events.get_nowait());
+            except queue.Empty:
+                return events;
+
+
+    # Waits (up to 'timeout' seconds) for a button event to be queued. Returns
+    # True if there's one waiting
+    def waitForEvent(self, timeout):
+        if (self.events.empty()):
+            self.signal.wait(timeout);
+        self.signal.clear();
+        return not self.events.empty();
+
+
+    # Reads every button's pin, queueing an event for any change the edge
+    # callbacks missed (such as a release that came within DEBOUNCE of the
+    # press, and was taken as a bounce)
+    def poll(self):
+        for i in range(0, len(self.pins)):
+            self.update(i, not GPIO.input(self.pins[i]), time.monotonic());
+
+
+    # ---------------------- GPIO Edge Callbacks ---------------------- #
+    # Called by RPi.GPIO (on its own thread) when a button's pin rises or
+    # falls: reads the button's new state and queues it
+    def edge(self, pin):
+        now = time.monotonic();
+        if (pin in self.pins):
+            self.update(self.pins.index(pin), not GPIO.input(pin), now);
+
 
+    # Helper function that records a button's state at the given time,
+    # queueing an event if it's changed (and isn't a bounce)
+    def update(self, index, pressed, now):
+        with self.lock:
+            if (pressed == self.states[index] or now - self.lastEdges[index] < self.DEBOUNCE):
+                return;
+            self.states[index] = pressed;
+            self.lastEdges[index] = now;
+            self.events.put((index, pressed, now));
+        self.signal.set();
@@ -0,0 +1,268 @@
+import os;
+import sys;
+import sqlite3;
+import argparse;
+import datetime;
+
+# A class that keeps a catalog of the dash cam's media (passive videos,
+# incident clips, images and logs) in an SQLite database, one row per file.
+# Each row holds what the file name can't: when the recording really started
+# (by the wall clock and the monotonic clock), how long it really is, its size,
+# its codec/container, whether it's been converted, whether it's protected
+# from being deleted to make room, and whether it's been uploaded. Rows are
+# written in a transaction as media is started, finished and removed, so
+# questions like "what was recorded between 14:02 and 14:10" don't need a
+# directory walk. Run this file to query the catalog.
+class MediaCatalog:
+
+    # MediaCatalog properties:
+    #   dbPath      The path of the database file
+    #   db          The sqlite3 connection (or None, if the database couldn't
+    #               be opened)
+
+    # MediaCatalog constants:
+    #   SCHEMA      The statements that create the catalog's table and indexes
+    #   MIGRATIONS  A list of (column, statement) tuples: columns added since
+    #               the first catalogs, and the statements that add them
+    #   COLUMNS     The columns returned for each row by the queries
+    #   STATES      The conversion states a row can be in:
+    #                 "recording"   still being written
+    #                 "raw"         finished, in the camera's own format
+    #                 "converted"   converted to a more portable container
+    #                 "failed"      couldn't be converted
+
+    # Constructor: takes the path of the database file, creating it if needed
+    def __init__(self, dbPath):
+        self.SCHEMA = ["CREATE TABLE IF NOT EXISTS media ("
+                       "name TEXT PRIMARY KEY, kind TEXT NOT NULL, seq INTEGER, "
+                       "wall_start REAL, mono_start REAL, duration REAL, "
+                       "bytes INTEGER NOT NULL DEFAULT 0, codec TEXT, container TEXT, "
+                       "state TEXT NOT NULL, protected INTEGER NOT NULL DEFAULT 0, "
+                       "uploaded INTEGER NOT NULL DEFAULT 0)",
+                       "CREATE INDEX IF NOT EXISTS media_start ON media (wall_start)",
+                       "CREATE INDEX IF NOT EXISTS media_kind ON media (kind, seq)"];
+        self.MIGRATIONS = [("uploaded", "ALTER TABLE media ADD COLUMN "
+                            "uploaded INTEGER NOT NULL DEFAULT 0")];
+        self.COLUMNS = ("name", "kind", "seq", "wall_start", "mono_start", "duration",
+                        "bytes", "codec", "container", "state", "protected", "uploaded");
+        self.STATES = ("recording", "raw", "converted", "failed");
+
+        self.dbPath = dbPath;
+        self.db = None;
+        try:
+            self.db = sqlite3.connect(dbPath);
+            # with write-ahead logging, a write is one append (and readers
+            # never block the camera); a power loss can only lose the last
+            # few transactions, never corrupt the database
+            self.db.execute("PRAGMA journal_mode=WAL");
+            self.db.execute("PRAGMA synchronous=NORMAL");
+            with self.db:
+                for statement in self.SCHEMA:
+                    self.db.execute(statement);
+                columns = [row[1] for row in self.db.execute("PRAGMA table_info(media)")];
+                for (column, statement) in self.MIGRATIONS:
+                    if (column not in columns):
+                        self.db.execute(statement);
+        except sqlite3.Error:
+            self.db = None;
+
+
+    # Closes the database
+    def close(self):
+        if (self.db != None):
+            self.db.close();
+            self.db = None;
+
+
+    # ------------------------------ Writing ------------------------------ #
+    # Adds a file to the catalog (replacing any row with the same name). Times
+    # that aren't known can be given as None. Returns False if it couldn't be
+    # written
+    def add(self, name, kind, wallStart = None, monoStart = None, duration = None,
+            size = 0, codec = None, container = None, state = "raw",
+            protected = False, seq = None):
+        return self.execute(["INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                             (name, kind, seq, wallStart, monoStart, duration, size, codec,
+                              container, state, int(protected))]);
+
+
+    # Records that a file has finished being written: its real duration (if
+    # it has one) and size. Returns False if it couldn't be written
+    def finish(self, name, duration, size):
+        return self.execute(["UPDATE media SET duration = ?, bytes = ?, state = 'raw' "
+                             "WHERE name = ? AND state = 'recording'", (duration, size, name)]);
+
+
+    # Adds to the recorded size of a file that keeps growing (such as a log),
+    # adding it to the catalog (as started now) if it isn't there yet
+    def grow(self, name, kind, size):
+        return self.execute(["INSERT OR IGNORE INTO media (name, kind, wall_start, state) "
+                             "VALUES (?, ?, CAST(strftime('%s', 'now') AS REAL), 'raw')",
+                             (name, kind)],
+                            ["UPDATE media SET bytes = bytes + ? WHERE name = ?", (size, name)]);
+
+
+    # Records that a file has been converted to a new container (and renamed)
+    def converted(self, oldName, newName, container, size):
+        return self.execute(["UPDATE media SET name = ?, container = ?, bytes = ?, "
+                             "state = 'converted' WHERE name = ?",
+                             (newName, container, size, oldName)]);
+
+
+    # Sets the conversion state (see STATES) of a file
+    def setState(self, name, state):
+        return self.execute(["UPDATE media SET state = ? WHERE name = ?", (state, name)]);
+
+
+    # Records that a file has been uploaded
+    def setUploaded(self, name):
+        return self.execute(["UPDATE media SET uploaded = 1 WHERE name = ?", (name,)]);
+
+
+    # Removes the files with the given names from the catalog (in one
+    # transaction)
+    def remove(self, names):
+        return self.execute(*[["DELETE FROM media WHERE name = ?", (name,)] for name in names]);
+
+
+    # Brings one kind of media in the catalog in line with what's on disk:
+    # 'sizes' maps the name of every such file on disk to its size. Rows for
+    # files that are gone are removed, files missing from the catalog are added
+    # (with the given codec, and their extension as their container), and
+    # anything left "recording" (by a power loss) is marked finished
+    def reconcile(self, kind, sizes, codec = None, protected = False):
+        if (self.db == None):
+            return False;
+        try:
+            known = set(row[0] for row in self.db.execute(
+                        "SELECT name FROM media WHERE kind = ?", (kind,)));
+        except sqlite3.Error:
+            return False;
+        statements = [["DELETE FROM media WHERE name = ?", (name,)]
+                      for name in known if name not in sizes];
+        for name in sizes:
+            if (name not in known):
+                statements.append(["INSERT INTO media (name, kind, bytes, codec, container, "
+                                   "state, protected) VALUES (?, ?, ?, ?, ?, 'raw', ?)",
+                                   (name, kind, sizes[name], codec,
+                                    os.path.splitext(name)[1][1:], int(protected))]);
+            else:
+                statements.append(["UPDATE media SET bytes = ?, state = CASE state "
+                                   "WHEN 'recording' THEN 'raw' ELSE state END WHERE name = ?",
+                                   (sizes[name], name)]);
+        return self.execute(*statements);
+
+
+    # Helper function that runs each of the given [statement, parameters]
+    # lists in a single transaction. Returns False if it failed (in which case
+    # none of them are applied)
+    def execute(self, *statements):
+        if (self.db == None):
+            return False;
+        try:
+            with self.db:
+                for (statement, parameters) in statements:
+                    self.db.execute(statement, parameters);
+        except sqlite3.Error:
+            return False;
+        return True;
+
+
+    # ------------------------------ Querying ------------------------------ #
+    # Returns the row (as a dictionary, see COLUMNS) of the file with the
+    # given name, or None if it isn't in the catalog
+    def get(self, name):
+        rows = self.query("SELECT * FROM media WHERE name = ?", (name,));
+        if (len(rows) == 0):
+            return None;
+        return rows[0];
+
+
+    # Returns a list of dictionaries (see COLUMNS) for every file whose
+    # footage overlaps the given wall-clock times (in seconds since the epoch),
+    # oldest first. Only files of the given kind are returned, if one is given
+    def between(self, start, end, kind = None):
+        query = ("SELECT * FROM media WHERE wall_start < ? AND "
+                 "wall_start + COALESCE(duration, 0) >= ?");
+        parameters = [end, start];
+        if (kind != None):
+            query += " AND kind = ?";
+            parameters.append(kind);
+        return self.query(query + " ORDER BY wall_start", parameters);
+
+
+    # Returns a list of (day, kind, bytes) tuples giving the total size of the
+    # files recorded on each day, oldest first. (Files with no known start
+    # time are counted under a day of None)
+    def bytesPerDay(self):
+        if (self.db == None):
+            return [];
+        return self.db.execute("SELECT date(wall_start, 'unixepoch', 'localtime') AS day, "
+                               "kind, SUM(bytes) FROM media GROUP BY day, kind "
+                               "ORDER BY day, kind").fetchall();
+
+
+    # Returns the row of the newest finished file of one of the given kinds
+    # that's still in the given container (such as an unconverted "h264"),
+    # or None if there isn't one
+    def nextUnconverted(self, kinds, container):
+        rows = self.query("SELECT * FROM media WHERE state = 'raw' AND container = ? AND "
+                          "kind IN (" + ", ".join("?" * len(kinds)) + ") "
+                          "ORDER BY wall_start DESC LIMIT 1", [container] + list(kinds));
+        if (len(rows) == 0):
+            return None;
+        return rows[0];
+
+
+    # Returns the rows of the files of the given kinds that are ready to be
+    # uploaded, but haven't been: finished, and not still waiting to be
+    # converted out of the given container (such as "h264"). Oldest first
+    def pendingUploads(self, kinds, rawContainer):
+        return self.query("SELECT * FROM media WHERE uploaded = 0 AND state != 'recording' "
+                          "AND NOT (state = 'raw' AND container = ?) AND "
+                          "kind IN (" + ", ".join("?" * len(kinds)) + ") "
+                          "ORDER BY wall_start", [rawContainer] + list(kinds));
+
+
+    # Helper function that runs a query, returning its rows as dictionaries
+    def query(self, query, parameters = ()):
+        if (self.db == None):
+            return [];
+        return [dict(zip(self.COLUMNS, row)) for row in self.db.execute(query, parameters)];
+
+
+# Queries the catalog given on the command line: lists the files recorded
+# between two times, or the bytes recorded each day
+def main(args):
+    from journal import parseTime;
+    parser = argparse.ArgumentParser(description = "Query the dash cam's media catalog");
+    parser.add_argument("catalog", help = "catalog database (catalog.db)");
+    parser.add_argument("--start", type = parseTime, help = "list files recorded from this time on");
+    parser.add_argument("--end", type = parseTime, help = "list files recorded before this time");
+    parser.add_argument("--kind", help = "only list this kind of file (passive, incident, image, log)");
+    parser.add_argument("--days", action = "store_true", help = "print the bytes recorded each day");
+    options = parser.parse_args(args);
+    if (not os.path.isfile(options.catalog)):
+        parser.error("no catalog at " + options.catalog);
+
+    catalog = MediaCatalog(options.catalog);
+    if (options.days):
+        for (day, kind, size) in catalog.bytesPerDay():
+            print("{d:10s}  {k:8s}  {b:14,d} bytes".format(d = str(day), k = kind, b = size));
+        return 0;
+
+    start = options.start if options.start != None else 0.0;
+    end = options.end if options.end != None else float("inf");
+    for row in catalog.between(start, end, options.kind):
+        duration = "";
+        if (row["duration"] != None):
+            duration = "{s:7.1f} s".format(s = row["duration"]);
+        print("{t}  {k:8s}  {n:48s}  {d:9s}  {b:12,d} bytes  {s}{p}".format(
+              t = datetime.datetime.fromtimestamp(row["wall_start"]).strftime("%Y-%m-%d %H:%M:%S"),
+              k = row["kind"], n = row["name"], d = duration, b = row["bytes"],
+              s = row["state"], p = "  (protected)" if row["protected"] else ""));
+    return 0;
+
+
+if (__name__ == "__main__"):
+    sys.exit(main(sys.argv[1:]));
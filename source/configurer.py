@@ -1,23 +1,31 @@
+import time;
+from startup import BootTimer, CameraWarmer;
+# time the startup from here, and start opening the camera right away (the
+# controller, and picamera with it, are only imported once they're needed)
+BOOT_TIMER = BootTimer();
+CAMERA_WARMER = CameraWarmer();
+
 import os;
 import datetime;
 from time import sleep;
-from filer import Filer;
-from dumper import Dumper;
-from lights import LightManager;
-from buttons import ButtonManager;
-from controller import Controller;
-from shutdown import shutdown_pi;
+from modes import ModeMachine;
 
-# A class that launches a "set-up" mode for the dash cam, before actually
-# starting with the passive recording. Allows the users to package and send
-# output, as well as connect to new WiFi networks
+# A class that provides the dash cam's "set-up" modes, run by the ModeMachine
+# before (and between) the passive recording: config, which waits a moment
+# before launching the dash cam; output, which lets the users package and send
+# output; and connect, for connecting to new WiFi networks. The hardware is the
+# ModeMachine's, so nothing is set up again when a mode is entered
 class Configurer:
     
     # Configurer Properties:
+    #   machine     The ModeMachine running the modes
     #   filer       The Filer object used to write logs/package output
     #   lights      The LightManager used for toggling LEDs
     #   buttons     The ButtonManager used for user input
+    #   gestures    The GestureRecognizer that turns the button presses into
+    #               clicks, holds and chords (its times are set by each mode)
     #   dumper      The Dumper object used to dump files to a flash drive
+    #   metrics     The MetricsRegistry the config loops' timings are kept in
     
     # Configurer Constants:
     #   TICK_RATE   The time interval (in seconds) at which the configurer
@@ -25,225 +33,213 @@ class Configurer:
     #   WAIT_TIME   The time the Configurer waits before automatically going
     #               into dash-cam mode (this is in seconds)
     
-    # Constructor
-    def __init__(self):
-        # create the filer, light manager, button manager, and dumper
-        self.filer = Filer();
-        self.lights = LightManager();
-        self.buttons = ButtonManager();
-        self.dumper = Dumper("dashdrive");
+    # Constructor: takes the ModeMachine (whose hardware is used), and adds
+    # the config, output and connect modes to it
+    def __init__(self, machine):
+        self.machine = machine;
+        self.filer = machine.filer;
+        self.lights = machine.lights;
+        self.buttons = machine.buttons;
+        self.gestures = machine.gestures;
+        self.dumper = machine.dumper;
+        self.metrics = machine.metrics;
 
         # create constants
         self.TICK_RATE = 0.125;
         self.WAIT_TIME = 5.0;
-        
-        # try to log a new config session
-        try:
-           self.filer.log("---------- New Config Session: " + str(datetime.datetime.now())
-                        + " ----------\n", True);
-        except:
-            # assume the device's storage is full. Wipe it and try again
-            self.wipeFiles(False);
-            self.__init__();
 
+        machine.addMode("config", self.mainConfig);
+        machine.addMode("output", self.mainOutput);
+        machine.addMode("connect", self.mainConnect);
+
+
+    # Config Mode main function. Returns the next mode: "recording" once the
+    # WAIT_TIME is up, "output" or "connect" if the capture or power button is
+    # clicked, or "shutdown" if both buttons are held
+    def mainConfig(self):
+        # this is the config log (rather than the dash cam's session log)
+        self.filer.logChannel = self.filer.CONFIG_LOG;
+        if (self.machine.previous == "output" or self.machine.previous == "connect"):
+            # flash yellow LED to indicate mode switch
+            self.lights.flashLED([0], 2);
+        else:
+            # make sure the card isn't full (deleting the oldest files if it
+            # is), then log a new config session
+            self.filer.reserveSpace();
+            self.filer.log("---------- New Config Session: " + str(datetime.datetime.now())
+                           + " ----------\n", True);
+            self.filer.log("Configuration mode...\n");
 
-    # Main function
-    def main(self):
         # set up loop variables
         ticks = 0.0;
         tickSeconds = 0.0;
-        
-        # the terminate codes are as follows:
-        #   -1      Don't terminate
-        #    0      Terminate and launch dash cam
-        #    1      Terminate and shut down
-        terminateCode = -1;
-        
-        self.filer.log("Configuration mode...\n");
+        nextMode = None;
+        # a click picks a mode, and holding both buttons shuts down (buttons
+        # still held from the last mode are ignored until they're released)
+        self.gestures.setTimes((1.0, 1.0), 2.0);
+        self.machine.enterMode();
 
         # main loop
-        while (terminateCode < 0):
-            # slowly flash the yellow light (twice every second)
-            self.lights.setLED([0], tickSeconds.is_integer() or
-                               (tickSeconds + 0.5).is_integer());
-            
-            tickString = "[Ticks: {t1:9.2f}]  [Running Time: {t2:9.2f}]";
-            tickString = tickString.format(t1 = ticks, t2 = int(tickSeconds));
-            tickString = "[config]  " + tickString;
-
-            # if the WAIT_TIME has been exceeded, terminate with code 0
-            if (tickSeconds == self.WAIT_TIME):
-                tickString += "  (Wait time exceeded: terminating configuration and launching dash cam...)";
-                terminateCode = 0;
-            
-            # check for user input (red/yellow hold: shut down)
-            if (self.buttons.isPowerPressed() and self.buttons.durations[0] * self.TICK_RATE >= 2.0 and
-                self.buttons.isCapturePressed() and self.buttons.durations[1] * self.TICK_RATE >= 2.0):
-                self.filer.log("Red/Yellow buttons held. Shutting down...");
-                # create a controller and use its shutdown sequence
-                shutdown_pi(self.lights, [self.buttons]);
-            # check for user input (output config)
-            elif (self.buttons.isCapturePressed() and self.buttons.durations[1] * self.TICK_RATE < 1.0 and
-                  self.buttons.durations[1] * self.TICK_RATE >= 0.25 and not self.buttons.isPowerPressed()):
-                self.filer.log("Entering output config...\n");
-                # disable yellow LED
-                self.lights.setLED([0], False);
-                self.mainOutput();
+        nextTick = time.monotonic();
+        while (nextMode == None):
+            loopStart = time.monotonic();
+            # tick, once every TICK_RATE
+            if (loopStart >= nextTick):
+                # slowly flash the yellow light (twice every second)
+                self.lights.setLED([0], tickSeconds.is_integer() or
+                                   (tickSeconds + 0.5).is_integer());
                 
-                # reset button durations (so shutdown doesn't trigger)
-                self.buttons.durations = [0, 0];
-                # reset the ticks/tickSeconds
-                ticks = 0.0;
-                tickSeconds = 0.0;
-                # flash yellow LED to indicate mode switch
-                self.lights.flashLED([0], 2);
-            # check for user input (connect config)
-            elif (self.buttons.isPowerPressed() and self.buttons.durations[0] * self.TICK_RATE < 1.0 and
-                  self.buttons.durations[0] * self.TICK_RATE >= 0.25 and not self.buttons.isCapturePressed()):
-                self.filer.log("Entering connect config...\n");
-                # disable yellow LED
-                self.lights.setLED([0], False);
-                self.mainConnect();
+                tickString = "[Ticks: {t1:9.2f}]  [Running Time: {t2:9.2f}]";
+                tickString = tickString.format(t1 = ticks, t2 = int(tickSeconds));
+                tickString = "[config]  " + tickString;
 
-                # reset button durations (so shutdown doesn't trigger)
-                self.buttons.durations = [0, 0];
-                # reset the ticks/tickSeconds
-                ticks = 0.0;
-                tickSeconds = 0.0;
-                # flash yellow LED to indicate mode switch
-                self.lights.flashLED([0], 2);
+                # if the WAIT_TIME has been exceeded, launch the dash cam
+                if (tickSeconds == self.WAIT_TIME):
+                    tickString += "  (Wait time exceeded: terminating configuration and launching dash cam...)";
+                    nextMode = "recording";
 
-            # only log the tickString if the ticks are currently on a second
-            if (tickSeconds.is_integer()):
-                self.filer.log(tickString + "\n");
+                # only log the tickString if the ticks are currently on a second
+                if (tickSeconds.is_integer()):
+                    self.filer.log(tickString + "\n");
 
-            # update the ticks
-            ticks += 1;
-            tickSeconds += self.TICK_RATE;
-            # sleep for one TICK_RATE
-            sleep(self.TICK_RATE);
-        
-        # the loop was terminated: determine why
-        if (terminateCode == 0):
-            # force GPIO-using classes to clean up
-            self.lights.__del__();
-            self.buttons.__del__();
+                # update the ticks
+                ticks += 1;
+                tickSeconds += self.TICK_RATE;
+                nextTick = max(nextTick + self.TICK_RATE, loopStart);
+            
+            # check for user input (as soon as it comes in)
+            for gesture in self.gestures.update():
+                # red/yellow hold: shut down
+                if (gesture.kind == "chord"):
+                    self.filer.log("Red/Yellow buttons held. Shutting down...\n");
+                    nextMode = "shutdown";
+                    break;
+                # capture click: output config
+                elif (gesture.kind == "click" and gesture.button == self.buttons.CAPTURE):
+                    self.filer.log("Entering output config...\n");
+                    nextMode = "output";
+                    break;
+                # power click: connect config
+                elif (gesture.kind == "click" and gesture.button == self.buttons.POWER):
+                    self.filer.log("Entering connect config...\n");
+                    nextMode = "connect";
+                    break;
 
+            # record how long the loop's work took
+            self.recordTick("config", loopStart);
+            # sleep until the next tick (or a button press)
+            if (nextMode == None):
+                self.waitTick(nextTick);
+        
+        # disable yellow LED
+        self.lights.setLED([0], False);
+        # the loop was terminated: note the end of the session if the config
+        # menus are being left
+        if (nextMode == "recording" or nextMode == "shutdown"):
             self.filer.log("--------- Config Session Ended: " + str(datetime.datetime.now())
                                            + " ---------\n\n", True);
-            # create a controller to launch the dash cam
-            cont = Controller();
-            cont.main();
+            if (self.machine.controller == None):
+                self.machine.bootTimer.mark("config window");
+        return nextMode;
 
 
-    # Output Mode main function
+    # Output Mode main function. Returns "config" once both buttons have been
+    # held and released
     def mainOutput(self):
         # set up loop variables
         ticks = 0.0;
         tickSeconds = 0.0;
-        # terminate codes are as follows:
-        #   -1      Don't terminate
-        #    0      Terminate and return to config
-        terminateCode = -1;
+        nextMode = None;
+        # a click packages/converts, a hold (past 1.5 seconds) dumps/wipes,
+        # and holding then releasing both buttons goes back
+        self.gestures.setTimes((1.5, 1.5), 1.5);
+        self.machine.enterMode();
         
         # main loop
-        while (terminateCode < 0):
-            # slowly flash the red/blue lights (twice every second)
-            self.lights.setLED([1, 2], tickSeconds.is_integer() or
-                               (tickSeconds + 0.5).is_integer());
-            
-            # create a tick string
-            tickString = "[Ticks: {t1:9.2f}]  [Running Time: {t2:9.2f}]";
-            tickString = tickString.format(t1 = ticks, t2 = int(tickSeconds));
-            tickString = "[config-output]  " + tickString;
-            
-            # get button durations before updating them
-            captureDuration = self.buttons.durations[1];
-            powerDuration = self.buttons.durations[0];
-            # call the button methods to update the button durations
-            self.buttons.isCapturePressed();
-            self.buttons.isPowerPressed();
+        nextTick = time.monotonic();
+        while (nextMode == None):
+            loopStart = time.monotonic();
+            # tick, once every TICK_RATE
+            if (loopStart >= nextTick):
+                # slowly flash the red/blue lights (twice every second)
+                self.lights.setLED([1, 2], tickSeconds.is_integer() or
+                                   (tickSeconds + 0.5).is_integer());
+                
+                # create a tick string, and log it if the tick is on a second
+                tickString = "[Ticks: {t1:9.2f}]  [Running Time: {t2:9.2f}]";
+                tickString = tickString.format(t1 = ticks, t2 = int(tickSeconds));
+                tickString = "[config-output]  " + tickString;
+                if (tickSeconds.is_integer()):
+                    self.filer.log(tickString + "\n");
 
-            # check for red AND yellow button duration
-            if (captureDuration > 0.0 and captureDuration < ticks and
-                powerDuration > 0.0 and powerDuration < ticks):
-                # if the buttons are released, go back
-                if (not self.buttons.isCapturePressed() and
-                    not self.buttons.isPowerPressed()):
-                    tickString += "  (Capture/Power buttons were held)";
-                    terminateCode = 0;
-            # check for red button duration
-            elif (captureDuration > 0.0 and captureDuration < ticks and
-                  powerDuration == 0.0):
+                # update ticks
+                ticks += 1;
+                tickSeconds += self.TICK_RATE;
+                nextTick = max(nextTick + self.TICK_RATE, loopStart);
+            
+            for gesture in self.gestures.update():
+                # check for red AND yellow buttons: once they're both
+                # released, go back
+                if (gesture.kind == "chord-release"):
+                    self.filer.log("[config-output]  (Capture/Power buttons were held)\n");
+                    nextMode = "config";
+                    break;
                 # flash at 1.5 seconds (and still being held down) to indicate
-                # that files will be sent to the flash drive upon button release
-                if (captureDuration * self.TICK_RATE >= 1.5 and
-                    (captureDuration * self.TICK_RATE) - 1.5 <= self.TICK_RATE and
-                    self.buttons.isCapturePressed()):
+                # that files will be sent to the flash drive (red button), or
+                # deleted (yellow button), upon button release
+                elif (gesture.kind == "held"):
                     self.lights.setLED([1, 2], False);
                     self.lights.flashLED([0], 1);
-                
-                # if the button is released...
-                if (not self.buttons.isCapturePressed()):
-                    # if released under 1.5 seconds, package output
-                    if (captureDuration * self.TICK_RATE < 1.5):
-                        # disable all lights
-                        self.lights.setLED([0, 1, 2], False);
-                        # package the output
-                        self.filer.packageOutput("output.zip", self.lights);
-                    # otherwise, dump to flash drive
-                    elif (captureDuration * self.TICK_RATE >= 1.5):
-                        # disable all lights
-                        self.lights.setLED([0, 1, 2], False);
-                        # dump output to flash drive, if it's plugged in
-                        if (self.dumper.driveExists()):
-                            self.filer.log("Drive found. Dumping files...\n");
-                            self.lights.setLED([2], True);
-                            # dump files
-                            self.dumper.dumpToDrive(self.filer);
-                            # flash the blue/red lights to show success
-                            self.lights.flashLED([1, 2], 3);
-                        # otherwise, flash red light to show the drive wasn't found
-                        else:
-                            self.filer.log("Drive not found. Cannot dump files.\n");
-                            self.lights.flashLED([1], 3);
-            # check for yellow button (convert videos)
-            elif (powerDuration > 0.0 and powerDuration < ticks and
-                  captureDuration == 0.0):
-                # flash at 1.5 seconds (if the button is still held) to indicate
-                # that files will be deleted upon button release
-                if (powerDuration * self.TICK_RATE >= 1.5 and
-                    (powerDuration * self.TICK_RATE) - 1.5 <= self.TICK_RATE and
-                    self.buttons.isPowerPressed()):
-                    self.lights.setLED([1, 2], False);
-                    self.lights.flashLED([0], 1);
-
-                # if the button is released
-                if (not self.buttons.isPowerPressed()):
-                    # if released under 1.5 seconds, convert the videos
-                    if (powerDuration * self.TICK_RATE < 1.5):
-                        self.lights.setLED([0, 1, 2], False);
-                        # convert videos to mp4
-                        self.filer.convertVideos(self.lights);
-                    # otherwise, delete the output
-                    elif (powerDuration * self.TICK_RATE >= 1.5):
-                        self.wipeFiles();
+                    continue;
+                # red button released under 1.5 seconds: package the output
+                # that's new since the last package (into its own archive)
+                elif (gesture.kind == "click" and gesture.button == self.buttons.CAPTURE):
+                    # disable all lights
+                    self.lights.setLED([0, 1, 2], False);
+                    # package the output
+                    self.filer.packageOutput(self.filer.nextPackageName(), self.lights, True);
+                # red button released after 1.5 seconds: dump to flash drive
+                elif (gesture.kind == "hold" and gesture.button == self.buttons.CAPTURE):
+                    # disable all lights
+                    self.lights.setLED([0, 1, 2], False);
+                    # dump output to flash drive, if it's plugged in
+                    if (self.dumper.driveExists()):
+                        self.filer.log("Drive found. Dumping files...\n");
+                        self.lights.setLED([2], True);
+                        # dump files
+                        self.dumper.dumpToDrive(self.filer);
+                        # flash the blue/red lights to show success
+                        self.lights.flashLED([1, 2], 3);
+                    # otherwise, flash red light to show the drive wasn't found
+                    else:
+                        self.filer.log("Drive not found. Cannot dump files.\n");
+                        self.lights.flashLED([1], 3);
+                # yellow button released under 1.5 seconds: convert the videos
+                elif (gesture.kind == "click" and gesture.button == self.buttons.POWER):
+                    self.lights.setLED([0, 1, 2], False);
+                    # convert videos to mp4
+                    self.filer.convertVideos(self.lights);
+                # yellow button released after 1.5 seconds: delete the output
+                elif (gesture.kind == "hold" and gesture.button == self.buttons.POWER):
+                    self.wipeFiles();
+                else:
+                    continue;
 
-            # log tick string if the tick is on a second
-            if (tickSeconds.is_integer()):
-                self.filer.log(tickString + "\n");
+                # drop anything pressed while that ran
+                self.gestures.reset();
+                break;
 
-            # update ticks
-            ticks += 1;
-            tickSeconds += self.TICK_RATE;
-            # sleep for one TICK_RATE
-            sleep(self.TICK_RATE);
+            # record how long the loop's work took
+            self.recordTick("config-output", loopStart);
+            # sleep until the next tick (or a button press)
+            if (nextMode == None):
+                self.waitTick(nextTick);
         
         # print termination message
-        if (terminateCode == 0):
-            self.filer.log("Returning to config...\n");
-            # disable blue/red LEDs
-            self.lights.setLED([1, 2], False);
+        self.filer.log("Returning to config...\n");
+        # disable blue/red LEDs
+        self.lights.setLED([1, 2], False);
+        return nextMode;
 
     
     # Helper function for mainOutput() that wipes all media files from the device.
@@ -258,10 +254,12 @@ class Configurer:
         # invoke system commands to wipe the media/log files
         os.system("sudo rm -rf ../logs");
         os.system("sudo rm -rf ../media");
+        os.system("sudo rm -rf ../packages");
         sleep(7);   # sleep for a short time before attempting anything else
         # since the current log file was destroyed, write to
         # a new one stating what happened
         self.filer.checkDirectories();
+        self.filer.reindex();
         self.filer.log("[config-output]  Wiping all output files...\n");
         
         if (toggleLights):
@@ -271,50 +269,82 @@ class Configurer:
             self.lights.setLED([1, 2], False);
 
     
-    # Connect Mode main function
+    # Helper function that records how long one iteration of a config loop
+    # took (from 'loopStart' until now), counting it as an overrun if it took
+    # longer than TICK_RATE
+    def recordTick(self, mode, loopStart):
+        loopTime = time.monotonic() - loopStart;
+        labels = {"mode": mode};
+        self.metrics.histogram("config_loop_seconds",
+            "Time spent on the work in each config loop iteration",
+            labels).observe(loopTime);
+        overruns = self.metrics.counter("config_tick_overruns_total",
+            "Config loop iterations whose work took longer than TICK_RATE", labels);
+        if (loopTime > self.TICK_RATE):
+            overruns.inc();
+
+
+    # Helper function that sleeps until 'nextTick' (a monotonic time), waking
+    # up early if a button is pressed or released, so it's acted on right away
+    def waitTick(self, nextTick):
+        self.buttons.waitForEvent(max(0.0, nextTick - time.monotonic()));
+
+
+    # Connect Mode main function. Returns "config" once both buttons have
+    # been held
     def mainConnect(self):
         # set up loop variables
         ticks = 0.0;
         tickSeconds = 0.0;
-        # terminate codes are as follows:
-        #   -1      Don't terminate
-        #    0      Terminate and return to config
-        terminateCode = -1;
+        nextMode = None;
+        # holding both buttons goes back
+        self.gestures.setTimes((1.0, 1.0), 1.0);
+        self.machine.enterMode();
 
         # main loop
-        while (terminateCode < 0):
-            # slowly flash the blue/yellow lights (twice every second)
-            self.lights.setLED([0, 2], tickSeconds.is_integer() or
-                               (tickSeconds + 0.5).is_integer());
+        nextTick = time.monotonic();
+        while (nextMode == None):
+            loopStart = time.monotonic();
+            # tick, once every TICK_RATE
+            if (loopStart >= nextTick):
+                # slowly flash the blue/yellow lights (twice every second)
+                self.lights.setLED([0, 2], tickSeconds.is_integer() or
+                                   (tickSeconds + 0.5).is_integer());
 
-            # create tick string
-            tickString = "[Ticks: {t1:9.2f}]  [Running Time: {t2:9.2f}]";
-            tickString = tickString.format(t1 = ticks, t2 = int(tickSeconds));
-            tickString = "[config-connect]  " + tickString;
+                # create tick string, and log it if the tickSeconds is on a
+                # second
+                tickString = "[Ticks: {t1:9.2f}]  [Running Time: {t2:9.2f}]";
+                tickString = tickString.format(t1 = ticks, t2 = int(tickSeconds));
+                tickString = "[config-connect]  " + tickString;
+                if (tickSeconds.is_integer()):
+                    self.filer.log(tickString + "\n");
 
-            # check for red/yellow button hold (back to config)
-            if (self.buttons.isCapturePressed() and self.buttons.durations[1] * self.TICK_RATE >= 1.0
-            and self.buttons.isPowerPressed() and self.buttons.durations[0] * self.TICK_RATE >= 1.0):
-                tickString += "  (Capture/Power buttons were held)";
-                terminateCode = 0;
+                # update ticks
+                ticks += 1;
+                tickSeconds += self.TICK_RATE;
+                nextTick = max(nextTick + self.TICK_RATE, loopStart);
 
-            # log the tick string if the tickSeconds is on a second
-            if (tickSeconds.is_integer()):
-                self.filer.log(tickString + "\n");
+            # check for red/yellow button hold (back to config)
+            for gesture in self.gestures.update():
+                if (gesture.kind == "chord"):
+                    self.filer.log("[config-connect]  (Capture/Power buttons were held)\n");
+                    nextMode = "config";
 
-            # update ticks
-            ticks += 1;
-            tickSeconds += self.TICK_RATE;
-            # sleep for one TICK_RATE
-            sleep(self.TICK_RATE);
+            # record how long the loop's work took
+            self.recordTick("config-connect", loopStart);
+            # sleep until the next tick (or a button press)
+            if (nextMode == None):
+                self.waitTick(nextTick);
         
         # print termination message
-        if (terminateCode == 0):
-            self.filer.log("Returning to config...\n");
-            # disable blue/yellow LEDs
-            self.lights.setLED([0, 2], False);
+        self.filer.log("Returning to config...\n");
+        # disable blue/yellow LEDs
+        self.lights.setLED([0, 2], False);
+        return nextMode;
 
 
-# run the configurer
-config = Configurer();
-config.main();
+# set up the hardware (just once: every mode shares it), and run the modes,
+# starting with config
+machine = ModeMachine(BOOT_TIMER, CAMERA_WARMER);
+config = Configurer(machine);
+machine.run("config");
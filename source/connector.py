@@ -1,6 +1,6 @@
 import os;
 import requests;
-from urllib import urlopen;
+from netprobe import ConnectivityProber;
 
 # A class responsible for connecting to WiFi and doing a few other WiFi-related
 # tasks for the dash cam
@@ -9,22 +9,21 @@ class Connector:
     # Connector properties
     #   netName         The name of the WiFi network to connect to
     #   netPassword     The password for the WiFi network to connect to
+    #   prober          The ConnectivityProber used to check the connection
     
-    # Constructor
-    def __init__(self):
+    # Constructor: takes an optional ConnectivityProber to share
+    def __init__(self, prober = None):
         self.netName = "";
         self.netPassword = "";
+        self.prober = prober;
+        if (self.prober == None):
+            self.prober = ConnectivityProber();
     
 
-    # Function that checks to see if a WiFi network is connected. If so,
-    # True is returned, and the Connector's net details are updated
+    # Function that checks to see if the internet can be reached. Returns a
+    # boolean accordingly (this never takes longer than the prober's TIMEOUT)
     def isConnected(self):
-        # try establishing a connection
-        try:
-            urlopen("http://www.vt.edu/");
-            return True;
-        except:
-            return False;
+        return self.prober.check();
 
     
     # Helper function that, if the pi is connected to the internet, sends
@@ -42,8 +41,9 @@ class Connector:
             webhook["value2"] = "";
             webhook["value3"] = "";
             requests.post("https://maker.ifttt.com/trigger/wrivcam_send_ip/with/key/dbVJgqzMlbjyxsTd5DuoRv",
-                          data = webhook);
+                          data = webhook, timeout = 10.0);
 
 
-c = Connector();
-c.sendIPAddress();
+if (__name__ == "__main__"):
+    c = Connector();
+    c.sendIPAddress();
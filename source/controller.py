@@ -1,15 +1,24 @@
 import datetime;
-import os;
 import time;
-from time import sleep;
+from scheduler import Scheduler;
+from segments import SegmentIndex;
+from thermal import ThermalSampler, ThermalGovernor;
+import metrics;
+from incident import IncidentRecorder;
+from remux import RemuxWorker;
+from dumper import Dumper;
+from uploader import UploadQueue;
+from netprobe import ConnectivityProber;
 from dashcam import DashCam;
 from filer import Filer;
 from lights import LightManager;
 from buttons import ButtonManager;
-from shutdown import shutdown_pi;
+from gestures import GestureRecognizer;
 
 # The main runner class for the program. Handles Camera interaction, file
-# saving/deletion, and other input/output
+# saving/deletion, and other input/output. This is the ModeMachine's
+# recording mode: main() can be run again each time the mode is entered,
+# and leaves the camera open (just not recording) when it returns
 class Controller:
     
     # Controller properties:
@@ -17,45 +26,184 @@ class Controller:
     #   filer        The Filer object responsible for managing system files
     #   lights       The LightManager object used for toggling LEDs
     #   buttons      The ButtonManager used to sense button presses
+    #   gestures     The GestureRecognizer that turns the presses into clicks,
+    #                holds and chords
+    #   scheduler    The Scheduler that runs the main loop's duties
+    #   thermals     The ThermalSampler used to read the CPU temperature
+    #   governor     The ThermalGovernor deciding how to respond to the heat
+    #   metrics      The MetricsRegistry the main loop's timings are kept in
+    #   incidents    The IncidentRecorder holding the last few seconds of
+    #                footage, saved when the capture button is held
+    #   lastCPUTemp  The most recent CPU temperature reading
+    #   remux        The RemuxWorker converting finished videos to .mp4 in
+    #                the background
+    #   maxLoopTime  The longest main loop iteration (in seconds) since the
+    #                last tick was written to the journal
+    #   lastLoopTime The length (in seconds) of the last main loop iteration
+    #   bootTimer    The BootTimer timing the startup phases (or None, once
+    #                the first session has started)
+    #   dumper       The Dumper that dumps the output onto the flash drive (in
+    #                the background) when it's plugged in
+    #   uploader     The UploadQueue that uploads finished media over the home
+    #                Wi-Fi (in the background)
+    #   prober       The ConnectivityProber watching (on its own thread) for
+    #                the upload server becoming reachable or unreachable
+    #   netEvents    A list of the reachable/unreachable changes the prober
+    #                has reported since the last tick
     
     # Controller constants:
     #   TICK_RATE    The time interval (in seconds) at which the system ticks
     #                to check for/make updates
     #   PASSIVE_LEN  The length (in seconds) of the dash cam's passive videos
+    #   LOG_RATE     The time interval (in seconds) at which the dash cam's
+    #                state is written to the telemetry journal
+    #   STATS_RATE   The time interval (in seconds) at which the scheduler's
+    #                timing statistics are written to the log
+    #   STORAGE_RATE The time interval (in seconds) at which the storage budget
+    #                is checked, deleting old files ahead of need
+    #   INCIDENT_HOLD  The time (in seconds) the capture button must be held
+    #                to save an incident clip (rather than take a picture)
+    #   REMUX_TEMP   The CPU temperature at which background conversions are
+    #                held (until it cools down)
+    #   REMUX_LATENCY  The main loop iteration time (in seconds) past which
+    #                background conversions are held
+    #   DRIVE_RATE   The time interval (in seconds) at which the flash drive
+    #                is looked for
+    #   DUMP_RATE    The most bytes per second a background dump may copy
+    #   UPLOAD_URL   The base URL of the server media is uploaded to
+    #   HOME_SSID    The name of the Wi-Fi network uploads run on
+    #   UPLOAD_CAP   The most bytes per second uploads may send
+    #   UPLOAD_RATE  The time interval (in seconds) at which finished media is
+    #                queued to be uploaded
     
-    # Constructor
-    def __init__(self):
+    # Constructor: takes an optional (already opened) camera, Filer, light
+    # manager, button manager, Dumper and GestureRecognizer to share, such as
+    # the ModeMachine's, so nothing is set up twice. Anything not given is
+    # created. An optional BootTimer is given the time each startup phase took
+    def __init__(self, camera = None, filer = None, lights = None, buttons = None,
+                 bootTimer = None, dumper = None, gestures = None):
+        self.bootTimer = bootTimer;
         # create a camera
-        self.camera = DashCam();
-        # create a Filer
-        self.filer = Filer();
-        # create a light manager and turn on the power LED
-        self.lights = LightManager();
-        self.lights.setLED([0], True);
+        self.camera = camera;
+        if (self.camera == None):
+            self.camera = DashCam();
+        # create a Filer (and write to the session log)
+        self.filer = filer;
+        if (self.filer == None):
+            self.filer = Filer();
+        # create a light manager
+        self.lights = lights;
+        if (self.lights == None):
+            self.lights = LightManager();
         # create a button manager
-        self.buttons = ButtonManager();
+        self.buttons = buttons;
+        if (self.buttons == None):
+            self.buttons = ButtonManager();
+        # create the temperature sampler and the governor that throttles
+        # the camera when it gets too hot
+        self.thermals = ThermalSampler();
+        self.governor = ThermalGovernor(self.camera.getProfile());
+        # create the incident recorder, fed by the camera's encoder
+        self.incidents = IncidentRecorder(self.filer.incidentPath, self.camera.bitrate);
+        self.camera.incidents = self.incidents;
+        # create the worker that converts finished videos in the background
+        self.remux = RemuxWorker();
+        # create the dumper that watches for the flash drive
+        self.dumper = dumper;
+        if (self.dumper == None):
+            self.dumper = Dumper("dashdrive");
         
         
         # create constants
         self.TICK_RATE = 0.125;
         self.PASSIVE_LEN = 10.0 * 60;
+        self.LOG_RATE = 1.0;
+        self.STATS_RATE = 60.0;
+        self.STORAGE_RATE = 30.0;
+        self.INCIDENT_HOLD = 1.0;
+        self.REMUX_TEMP = 70.0;
+        self.REMUX_LATENCY = self.TICK_RATE / 2.0;
+        self.DRIVE_RATE = 1.0;
+        self.DUMP_RATE = 4 * 1000 * 1000;
+        self.UPLOAD_URL = "http://dashhome.local:8080/";
+        self.HOME_SSID = "dashhome";
+        self.UPLOAD_CAP = 2 * 1000 * 1000;
+        self.UPLOAD_RATE = 5.0;
+        self.lastCPUTemp = 0.0;
+        self.maxLoopTime = 0.0;
+        self.lastLoopTime = 0.0;
+
+        # create the recognizer that reads the buttons as gestures
+        self.gestures = gestures;
+        if (self.gestures == None):
+            self.gestures = GestureRecognizer(self.buttons);
 
-        # log that a new session has begun
+        # create the prober that watches for the upload server (on the home
+        # network), and the queue that uploads media once the car's home
+        self.prober = ConnectivityProber.forUrl(self.UPLOAD_URL);
+        self.netEvents = [];
+        self.prober.addListener(self.netEvents.append);
+        self.uploader = UploadQueue(self.UPLOAD_URL, self.HOME_SSID, self.UPLOAD_CAP,
+                                    self.prober);
+
+        # set up the metrics, and publish them on the loopback endpoint
+        self.metrics = metrics.REGISTRY;
+        self.loopTimings = self.metrics.histogram("dashcam_loop_seconds",
+            "Time spent running due duties in each main loop iteration");
+        self.waitTimings = self.metrics.histogram("dashcam_wait_recording_seconds",
+            "Time spent in wait_recording between main loop iterations");
+        self.tickOverruns = self.metrics.counter("dashcam_tick_overruns_total",
+            "Main loop iterations whose duties took longer than TICK_RATE");
+        self.splitGaps = self.metrics.histogram("dashcam_split_gap_seconds",
+            "Footage lost (beyond one frame interval) at each segment split");
+        self.splitFrames = self.metrics.counter("dashcam_split_lost_frames_total",
+            "Frames lost at segment splits");
+        self.stillLatency = self.metrics.histogram("dashcam_still_latency_seconds",
+            "Time from the start of a picture's capture until it's on disk");
+        self.stillFrames = self.metrics.counter("dashcam_still_lost_frames_total",
+            "Recorded frames lost while pictures were captured");
+        self.metrics.gauge("dashcam_segments", "Passive video segments on disk",
+            func = lambda: self.filer.segments.count());
+        self.metrics.gauge("dashcam_free_bytes", "Free space on the media card",
+            func = lambda: self.filer.getFreeSpace());
+        self.metrics.gauge("dashcam_cpu_temp_celsius", "Latest CPU temperature",
+            func = lambda: self.lastCPUTemp);
+        metrics.SERVER.start();
+        
+    
+    # Main process function. Records until the dash cam is told to stop, then
+    # stops recording and returns the terminate code (see below). It's called
+    # once per session, and 'started' (if given) is called once the recording
+    # has started
+    def main(self, started = None):
+        # log that a new session has begun (in the session log), and turn on
+        # the power LED
+        self.filer.logChannel = self.filer.SESSION_LOG;
         self.filer.log("---------- New Session: " + str(datetime.datetime.now())
                        + " ----------\n", True);
-        
-        
-    # Destructor
-    def __del__(self):        
-        # log that the session has ended
-        self.filer.log("--------- Session Ended: " + str(datetime.datetime.now())
-                       + " ---------\n\n", True);
+        self.lights.setLED([0], True);
+        # read the buttons as gestures: holding power (or both buttons) stops
+        # the dash cam, and holding capture saves an incident. (Buttons still
+        # held from the last mode are ignored until they're released)
+        self.gestures.setTimes((2.0, self.INCIDENT_HOLD), 2.0);
+        # start (or restart) the network prober and uploads
+        self.prober.start();
+        self.uploader.start();
 
-    
-    # Main process function. Loops indefinitely until the program is terminated
-    def main(self):        
         # start passively recording
+        if (self.bootTimer != None):
+            self.bootTimer.mark("controller");
         self.passiveRecording(1);
+        if (started != None):
+            started();
+        if (self.bootTimer != None):
+            # note how long it took to get the first frame recorded (this is
+            # only done for the first session after boot)
+            if (not self.camera.waitForFirstFrame()):
+                self.filer.log("No frame recorded yet!\n");
+            self.bootTimer.mark("first frame");
+            self.filer.log("[startup]  " + self.bootTimer.getSummary() + "\n");
+            self.bootTimer = None;
         
         # termination code: used to help determine why the main loop
         # was broken (could be the power button, could be too hot
@@ -63,147 +211,310 @@ class Controller:
         #   -1  =  not terminated
         #    0  =  CPU is too hot
         #    1  =  power button was pressed
-        #    2  =  debug terminate (exit program but keep pi powered on)
-        terminateCode = -1;
+        #    2  =  power button was held (go back to config mode, keeping the
+        #          pi powered on)
+        self.terminateCode = -1;
+        
+        # set up the scheduler: every duty gets its own period, and the main
+        # loop only wakes up when the next one is due
+        self.tickEvents = "";
+        self.scheduler = Scheduler(registry = self.metrics);
+        self.scheduler.addDuty("buttons", self.TICK_RATE, self.checkButtons);
+        self.scheduler.addDuty("overlay", self.TICK_RATE, self.refreshOverlay);
+        self.scheduler.addDuty("thermal", 1.0, self.checkTemperature);
+        self.scheduler.addDuty("rolling", 1.0, self.toggleRolling);
+        self.scheduler.addDuty("split", self.PASSIVE_LEN, self.splitPassive,
+                               self.PASSIVE_LEN);
+        self.scheduler.addDuty("log", self.LOG_RATE, self.logTick);
+        self.scheduler.addDuty("remux", self.TICK_RATE, self.convertInBackground);
+        self.scheduler.addDuty("drive", self.DRIVE_RATE, self.watchDrive);
+        self.scheduler.addDuty("upload", self.UPLOAD_RATE, self.queueUploads);
+        self.scheduler.addDuty("storage", self.STORAGE_RATE, self.checkStorage,
+                               self.STORAGE_RATE);
+        self.scheduler.addDuty("stats", self.STATS_RATE, self.logStats,
+                               self.STATS_RATE);
         
         # --------------- main loop --------------- #
-        ticks = 0.0;
-        tickSeconds = 0.0;
-        tickPrintRate = 1; # logs the tickString every 'tickPrintRate' seconds
-        terminate = False;
-        while (not terminate):
-            tickOnSecond = tickSeconds.is_integer();
-            # write a tick string to be printed to the log
-            tickString = "Tick: {t1:9.2f}  |  Running Time: {t2:9.2f}";
-            tickString = tickString.format(t1 = ticks, t2 = int(tickSeconds));
-            tickHeader = "[dashcam]  ";
-            tickHeader += "[LED: " + (str(self.lights.states[0]) +
-                                      str(self.lights.states[1]) +
-                                      str(self.lights.states[2])) + "]  ";
-            tickHeader += "[Button: " + (str(int(self.buttons.durations[0] * self.TICK_RATE)) + "|" +
-                                         str(int(self.buttons.durations[1] * self.TICK_RATE)) + "]  ");
-            tickString = tickHeader + tickString;
-            
-            # check the CPU temperature (terminate if needed)
-            if (tickOnSecond):
-                cpuTemp = self.getCPUTemp();
-                terminate = cpuTemp > 80.0;
-                # add to the tick string
-                tickString += "  [CPU Temp: " + str(cpuTemp) + "]";
-                # if the temperature exceeds the threshold, stop the program
-                terminate = cpuTemp > 80;
-                if (terminate):
-                    self.filer.log("CPU running too hot! Shutting down...");
-                    terminateCode = 0;
-            
-            # perform any mode actions needed
-            tickString += self.update(ticks, tickSeconds);
-
-            # grab the initial button durations
-            powerDuration = self.buttons.durations[0];
-            captureDuration = self.buttons.durations[1];
-            # call the button-detection methods to update their durations
-            self.buttons.isPowerPressed();
-            self.buttons.isCapturePressed();
-
-            # check for both buttons being pressed
-            if (self.buttons.isPowerPressed() and powerDuration * self.TICK_RATE >= 2.0
-            and self.buttons.isCapturePressed() and captureDuration * self.TICK_RATE >= 2.0):
-                # terminate and shut down
-                terminate = True;
-                terminateCode = 1;
-            # check for power button press
-            elif (self.buttons.isPowerPressed() and powerDuration * self.TICK_RATE >= 2.0 and
-              not self.buttons.isCapturePressed()):
-                # terminate but don't shut down
-                terminate = True;
-                terminateCode = 2;
-            # check for capture button press (TAKE PICTURE)
-            elif (captureDuration * self.TICK_RATE <= 2.0 and
-                  captureDuration * self.TICK_RATE > 0.0 and
-                  not self.buttons.isCapturePressed()):
-                self.filer.log("Capturing image..."); 
-                # flash LED and take picture
-                self.lights.flashLED([1], 2);
-                self.camera.takePicture(Filer.makeFileName(1), self.filer.imagePath);
-            
-            # update the camera's overlay text
-            if (self.camera.currVideo != None):                
-                self.camera.updateOverlays(datetime.datetime.now());
-                self.camera.currVideo.duration += self.TICK_RATE;
-            
-            # sleep for one tick rate
-            self.camera.picam.wait_recording(self.TICK_RATE);
-            # log the tick string
-            if (tickSeconds % tickPrintRate == 0):
-                self.filer.log(tickString + "\n");
-            # increment ticks
-            ticks += 1;
-            tickSeconds += self.TICK_RATE;
+        while (self.terminateCode < 0):
+            # run whatever's due, then sleep until the next duty (waiting on
+            # the camera so any recording errors are raised here)
+            loopStart = time.monotonic();
+            wait = self.scheduler.runPending();
+            loopTime = time.monotonic() - loopStart;
+            self.loopTimings.observe(loopTime);
+            self.maxLoopTime = max(self.maxLoopTime, loopTime);
+            self.lastLoopTime = loopTime;
+            if (loopTime > self.TICK_RATE):
+                self.tickOverruns.inc();
+            if (self.terminateCode < 0):
+                # sleep until the next duty, but wake up for a button press
+                # so it's acted on right away (rather than at the next tick)
+                waitStart = time.monotonic();
+                if (self.buttons.waitForEvent(wait)):
+                    self.checkButtons(None);
+                self.camera.picam.wait_recording(0);
+                self.waitTimings.observe(time.monotonic() - waitStart);
         # ----------------------------------------- #
 
-        self.filer.log("Terminate Code: " + str(terminateCode) + "\n"); 
-        # check terminate code: shutdown if needed
-        if (terminateCode == 0 or terminateCode == 1):
+        # stop any background conversion or dump (they're picked up again
+        # next time)
+        self.remux.stop();
+        self.dumper.stopDump();
+        self.uploader.stop();
+        self.prober.stop();
+        # stop recording (the camera stays open, for the next session)
+        self.filer.log("Stopping passive recording...\n");
+        self.filer.videoClosed(self.camera.stopVideo());
+        self.filer.journal.flush();
+        self.filer.log(self.scheduler.getStats() + "\n");
+        self.filer.log("Terminate Code: " + str(self.terminateCode) + "\n"); 
+        # check terminate code: note a shutdown
+        if (self.terminateCode == 0 or self.terminateCode == 1):
             self.filer.log("Shutting down...\n");
-            shutdown_pi(self.lights, [self.buttons, self]);
         
-        if (terminateCode == 2):
-            # flash LED to show debug terminate
+        if (self.terminateCode == 2):
+            # flash LED to show the dash cam was stopped
             self.lights.setLED([0, 1], False);
             self.lights.flashLED([0, 1], 5);
-            self.filer.log("Terminating dash cam, but keeping Pi powered on...\n");
+            self.filer.log("Stopping dash cam, but keeping Pi powered on...\n");
+        self.lights.setLED([1], False);
+
+        # log that the session has ended
+        self.filer.log("--------- Session Ended: " + str(datetime.datetime.now())
+                       + " ---------\n\n", True);
+        return self.terminateCode;
     
     
-    # ------------------------ Mode Updates ------------------------ #
-    # Main update method for whatever mode the dash cam is in. Takes in
-    # the main loop's tick and tick-second count. Returns a string to
-    # be added to the "tickString" in the main loop to reflect any
-    # changes that were made in this function
-    def update(self, ticks, tickSeconds):
-        stringAddon = "";
-        tickOnSecond = tickSeconds.is_integer();
-        
-        # if the tick is on a second, toggle the "rolling" LED
-        if (tickOnSecond):
-            self.lights.setLED([1], not self.lights.getLED(1));
-            
-        # if it's time to save the video, split the recording
-        if (tickSeconds % self.PASSIVE_LEN == 0 and ticks > 0):
-            self.passiveRecording(0);
-            # add to the tick string
-            stringAddon += "  (Starting next passive video)";
-            # flash LED
-            self.lights.flashLED([1], 4);
-        
-        # return the string to be added to the tickString
-        return stringAddon;
+    # ------------------------ Mode Duties ------------------------- #
+    # Each of these is run by the scheduler when it's due, and is passed its
+    # Duty object. Anything worth noting in the log at the next tick is added
+    # to self.tickEvents
+
+    # Duty: checks the buttons for gestures and acts on them (this is also
+    # called straight from the main loop when a button event wakes it up)
+    def checkButtons(self, duty):
+        for gesture in self.gestures.update():
+            # check for both buttons being held
+            if (gesture.kind == "chord"):
+                # terminate and shut down
+                self.terminateCode = 1;
+            # check for power button hold
+            elif (gesture.kind == "held" and gesture.button == self.buttons.POWER):
+                # stop recording, and go back to config
+                self.terminateCode = 2;
+            # check for capture button hold (SAVE INCIDENT)
+            elif (gesture.kind == "hold" and gesture.button == self.buttons.CAPTURE):
+                self.saveIncident();
+            # check for capture button press (TAKE PICTURE)
+            elif (gesture.kind == "click" and gesture.button == self.buttons.CAPTURE):
+                self.filer.log("Capturing image..."); 
+                # flash LED and take picture
+                self.lights.flashLED([1], 2);
+                if (self.camera.takePicture(self.filer.nextImageName(), self.filer.imagePath) == None):
+                    self.filer.log("Image writer is busy; picture dropped\n");
+
+
+    # Duty: updates the camera's overlay text
+    def refreshOverlay(self, duty):
+        if (self.camera.currVideo != None):                
+            self.camera.updateOverlays();
+
+
+    # Duty: samples the CPU temperature and lets the governor respond to it
+    # (throttling the camera, or terminating if that isn't enough)
+    def checkTemperature(self, duty):
+        cpuTemp = self.thermals.sample();
+        if (cpuTemp == None):
+            return;
+        self.lastCPUTemp = cpuTemp;
+        self.camera.overlay.setField("temp", "{t:.0f}C".format(t = cpuTemp));
+
+        action = self.governor.update(self.thermals);
+        if (action == "throttle" or action == "recover"):
+            self.applyRecordingProfile(action);
+        elif (action == "shutdown"):
+            self.filer.log("CPU running too hot! Shutting down...");
+            self.terminateCode = 0;
+
+
+    # Duty: toggles the "rolling" LED once a second
+    def toggleRolling(self, duty):
+        self.lights.setLED([1], not self.lights.getLED(1));
+
+
+    # Duty: splits the passive recording once it's reached PASSIVE_LEN
+    def splitPassive(self, duty):
+        self.passiveRecording(0);
+        # add to the tick string
+        self.tickEvents += "  (Starting next passive video)";
+        # flash LED
+        self.lights.flashLED([1], 4);
+
+
+    # Duty: deletes old files if anything's over its quota, keeping room for
+    # the next passive video ahead of time
+    def checkStorage(self, duty):
+        self.filer.reserveSpace(self.getSegmentBytes());
+
+
+    # Duty: runs one slot of the background conversion's duty cycle, holding
+    # it while the CPU is hot or the main loop is running late. Finished
+    # conversions replace their .h264's, and the next video is started
+    def convertInBackground(self, duty):
+        backOff = (self.governor.level > 0 or self.lastCPUTemp >= self.REMUX_TEMP or
+                   self.lastLoopTime > self.REMUX_LATENCY);
+        finished = self.remux.update(backOff);
+        if (finished != None):
+            ((directory, fileName, index, duration), success) = finished;
+            if (self.filer.finishConversion(directory, fileName, index, success)):
+                self.tickEvents += "  (Converted " + fileName + " to .mp4)";
+            else:
+                self.tickEvents += "  (Couldn't convert " + fileName + ")";
+
+        if (not self.remux.isBusy() and not backOff):
+            job = self.filer.nextConversion();
+            if (job != None and not self.remux.start(job)):
+                self.filer.log("Couldn't start converting " + job[1] + "\n");
+                self.filer.finishConversion(job[0], job[1], job[2], False);
+
+
+    # Duty: looks for the flash drive being plugged in (or pulled out), and
+    # dumps the output onto it in the background when it is
+    def watchDrive(self, duty):
+        event = self.dumper.watcher.poll();
+        if (event == "added"):
+            if (self.dumper.startDump(self.filer, self.DUMP_RATE)):
+                self.tickEvents += "  (Flash drive plugged in: dumping in the background)";
+        elif (event == "removed"):
+            self.tickEvents += "  (Flash drive pulled out)";
+        if (self.dumper.popFinished()):
+            self.tickEvents += "  (Background dump finished)";
+
+
+    # Duty: records the files the uploader has finished (and whether the Pi
+    # went online or offline), and queues any media that's newly ready to be
+    # uploaded
+    def queueUploads(self, duty):
+        while (len(self.netEvents) > 0):
+            online = self.netEvents.pop(0);
+            self.tickEvents += "  (Upload server " + ("reachable" if online else "unreachable") + ")";
+        for name in self.uploader.popFinished():
+            self.filer.fileUploaded(name);
+            self.tickEvents += "  (Uploaded " + name + ")";
+        for (fullPath, name, kind) in self.filer.pendingUploads():
+            self.uploader.add(fullPath, name, kind);
+
+
+    # Duty: records the dash cam's state (LEDs, buttons, CPU temperature,
+    # segment and loop latency) in the telemetry journal, and logs any events
+    # that happened since the last tick
+    def logTick(self, duty):
+        leds = 0;
+        for i in range(0, len(self.lights.states)):
+            if (self.lights.states[i]):
+                leds |= 1 << i;
+        segment = 0;
+        if (self.camera.currVideo != None):
+            segment = SegmentIndex.parseSequence(self.camera.currVideo.fileName) or 0;
+        self.filer.journal.append(time.time(), leds,
+                                  self.gestures.getHoldTime(self.buttons.POWER),
+                                  self.gestures.getHoldTime(self.buttons.CAPTURE),
+                                  self.lastCPUTemp, segment, self.maxLoopTime);
+        self.maxLoopTime = 0.0;
+
+        events = self.tickEvents;
+        self.tickEvents = "";
+        # note any incident clips that have finished writing
+        for (clipName, clipBytes, clipSeconds) in self.incidents.popFinished():
+            events += "  (Saved incident {n}: {s:.1f} s, {b} bytes)".format(
+                      n = clipName, s = clipSeconds, b = clipBytes);
+            self.filer.incidentSaved(clipName, clipBytes, clipSeconds);
+        # note any pictures that have been written, and how long they took
+        for img in self.camera.imageWriter.popFinished():
+            if (img.latency == None):
+                events += "  (Failed to write " + img.fileName + ")";
+                continue;
+            self.filer.imageSaved(img);
+            events += "  (Saved {n} in {t:.1f} ms, {f} frames lost)".format(
+                      n = img.fileName, t = img.latency * 1000.0, f = img.lostFrames);
+            self.stillLatency.observe(img.latency);
+            if (img.lostFrames != None):
+                self.stillFrames.inc(img.lostFrames);
+        if (events != ""):
+            self.filer.log("[dashcam]  [Tick: {t:d}]".format(t = duty.count) + events + "\n");
+
+
+    # Duty: logs the scheduler's jitter/overrun statistics
+    def logStats(self, duty):
+        self.filer.log("[dashcam]  [Scheduler]  " + self.scheduler.getStats() + "\n");
     
     
     # -------------------- File Saving/Deleting -------------------- #
-    # Deletes the oldest passive recording and begins a new one (or splits one
-    # that's already running)
+    # Makes room for a new passive recording and begins it (or splits one
+    # that's already running, without stopping the encoder)
     def passiveRecording(self, isNew):
-        # first, delete the oldest passive recording
-        self.filer.deleteOldestPassive();
+        # first, make sure there's room for the next passive recording
+        # (deleting the oldest files if there isn't)
+        if (not self.filer.reserveSpace(self.getSegmentBytes())):
+            self.filer.log("Not enough room for the next passive recording!\n");
         
         # depending on the given input, either START a new video, or STOP the
         # current one and create a new one
         if (isNew):
             self.filer.log("Beginning passive recording...\n");
-            self.camera.startVideo(Filer.makeFileName(0), self.filer.passivePath);
+            self.camera.startVideo(self.filer.nextVideoName(), self.filer.passivePath);
+            self.filer.videoStarted(self.camera.currVideo);
         else:
             self.filer.log("Splitting passive recording...\n");
-            self.camera.stopVideo();
-            self.camera.startVideo(Filer.makeFileName(0), self.filer.passivePath);
+            splitStart = time.monotonic();
+            oldVideo = self.camera.splitVideo(self.filer.nextVideoName(),
+                                              self.filer.passivePath);
+            splitTime = time.monotonic() - splitStart;
+            self.filer.videoStarted(self.camera.currVideo);
+            self.filer.videoClosed(oldVideo);
+
+            # record how much footage (if any) was lost at the split
+            gap = self.camera.lastGap;
+            if (gap == None):
+                self.filer.log("Split took {t:.1f} ms (gap not measured)\n".format(
+                               t = splitTime * 1000.0));
+            else:
+                self.filer.log("Split took {t:.1f} ms, gap: {f} frames, {g:.1f} ms\n".format(
+                               t = splitTime * 1000.0, f = gap[0], g = gap[1]));
+                self.splitGaps.observe(gap[1] / 1000.0);
+                self.splitFrames.inc(gap[0]);
+
+
+    # Saves the buffered footage from before (and the next few seconds after)
+    # the capture button was held to a protected incident clip. The clip is
+    # written in the background
+    def saveIncident(self):
+        clipName = self.filer.nextIncidentName();
+        if (self.incidents.saveClip(clipName)):
+            self.filer.log("Saving incident clip " + clipName + "...\n");
+            self.lights.flashLED([1], 3);
+        else:
+            self.filer.log("Incident clip already in progress (or no footage buffered yet)\n");
 
 
     # ---------------------- Helper Functions ---------------------- #
-    # Function that finds the cpu's current temperature and returns the value
-    # as a double
-    def getCPUTemp(self):
-        # run the temp check in the command line and parse the output
-        tempOutput = os.popen("vcgencmd measure_temp | egrep -o '[0-9]*\.[0-9]*'").readlines();
-        return float(tempOutput[0].replace("\n", ""));
+    # Returns the number of bytes one passive recording is expected to take up,
+    # given the camera's bitrate
+    def getSegmentBytes(self):
+        return int(self.camera.bitrate / 8.0 * self.PASSIVE_LEN);
 
 
+    # Restarts the passive recording with the governor's current recording
+    # profile. (The action that caused the change is logged)
+    def applyRecordingProfile(self, action):
+        profile = self.governor.getProfile();
+        self.filer.log("CPU temperature {t:.1f} (trend {d:+.1f}/min): {a} to level {l} "
+                       "({w}x{h} @ {f} fps, {b} bps)\n".format(
+                       t = self.thermals.smoothed, d = self.thermals.getTrend(),
+                       a = action, l = self.governor.level,
+                       w = profile["resolution"][0], h = profile["resolution"][1],
+                       f = profile["framerate"], b = profile["bitrate"]));
+        # the camera can't change its profile mid-recording
+        self.filer.videoClosed(self.camera.stopVideo());
+        self.camera.setProfile(profile);
+        self.passiveRecording(1);
@@ -0,0 +1,193 @@
+import os;
+import time;
+import errno;
+import threading;
+from concurrent.futures import ThreadPoolExecutor;
+
+# A class that copies files as fast as the drives allow. Data is moved by the
+# kernel where it can be (copy_file_range, then sendfile), so it never passes
+# through Python; otherwise large, reused buffers are used. Several files are
+# copied at once on a small thread pool, so reading from the SD card overlaps
+# writing to the flash drive, and the copies are only flushed to the drive
+# (fsync) together, once a whole batch is done. The copies can be held to a
+# rate, so they can run in the background without starving the recording.
+class CopyEngine:
+
+    # CopyEngine properties:
+    #   threads         The number of files copied at once
+    #   useCopyRange    Whether or not copy_file_range is tried first
+    #   useSendfile     Whether or not sendfile is tried next
+    #   buffers         A threading.local holding each thread's copy buffer
+    #   rate            The most bytes copied per second, across all the
+    #                   threads (or None, for no limit)
+    #   rateLock        A lock guarding 'nextTime'
+    #   nextTime        The monotonic time the rate allows the next copy at
+    #   cancelled       Whether or not cancel() has been called
+
+    # CopyEngine constants:
+    #   BUFFER_SIZE     The size of each thread's copy buffer (and the most
+    #                   the kernel is asked to copy in one call)
+    #   FALLBACK_ERRORS The errors that mean a kernel copy isn't supported
+    #                   between two files (so the next method is tried)
+
+    # Constructor: takes the number of threads, the buffer size and the most
+    # bytes to copy per second (if there's to be a limit)
+    def __init__(self, threads = 2, bufferSize = 4 * 1024 * 1024, rate = None):
+        self.BUFFER_SIZE = bufferSize;
+        self.FALLBACK_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                                errno.EBADF, errno.ENOTSUP);
+
+        self.threads = threads;
+        self.useCopyRange = hasattr(os, "copy_file_range");
+        self.useSendfile = hasattr(os, "sendfile");
+        self.buffers = threading.local();
+        self.rate = rate;
+        self.rateLock = threading.Lock();
+        self.nextTime = 0.0;
+        self.cancelled = False;
+
+
+    # ---------------------------- Copying ---------------------------- #
+    # Copies a batch of files: each job is a tuple of the (source path,
+    # destination path, offset to start from). The copies run on the thread
+    # pool, then every file that was copied is flushed to its drive. Returns a
+    # list (in the same order as the jobs) of the number of bytes each job
+    # copied, or the exception it failed with
+    def copyAll(self, jobs):
+        with ThreadPoolExecutor(max_workers = max(1, self.threads)) as pool:
+            futures = [pool.submit(self.copyFile, src, dest, offset)
+                       for (src, dest, offset) in jobs];
+        results = [];
+        for i in range(0, len(jobs)):
+            try:
+                results.append(futures[i].result());
+            except (IOError, OSError) as e:
+                results.append(e);
+
+        # flush everything that was copied, all at once
+        for i in range(0, len(jobs)):
+            if (not isinstance(results[i], Exception)):
+                try:
+                    self.syncFile(jobs[i][1]);
+                except (IOError, OSError) as e:
+                    results[i] = e;
+        return results;
+
+
+    # Copies the file at 'srcPath' to 'destPath' (from 'offset' on, keeping
+    # whatever's already before it). The copy isn't flushed to the drive.
+    # Returns the number of bytes copied
+    def copyFile(self, srcPath, destPath, offset = 0):
+        flags = os.O_WRONLY | os.O_CREAT;
+        if (offset == 0):
+            flags |= os.O_TRUNC;
+        src = os.open(srcPath, os.O_RDONLY);
+        try:
+            dest = os.open(destPath, flags, 0o644);
+            try:
+                os.ftruncate(dest, offset);
+                size = os.fstat(src).st_size;
+                copied = None;
+                if (self.useCopyRange):
+                    copied = self.copyRange(src, dest, offset, size);
+                if (copied == None and self.useSendfile):
+                    copied = self.copySendfile(src, dest, offset, size);
+                if (copied == None):
+                    copied = self.copyBuffered(src, dest, offset);
+            finally:
+                os.close(dest);
+        finally:
+            os.close(src);
+        return copied;
+
+
+    # Stops the copies in progress (and any still to come), which fail with
+    # ECANCELED. This can be called from any thread
+    def cancel(self):
+        self.cancelled = True;
+
+
+    # Flushes a copied file to its drive
+    def syncFile(self, path):
+        fd = os.open(path, os.O_RDONLY);
+        try:
+            os.fsync(fd);
+        finally:
+            os.close(fd);
+
+
+    # ---------------------------- Helpers ---------------------------- #
+    # Helper function that copies with copy_file_range. Returns the number of
+    # bytes copied, or None if it isn't supported between these files
+    def copyRange(self, src, dest, offset, size):
+        position = offset;
+        while (position < size):
+            try:
+                count = os.copy_file_range(src, dest, min(self.BUFFER_SIZE, size - position),
+                                           position, position);
+            except OSError as e:
+                if (position == offset and e.errno in self.FALLBACK_ERRORS):
+                    return None;
+                raise;
+            if (count == 0):
+                break;
+            position += count;
+            self.throttle(count);
+        return position - offset;
+
+
+    # Helper function that copies with sendfile. Returns the number of bytes
+    # copied, or None if it isn't supported between these files
+    def copySendfile(self, src, dest, offset, size):
+        os.lseek(dest, offset, os.SEEK_SET);
+        position = offset;
+        while (position < size):
+            try:
+                count = os.sendfile(dest, src, position, min(self.BUFFER_SIZE, size - position));
+            except OSError as e:
+                if (position == offset and e.errno in self.FALLBACK_ERRORS):
+                    return None;
+                raise;
+            if (count == 0):
+                break;
+            position += count;
+            self.throttle(count);
+        return position - offset;
+
+
+    # Helper function that copies through this thread's buffer. Returns the
+    # number of bytes copied
+    def copyBuffered(self, src, dest, offset):
+        buf = getattr(self.buffers, "buf", None);
+        if (buf == None):
+            buf = bytearray(self.BUFFER_SIZE);
+            self.buffers.buf = buf;
+        view = memoryview(buf);
+        os.lseek(src, offset, os.SEEK_SET);
+        os.lseek(dest, offset, os.SEEK_SET);
+        copied = 0;
+        while (True):
+            count = os.readv(src, [view]);
+            if (count == 0):
+                break;
+            written = 0;
+            while (written < count):
+                written += os.write(dest, view[written:count]);
+            copied += count;
+            self.throttle(count);
+        return copied;
+
+
+    # Helper function that waits long enough, after 'count' bytes were copied,
+    # to keep the copies (on every thread) to the rate. Raises an OSError if
+    # the copies have been cancelled
+    def throttle(self, count):
+        if (self.cancelled):
+            raise OSError(errno.ECANCELED, "Copy cancelled");
+        if (self.rate == None):
+            return;
+        with self.rateLock:
+            now = time.monotonic();
+            self.nextTime = max(self.nextTime, now) + count / float(self.rate);
+            wait = self.nextTime - now;
+        time.sleep(wait);
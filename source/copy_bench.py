@@ -0,0 +1,82 @@
+# A script that benchmarks the copy engine (copier.py) against shutil, copying
+# a directory of test files (sized like recorded segments) onto a target
+# directory, such as a tmpfs or a loopback-mounted flash drive image. Every
+# copy is flushed to the target before it's timed, and the throughput of each
+# method is printed. Usage:
+#   python3 copy_bench.py <target directory> [--files 8] [--size 64] [--runs 3]
+
+import os;
+import time;
+import shutil;
+import argparse;
+from copier import CopyEngine;
+
+# Copies every file in 'srcDir' into 'destDir' with shutil, flushing each to
+# the target
+def copyShutil(srcDir, destDir, fileNames):
+    for fileName in fileNames:
+        shutil.copyfile(srcDir + fileName, destDir + fileName);
+    for fileName in fileNames:
+        fd = os.open(destDir + fileName, os.O_RDONLY);
+        os.fsync(fd);
+        os.close(fd);
+
+
+# Returns a function that copies every file in 'srcDir' into 'destDir' with a
+# CopyEngine of the given number of threads
+def makeEngineCopy(threads):
+    engine = CopyEngine(threads);
+    def copy(srcDir, destDir, fileNames):
+        results = engine.copyAll([(srcDir + f, destDir + f, 0) for f in fileNames]);
+        for result in results:
+            if (isinstance(result, Exception)):
+                raise result;
+    return copy;
+
+
+parser = argparse.ArgumentParser(description = "Benchmark the copy engine against shutil");
+parser.add_argument("target", help = "directory to copy into (a tmpfs or loop mount)");
+parser.add_argument("--source", default = "/tmp/copy_bench_src/",
+                    help = "directory to create the test files in");
+parser.add_argument("--files", type = int, default = 8, help = "number of test files");
+parser.add_argument("--size", type = int, default = 64, help = "size of each file (MB)");
+parser.add_argument("--runs", type = int, default = 3, help = "runs of each method");
+options = parser.parse_args();
+
+srcDir = os.path.join(options.source, "");
+destDir = os.path.join(options.target, "copy_bench", "");
+for directory in (srcDir, destDir):
+    if (not os.path.isdir(directory)):
+        os.makedirs(directory);
+
+# write the test files (random data, so nothing along the way can compress it)
+fileNames = ["test_{i}.h264".format(i = i) for i in range(0, options.files)];
+for fileName in fileNames:
+    if (os.path.exists(srcDir + fileName) and
+        os.path.getsize(srcDir + fileName) == options.size * 1000000):
+        continue;
+    with open(srcDir + fileName, "wb") as f:
+        for mb in range(0, options.size):
+            f.write(os.urandom(1000000));
+totalSize = options.files * options.size * 1000000;
+
+methods = [("shutil", copyShutil)];
+for threads in (1, 2, 4):
+    methods.append(("engine x" + str(threads), makeEngineCopy(threads)));
+
+print("Copying {n} x {s} MB to {t}".format(n = options.files, s = options.size,
+                                          t = options.target));
+for (name, copy) in methods:
+    for run in range(0, options.runs):
+        for fileName in os.listdir(destDir):
+            os.remove(destDir + fileName);
+        # drop the test files from the page cache (if allowed), so each run
+        # reads them from the disk
+        os.system("sync; echo 1 | sudo -n tee /proc/sys/vm/drop_caches > /dev/null 2>&1");
+        start = time.monotonic();
+        copy(srcDir, destDir, fileNames);
+        seconds = time.monotonic() - start;
+        print("{n:10s} run {r}: {t:7.2f} s  {m:7.1f} MB/s".format(
+              n = name, r = run + 1, t = seconds, m = totalSize / 1000000.0 / seconds));
+
+shutil.rmtree(destDir);
@@ -1,6 +1,10 @@
+import io;
+import time;
 import picamera;
-from video import Video;
-from image import Image;
+from video import Video, SegmentOutput;
+from image import Image, ImageWriter;
+from overlay import OverlayRenderer;
+import metrics;
 
 # A class that handles the pi camera: creating Video and Image objects
 # (helpful stuff: https://picamera.readthedocs.io/en/release-1.10/recipes1.html)
@@ -10,14 +14,46 @@ class DashCam:
     #   picam        The PiCamera object used to work the Camera Module
     #   currVideo    The current video that's being recorded (if any)
     #                (set to None otherwise)
+    #   bitrate      The bitrate (in bits per second) videos are encoded at
+    #   currOutput   The SegmentOutput the current video is being written to
+    #   lastGap      A tuple of the (frames, milliseconds) lost at the most
+    #                recent split (or None if it couldn't be measured)
+    #   incidents    The IncidentRecorder that's fed everything the encoder
+    #                writes (or None)
+    #   imageWriter  The ImageWriter that writes captured pictures to disk
+    #   overlay      The OverlayRenderer drawing the text over the video
+    #   segments     The number of videos started since the camera was created
+
+    # DashCam constants:
+    #   KEYFRAME_INTERVAL  The time (in seconds) between the encoder's key
+    #                      frames. Passive video lengths should be a multiple
+    #                      of this, so splits land on a key frame
+    #   SPLIT_TIMEOUT      The longest (in seconds) a split waits for the first
+    #                      frame of the new segment when measuring the gap
     
-    # Constructor: takes in an optional parameter: camera resolution
-    def __init__(self, resolution = [1600, 900]):
+    # Constructor: takes in optional parameters: camera resolution, framerate
+    # and video bitrate
+    def __init__(self, resolution = [1600, 900], framerate = 30, bitrate = 17000000):
         self.currVideo = None;
         self.picam = picamera.PiCamera();
-        # set up the camera'a resolution and rotation
+        # set up the camera'a resolution, framerate and rotation
         self.picam.resolution = (resolution[0], resolution[1]);
+        self.picam.framerate = framerate;
         self.picam.rotation = 180;
+        self.bitrate = bitrate;
+        self.currOutput = None;
+        self.lastGap = None;
+        self.incidents = None;
+        self.imageWriter = ImageWriter();
+        self.segments = 0;
+
+        # set up the overlay (its style only needs to be pushed once)
+        self.overlay = OverlayRenderer(self.picam, registry = metrics.REGISTRY);
+        self.overlay.applyStyle(picamera.Color("black"), picamera.Color("white"), 15);
+
+        # create constants
+        self.KEYFRAME_INTERVAL = 1.0;
+        self.SPLIT_TIMEOUT = 1.0;
     
     
     # Destructor: releases the picamera
@@ -27,22 +63,52 @@ class DashCam:
     
     
     # -------------------- Recording/Capturing -------------------- #
+    # Starts the camera's (invisible) preview, so its exposure and white
+    # balance settle before anything's recorded. This is done while the
+    # config window is open, so recording can start right away
+    def warmUp(self):
+        self.picam.start_preview(alpha = 0);
+
+
+    # Waits (up to 'timeout' seconds) for the first frame of the current
+    # video to be written. Returns a boolean indicating whether or not it was
+    def waitForFirstFrame(self, timeout = 1.0):
+        waitStart = time.monotonic();
+        while (self.currOutput != None and self.currOutput.firstTimestamp == None):
+            if (time.monotonic() - waitStart >= timeout):
+                return False;
+            self.picam.wait_recording(0.01);
+        return self.currOutput != None;
+
+
     # Creates a new video (with the given parameters), and starts the
     # python camera's video mode. self.currVideo is updated
     def startVideo(self, vidName, vidPath):
-        # create the video object
+        # create the video object and the output it's written to
         self.currVideo = Video(vidName, vidPath);
+        self.segments += 1;
+        self.overlay.setField("segment", self.segments);
+        self.currOutput = SegmentOutput(self.currVideo.getFullPath(), self.getFrame,
+                                        self.feedIncidents);
         
-        # start recording the video
-        self.picam.start_recording(self.currVideo.getFullPath());
+        # start recording the video, with key frames at a fixed interval so
+        # splits don't have to wait long for one
+        self.picam.start_recording(self.currOutput, format = "h264",
+                                   bitrate = self.bitrate,
+                                   intra_period = self.getIntraPeriod());
+        self.currVideo.markStarted();
         return;
     
     
     # Stops the recording of the current video, and returns the Video
-    # object from self.currVideo. self.currVideo is nulled out.
+    # object from self.currVideo (with its duration filled in).
+    # self.currVideo is nulled out.
     def stopVideo(self):
-        # stop recording
+        # stop recording and close the video's file
         self.picam.stop_recording();
+        self.currOutput.close();
+        self.currVideo.duration = self.measureDuration(self.currVideo, self.currOutput);
+        self.currOutput = None;
 
         # return the Video and empty self.currVideo
         vid = self.currVideo;
@@ -50,40 +116,134 @@ class DashCam:
         return vid;
 
     
-    # Function that saves what's been currently recorded to self.currVideo's
-    # specified file + path. self.currVideo's video name is updated for the next
-    # time the video is saved or split
-    def splitVideo(self, newName):
-        self.picam.split_recording(self.currVideo.getFullPath());
-        # update the video's name
-        self.currVideo.setFileName(newName);
+    # Function that moves the recording over to a new video (with the given
+    # name and path) without stopping the encoder. The switch happens at the
+    # next key frame, so no footage is dropped between the two files. The
+    # finished Video object is returned (with its duration filled in), and
+    # self.currVideo becomes the new one.
+    # The gap between the two videos is measured and saved in self.lastGap
+    def splitVideo(self, vidName, vidPath):
+        oldVideo = self.currVideo;
+        oldOutput = self.currOutput;
+        self.currVideo = Video(vidName, vidPath);
+        self.currOutput = SegmentOutput(self.currVideo.getFullPath(), self.getFrame,
+                                        self.feedIncidents);
+        self.segments += 1;
+        self.overlay.setField("segment", self.segments);
+
+        # ask for a key frame right away, then switch outputs on it
+        self.picam.request_key_frame();
+        self.picam.split_recording(self.currOutput);
+        self.currVideo.markStarted();
+        oldOutput.close();
+        oldVideo.duration = self.measureDuration(oldVideo, oldOutput);
+
+        self.lastGap = self.measureGap(oldOutput, self.currOutput);
+        return oldVideo;
 
 
     # Takes a picture with the Pi Camera, returning an Image object containing
-    # the information of the picture that was captured. (If self.currVideo is
-    # NOT None, then a picture can't be taken, as a video is being recorded).
+    # the information of the picture that was captured. The picture is taken
+    # from the video port (so a recording isn't interrupted) into memory, and
+    # is written to disk in the background by the ImageWriter. Returns None if
+    # the writer is too far behind to take another picture
     def takePicture(self, picName, picPath):
         # create the image object
         img = Image(picName, picPath);
         
-        # take the picture and return the Image object
-        self.picam.capture(img.getFullPath());        
+        # start measuring any gap in the recording from here
+        captureStart = time.monotonic();
+        img.captureTime = time.time();
+        img.captureClock = captureStart;
+        frameTime = None;
+        if (self.currOutput != None):
+            self.currOutput.resetMaxGap();
+            frameTime = 1000000.0 / float(self.picam.framerate);
+
+        # take the picture and hand it to the writer
+        stream = io.BytesIO();
+        self.picam.capture(stream, format = "jpeg", use_video_port = True);
+        if (not self.imageWriter.submit(img, stream.getvalue(), captureStart,
+                                        self.currOutput, frameTime)):
+            return None;
         return img;
     
 
+    # --------------------- Recording Profile --------------------- #
+    # Returns the camera's current recording profile: a dictionary holding its
+    # "resolution", "framerate" and "bitrate"
+    def getProfile(self):
+        return {"resolution": (self.picam.resolution[0], self.picam.resolution[1]),
+                "framerate": int(self.picam.framerate),
+                "bitrate": self.bitrate};
+
+
+    # Switches the camera to the given recording profile (see getProfile()).
+    # The resolution and framerate can't be changed mid-recording, so this must
+    # only be called while no video is being recorded
+    def setProfile(self, profile):
+        self.picam.resolution = profile["resolution"];
+        self.picam.framerate = profile["framerate"];
+        self.bitrate = profile["bitrate"];
+
+
     # --------------------- Helper Functions ---------------------- #    
-    # Updates the text being displayed over the camera's video/pictures
-    def updateOverlays(self, currentTime):
-        self.picam.annotate_background = picamera.Color("black");
-        self.picam.annotate_foreground = picamera.Color("white");
-        self.picam.annotate_text_size = 15;
-        
-        # determine what to display depending on the second (it's the
-        # current date/time by default)
-        annotation = currentTime.strftime("%Y-%m-%d, %H:%M:%S");
-        
-        # update the overlay text
-        self.picam.annotate_text = str(annotation);
+    # Returns the encoder's most recent frame (or None if nothing's recording)
+    def getFrame(self):
+        try:
+            return self.picam.frame;
+        except picamera.PiCameraError:
+            return None;
+
+
+    # Passes a buffer written by the encoder along to the IncidentRecorder
+    # (if there is one)
+    def feedIncidents(self, data, frame):
+        if (self.incidents != None):
+            self.incidents.feed(data, frame);
+
+
+    # Returns the number of frames between two key frames, given the camera's
+    # framerate and the KEYFRAME_INTERVAL
+    def getIntraPeriod(self):
+        return max(1, int(round(float(self.picam.framerate) * self.KEYFRAME_INTERVAL)));
+
+
+    # Measures the gap between two consecutive segment outputs, using the
+    # timestamps of the last frame of the first and the first frame of the
+    # second. (This waits up to SPLIT_TIMEOUT for the second segment's first
+    # frame). Returns a tuple of the (frames, milliseconds) missing beyond one
+    # normal frame interval, or None if it couldn't be measured
+    def measureGap(self, oldOutput, newOutput):
+        waitStart = time.monotonic();
+        while (newOutput.firstTimestamp == None and
+               time.monotonic() - waitStart < self.SPLIT_TIMEOUT):
+            self.picam.wait_recording(0.01);
+        if (oldOutput.lastTimestamp == None or newOutput.firstTimestamp == None):
+            return None;
+
+        # anything longer than one frame interval is footage that was lost
+        frameTime = 1000.0 / float(self.picam.framerate);
+        gapMs = (newOutput.firstTimestamp - oldOutput.lastTimestamp) / 1000.0;
+        lostFrames = max(0, int(round(gapMs / frameTime)) - 1);
+        return (lostFrames, max(0.0, gapMs - frameTime));
+
 
+    # Returns the length (in seconds) of the footage written to the given
+    # Video's SegmentOutput, from the timestamps of its first and last frames
+    # (plus the last frame's interval). If no frames were timestamped, the
+    # time since the video started is used instead
+    def measureDuration(self, video, output):
+        if (output.firstTimestamp == None or output.lastTimestamp == None):
+            if (video.startClock == None):
+                return None;
+            return time.monotonic() - video.startClock;
+        return ((output.lastTimestamp - output.firstTimestamp) / 1000000.0 +
+                1.0 / float(self.picam.framerate));
 
 
+    # Updates the text being displayed over the camera's video/pictures. (The
+    # camera is only touched if the text has changed). Returns a boolean
+    # indicating whether or not the text was rewritten
+    def updateOverlays(self):
+        return self.overlay.update();
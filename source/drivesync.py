@@ -0,0 +1,186 @@
+import os;
+import json;
+import errno;
+from copier import CopyEngine;
+
+# A class that syncs the dash cam's output onto a flash drive. A manifest on
+# the drive records the size and modification time each file had when it was
+# copied, so a dump only copies files that are new (or have changed) since
+# the last one. Files are copied in batches (see CopyEngine) to temporary
+# names, and renamed into place once they're complete and flushed to the
+# drive, and the manifest is saved as the dump goes, so a dump
+# that's interrupted (such as by the drive being pulled) leaves every finished
+# file intact, and picks up where it left off next time.
+class DriveSync:
+
+    # DriveSync properties:
+    #   destPath        The directory on the drive the output is synced into
+    #   sources         A list of (directory, name) tuples: each directory is
+    #                   synced into a directory of that name on the drive
+    #   manifestPath    The path of the manifest on the drive
+    #   manifest        A dictionary holding "files" (mapping each synced
+    #                   file's path, relative to destPath, to its [size, mtime])
+    #                   and "pending" (the same, for the files being copied)
+
+    # DriveSync constants:
+    #   CHUNK_SIZE      The amount (in bytes) an interrupted copy backs up
+    #                   before resuming
+    #   BATCH_BYTES     The most bytes copied (and flushed) in one batch. The
+    #                   manifest is saved after every batch
+    #   PART_SUFFIX     The suffix of files that are still being copied
+
+    # Constructor: takes the directory on the drive to sync into
+    def __init__(self, destPath):
+        self.CHUNK_SIZE = 1024 * 1024;
+        self.BATCH_BYTES = 256 * 1024 * 1024;
+        self.PART_SUFFIX = ".part";
+
+        self.destPath = destPath;
+        self.sources = [];
+        self.manifestPath = destPath + ".manifest.json";
+        self.manifest = {"files": {}, "pending": {}};
+
+
+    # Adds a directory to be synced into a directory of the given name
+    def addSource(self, directory, name):
+        self.sources.append((directory, name));
+
+
+    # ----------------------------- Syncing ----------------------------- #
+    # Copies every new or changed file onto the drive, a directory at a time,
+    # with the given CopyEngine (or a default one). Returns a dictionary of
+    # the "copied" and "skipped" file counts, the "bytesCopied" and
+    # "bytesSkipped", and the "failed" count
+    def sync(self, engine = None):
+        if (engine == None):
+            engine = CopyEngine();
+        report = {"copied": 0, "skipped": 0, "bytesCopied": 0, "bytesSkipped": 0,
+                  "failed": 0};
+        if (not os.path.isdir(self.destPath)):
+            os.makedirs(self.destPath);
+        self.loadManifest();
+        try:
+            for batch in self.getBatches(report):
+                self.syncBatch(batch, engine, report);
+        finally:
+            self.saveManifest();
+        return report;
+
+
+    # Helper function that copies a batch of files (all going to the same
+    # directory) with the engine, and renames each into place once they've
+    # all been flushed to the drive. Each file is a (source path, relative
+    # path, size, mtime) tuple
+    def syncBatch(self, batch, engine, report):
+        # resume any copies that were interrupted (going back a chunk, in case
+        # the end of them never made it to the drive)
+        jobs = [];
+        for (srcPath, relPath, size, mtime) in batch:
+            offset = 0;
+            partPath = self.destPath + relPath + self.PART_SUFFIX;
+            if (self.manifest["pending"].get(relPath) == [size, mtime] and
+                os.path.exists(partPath)):
+                offset = max(0, os.path.getsize(partPath) - self.CHUNK_SIZE);
+                offset -= offset % self.CHUNK_SIZE;
+            jobs.append((srcPath, partPath, offset));
+        # (files from earlier batches that failed stay pending, so they can
+        # still be resumed)
+        self.manifest["pending"].update((f[1], [f[2], f[3]]) for f in batch);
+        self.saveManifest();
+
+        directory = os.path.dirname(self.destPath + batch[0][1]);
+        if (not os.path.isdir(directory)):
+            os.makedirs(directory);
+        results = engine.copyAll(jobs);
+        for i in range(0, len(batch)):
+            (srcPath, relPath, size, mtime) = batch[i];
+            copied = results[i];
+            if (not isinstance(copied, Exception)):
+                try:
+                    os.replace(jobs[i][1], self.destPath + relPath);
+                except OSError as e:
+                    copied = e;
+            if (isinstance(copied, Exception)):
+                # a drive that's gone fails every file, so give up on it (as
+                # with a cancelled copy)
+                report["failed"] += 1;
+                if (not os.path.isdir(self.destPath) or
+                    getattr(copied, "errno", None) == errno.ECANCELED):
+                    raise copied;
+                continue;
+            self.manifest["files"][relPath] = [size, mtime];
+            del self.manifest["pending"][relPath];
+            report["copied"] += 1;
+            report["bytesCopied"] += copied;
+            report["bytesSkipped"] += jobs[i][2];
+        self.saveManifest();
+
+
+    # Helper function that yields the files that need copying, in batches of
+    # files going to the same directory (no bigger than BATCH_BYTES). Files
+    # that are already on the drive, unchanged, are counted in the report
+    def getBatches(self, report):
+        batch = [];
+        batchBytes = 0;
+        for (srcPath, relPath, size, mtime) in self.listFiles():
+            if (self.manifest["files"].get(relPath) == [size, mtime] and
+                os.path.exists(self.destPath + relPath)):
+                report["skipped"] += 1;
+                report["bytesSkipped"] += size;
+                continue;
+            if (len(batch) > 0 and (os.path.dirname(relPath) != os.path.dirname(batch[0][1]) or
+                                    batchBytes + size > self.BATCH_BYTES)):
+                yield batch;
+                batch = [];
+                batchBytes = 0;
+            batch.append((srcPath, relPath, size, mtime));
+            batchBytes += size;
+        if (len(batch) > 0):
+            yield batch;
+
+
+    # ----------------------------- Helpers ----------------------------- #
+    # Returns a list of (source path, path relative to destPath, size, mtime)
+    # tuples for every file in the sources (and their sub-directories)
+    def listFiles(self):
+        files = [];
+        for (directory, name) in self.sources:
+            for (root, dirs, fileNames) in os.walk(directory):
+                dirs.sort();
+                for fileName in sorted(fileNames):
+                    if (fileName.endswith(self.PART_SUFFIX)):
+                        continue;
+                    srcPath = os.path.join(root, fileName);
+                    try:
+                        stats = os.stat(srcPath);
+                    except OSError:
+                        continue;
+                    relPath = os.path.join(name, os.path.relpath(srcPath, directory));
+                    files.append((srcPath, relPath.replace(os.sep, "/"),
+                                  stats.st_size, int(stats.st_mtime)));
+        return files;
+
+
+    # Loads the manifest from the drive (starting a new one if there isn't one)
+    def loadManifest(self):
+        self.manifest = {"files": {}, "pending": {}};
+        try:
+            with open(self.manifestPath, "r") as f:
+                manifest = json.load(f);
+            self.manifest["files"] = manifest.get("files", {});
+            self.manifest["pending"] = manifest.get("pending", {});
+        except (IOError, OSError, ValueError, AttributeError):
+            pass;
+
+
+    # Saves the manifest onto the drive (replacing the old one only once it's
+    # been written)
+    def saveManifest(self):
+        try:
+            with open(self.manifestPath + self.PART_SUFFIX, "w") as f:
+                json.dump(self.manifest, f);
+                f.flush();
+                os.fsync(f.fileno());
+            os.replace(self.manifestPath + self.PART_SUFFIX, self.manifestPath);
+        except (IOError, OSError):
+            pass;
@@ -1,28 +1,47 @@
 import os;
-import shutil;
+import time;
+import threading;
+import subprocess;
+from drivesync import DriveSync;
+from copier import CopyEngine;
+from hotplug import DriveWatcher;
 
 # A class responsible for looking for a flash drive on the system, and
 # "dumping" the dash cam's files onto it, either immediately when the flash
-# drive is plugged in, or periodically, with the flash drive plugged in
+# drive is plugged in, or periodically, with the flash drive plugged in. The
+# drive is found by its label (see DriveWatcher), and a dump can run in the
+# background (held to a rate), so the dash cam keeps recording meanwhile
 class Dumper:
     
     # Dumper properties:
     #   dumpDirectories    A list of paths pointing to directories to be dumped
     #                      to a plugged-in flash drive
-    #   driveName          The name of the flash drive to search for
+    #   driveName          The name (label) of the flash drive to search for
     #   drivePath          The full path of the flash drive in the system
     #   saveDirectory      The name of the directory the files will be copied
     #                      to on the flash drive
+    #   root               The directory the system's /dev, /sys and /proc
+    #                      are looked for under
+    #   watcher            The DriveWatcher looking for the drive
+    #   thread             The thread running a background dump (or None)
+    #   engine             The CopyEngine used by the background dump
+    #   finished           Whether or not a background dump has finished
+    #                      since popFinished() was last called
     
-    # Constructor: sets up the name of the flash drive to dump to
-    def __init__(self, name):
+    # Constructor: sets up the name of the flash drive to dump to, and
+    # (optionally) the root the system's /dev, /sys and /proc are under
+    def __init__(self, name, root = "/"):
         # set up the name/path
+        self.root = root;
         self.setDriveName(name);
         
         # set up directories to dump
         #homePath = os.getcwd().replace("/source", "") + "/";
         homePath = "/home/pi/coding/python/dash/";
         self.dumpDirectories = [homePath + "logs", homePath + "media"];
+        self.thread = None;
+        self.engine = None;
+        self.finished = False;
 
 
     # ---------------------- Set-up Functions ---------------------- #
@@ -32,45 +51,41 @@ class Dumper:
         self.driveName = name;
         self.drivePath = "/media/pi/" + name + "/";
         self.saveDirectory = "dashcam";
+        self.watcher = DriveWatcher(name, root = self.root);
     
     
     # -------------------- Flash-Drive Detection ------------------- #
     # Function that checks if the flash drive by the object's name is plugged
     # in. Returns a boolean accordingly
     def driveExists(self):
-        driveInfo = os.popen("sudo blkid").readlines();
-        if (len(driveInfo) > 4):
-            # make sure '/dev/sd*' exists
-            return "/dev/sd" in driveInfo[4];
+        return self.watcher.findDevice() != None;
     
     
-    # Function that mounts the sda1/sdb1 flash drive to the correct folder. The
-    # filer is used to log the mounting. Returns a boolean indicating mount
-    # success
+    # Function that mounts the flash drive to the correct folder (or, if it's
+    # already mounted somewhere, uses that). The filer is used to log the
+    # mounting. Returns a boolean indicating mount success
     def mountDrive(self, filer):
-        # if the mounting path already exists, delete it
-        if (os.path.exists(self.drivePath)):
-            os.system("sudo rm -rf " + self.drivePath);
-        # create a fresh directory for the mount
-        os.system("sudo mkdir " + self.drivePath);
-        os.system("sudo mkdir " + self.drivePath + self.saveDirectory);
-
-        # look for '/dev/sd??'
-        mountPoint = "sda1";
-        driveInfo = os.popen("sudo blkid").readlines();
-        if (len(driveInfo) > 4):
-            # make sure 'dev/sd??' exists in this line
-            if ("/dev/sd" in driveInfo[4]):
-                # save the "sd??" value as the mount point
-                mountPoint = driveInfo[4].split(":")[0].replace("/dev/", "");
-
-        # mount
-        status = os.system("sudo mount -o uid=pi,gid=pi /dev/" + mountPoint +
-                           " " + self.drivePath);
+        devicePath = self.watcher.getDevicePath();
+        if (devicePath == None):
+            filer.log("Mounting unsuccessful: drive '" + self.driveName + "' not found.\n");
+            return False;
+
+        # if it's already mounted (such as by the desktop), dump to it there
+        mountPoint = self.watcher.getMountPoint();
+        if (mountPoint != None):
+            self.drivePath = os.path.join(mountPoint, "");
+            filer.log("Drive " + devicePath + " is mounted at " + self.drivePath + "\n");
+            return True;
+
+        # create the directory for the mount (if it isn't there), and mount
+        self.drivePath = "/media/pi/" + self.driveName + "/";
+        self.runCommand(["sudo", "mkdir", "-p", self.drivePath]);
+        status = self.runCommand(["sudo", "mount", "-o", "uid=pi,gid=pi", devicePath,
+                                   self.drivePath]);
         
         # log the status
         if (status == 0):
-            filer.log("Mounted drive " + mountPoint + " to " + self.drivePath + "\n");
+            filer.log("Mounted drive " + devicePath + " to " + self.drivePath + "\n");
             return True;
         else:
             filer.log("Mounting unsuccessful.\n");
@@ -81,7 +96,7 @@ class Dumper:
     # of the unmounting
     def unmountDrive(self, filer):
         # umount the drive
-        status = os.system("sudo umount " + self.drivePath);
+        status = self.runCommand(["sudo", "umount", self.drivePath]);
         
         # report unmount to the log
         if (status == 0):
@@ -90,54 +105,104 @@ class Dumper:
             filer.log("Unmount unsuccessful.\n");
 
     
+    # Helper function that runs a command, returning its exit status (or -1,
+    # if it couldn't be run at all)
+    def runCommand(self, command):
+        try:
+            return subprocess.call(command);
+        except OSError:
+            return -1;
+
+
     # --------------------- Flash-Drive Dumping -------------------- #
     # Function that, assuming the target drive is plugged into the computer,
-    # dumps every directory in self.dumpDirectories to the flash drive in a
-    # new folder (or the same folder if it already exists). A filer is passed
-    # as a parameter so that any errors can be logged, and a .zip file can be
-    # created if the parameter is given. (If 'zipFirst' is passed in as True,
-    # a .zip archive of all the output is first created, then THAT is sent
-    # to the flash drive).
-    def dumpToDrive(self, filer, zipFirst = False):
+    # dumps every directory in self.dumpDirectories to the flash drive's save
+    # directory. Only files that are new (or have changed) since the last dump
+    # are copied, and an interrupted dump picks up where it left off (see
+    # DriveSync). A filer is passed as a parameter so that any errors can be
+    # logged. (If an 'archiveName' is given, such as "output.zip" or
+    # "output.tar", all the output is instead streamed straight into a single
+    # archive of that name on the drive, with a checksum of every file; the
+    # optional light manager shows its progress). The files are copied with
+    # the given CopyEngine (or a default one)
+    def dumpToDrive(self, filer, archiveName = None, engine = None, lights = None):
         # attempt to mount
-        mountSuccess = self.mountDrive(filer);
+        if (not self.mountDrive(filer)):
+            return;
 
-        # if the directory to save to exists, remove it to make room
-        if (os.path.exists(self.drivePath + self.saveDirectory)):
-            filer.log("  Removing old directory...");
-            os.system("rm -rf " + self.drivePath + self.saveDirectory);        
-        
-        # if zipFirst is true, zip the files and copy this instead
-        if (zipFirst):
-            zipName = "output.zip";
-            filer.packageOutput(zipName);
-            os.system("cp " + filer.path + zipName + self.drivePath +
-                      self.saveDirectory + "/" + zipName);
-        # otherwise, copy the directories directly
+        # if an archive was asked for, write the output into it on the drive
+        if (archiveName != None):
+            archivePath = self.drivePath + self.saveDirectory + "/";
+            try:
+                if (not os.path.isdir(archivePath)):
+                    os.makedirs(archivePath);
+                filer.packageOutput(archiveName, lights, False, archivePath, True);
+            except OSError as e:
+                filer.log("  Couldn't write to the drive: " + str(e) + "\n");
+        # otherwise, sync the directories onto the drive
         else:
-            # walk through the dump directories
-            for i in range(0, len(self.dumpDirectories)):
-                # get the name of the current dump directory
-                dName = self.dumpDirectories[i].split("/");
-                dName = dName[len(dName) - 1];
-                copyPath = self.drivePath + self.saveDirectory + "/" + dName;
-                 
-                # attempt to copy files
-                try:
-                    # copy over the contents of the dump directory and log it
-                    shutil.copytree(self.dumpDirectories[i], copyPath);
-                    filer.log("  Dumping " + dName + "...");
-                # catch exceptions
-                except shutil.Error as e:
-                    filer.log("  Directory: '" + self.dumpDirectories[i] +
-                              "' not copied due to shutil error: " + str(e));
-                except OSError as e:
-                    filer.log("  Directory: '" + self.dumpDirectories[i] +
-                            "' not copied due to OS error: " + str(e));
+            sync = DriveSync(self.drivePath + self.saveDirectory + "/");
+            for directory in self.dumpDirectories:
+                sync.addSource(directory, os.path.basename(directory));
+            syncStart = time.monotonic();
+            try:
+                report = sync.sync(engine);
+                filer.log("  Dumped {c} files ({b} bytes) in {t:.1f} s; skipped {s} files "
+                          "({k} bytes) already on the drive{f}\n".format(
+                          c = report["copied"], b = report["bytesCopied"],
+                          t = time.monotonic() - syncStart, s = report["skipped"],
+                          k = report["bytesSkipped"],
+                          f = "" if report["failed"] == 0 else
+                              "; " + str(report["failed"]) + " files failed"));
+            except (IOError, OSError) as e:
+                filer.log("  Dump interrupted (it'll resume next time): " + str(e) + "\n");
 
         # unmount the usb drive
         self.unmountDrive(filer);
 
 
+    # Starts dumping to the drive on a background thread (unless a dump is
+    # already running), copying no more than 'rate' bytes per second, so the
+    # dash cam can keep recording. The filer is used to log the dump, as in
+    # dumpToDrive(). Returns False if a dump was already running
+    def startDump(self, filer, rate = None):
+        if (self.isDumping()):
+            return False;
+        self.engine = CopyEngine(1, 1024 * 1024, rate);
+        self.finished = False;
+        self.thread = threading.Thread(target = self.runDump, args = (filer, self.engine),
+                                       name = "dumper");
+        self.thread.daemon = True;
+        self.thread.start();
+        return True;
+
 
-        
+    # The background dump's main function
+    def runDump(self, filer, engine):
+        try:
+            self.dumpToDrive(filer, None, engine);
+        finally:
+            self.finished = True;
+
+
+    # Returns a boolean indicating whether or not a background dump is running
+    def isDumping(self):
+        return self.thread != None and self.thread.is_alive();
+
+
+    # Returns True (once) if a background dump has finished since this was
+    # last called
+    def popFinished(self):
+        finished = self.finished;
+        self.finished = False;
+        return finished;
+
+
+    # Cancels the background dump (if there is one), and waits up to
+    # 'timeout' seconds for it to unmount the drive. (It'll pick up where it
+    # left off next time)
+    def stopDump(self, timeout = 10.0):
+        if (not self.isDumping()):
+            return;
+        self.engine.cancel();
+        self.thread.join(timeout);
@@ -1,6 +1,17 @@
 import os;
+import zipfile;
+import tarfile;
+import time;
 import datetime;
+import threading;
 from lights import LightManager;
+from segments import SegmentIndex;
+from storage import StorageBudget;
+from logwriter import LogWriter;
+from journal import TelemetryJournal;
+from catalog import MediaCatalog;
+from packager import Packager;
+from mp4mux import MP4Muxer;
 
 # A class responsible for managing the files of the dash cam
 class Filer:
@@ -11,16 +22,45 @@ class Filer:
     #   passivePath  The path to the directory where passive recordings are
     #                stored on the System
     #   imagePath    The path to the directory where images are stored    
+    #   incidentPath The path to the directory where incident clips are stored.
+    #                (These are never deleted to make room for passive videos)
     #   logPath      The path to the directory where log files are stored
-    #   logString    A temporary string holding log information
+    #   packagePath  The path to the directory where packages (archives of the
+    #                output, built in output mode) are stored
+    #   logWriter    The LogWriter that writes logged text to disk in the
+    #                background
+    #   journal      The TelemetryJournal the dash cam's per-tick state is
+    #                recorded in (alongside the logs)
+    #   logChannel   The log that text is written to by default (SESSION_LOG
+    #                or CONFIG_LOG)
     #   displayLog   A boolean telling whether or not to print any logged
     #                strings to the terminal
+    #   segments     The SegmentIndex of the passive recordings on disk
+    #   images       The SegmentIndex of the images on disk
+    #   incidents    The SegmentIndex of the incident clips on disk
+    #   logs         The SegmentIndex of the log files on disk
+    #   packages     The SegmentIndex of the packages on disk
+    #   logNames     A dictionary mapping the name of each day's log (and
+    #                journal) file, such as "log_2020-1-1.txt", to the numbered
+    #                name it's written under
+    #   logSeq       The sequence number the next new log file will be given
+    #   logLock      A lock guarding 'logNames' and 'logSeq' (log files are
+    #                named on the log writer's thread)
+    #   storage      The StorageBudget deciding when (and which) old files are
+    #                deleted to make room for new ones
+    #   catalog      The MediaCatalog holding the metadata (start times,
+    #                durations, sizes...) of every file
+    #   packager     The Packager that packages the output into an archive
+    #   conversionsPending  Whether or not there may be videos in the catalog
+    #                waiting to be converted to .mp4
     
     # Filer constants:    
-    #   PASSIVE_LIM  The number of video files passive recording will save before
-    #                deleting the oldest one once a new one is created
-    #   LOG_LIM      The length the filer's logString can be before it's written to
-    #                a log file. (Used to minimize file writes)
+    #   QUOTAS       A dictionary holding the share of the card's capacity each
+    #                kind of output ("passive", "incidents", "images", "logs",
+    #                "packages")
+    #                may use before its oldest files are deleted
+    #   SESSION_LOG  The channel for the dash cam's session log
+    #   CONFIG_LOG   The channel for the Configurer's log
 
     # Constructor
     def __init__(self):
@@ -30,22 +70,62 @@ class Filer:
         self.mediaPath = path + "media/";
         self.passivePath = self.mediaPath + "passive/";
         self.imagePath = self.mediaPath + "images/";  
+        self.incidentPath = self.mediaPath + "incidents/";
         self.logPath = path + "logs/";
+        self.packagePath = path + "packages/";
         
         # set up log info
-        self.logString = "";
+        self.SESSION_LOG = 2;
+        self.CONFIG_LOG = 3;
+        self.logChannel = self.SESSION_LOG;
         self.displayLog = True;
         
         # create constants 
-        self.PASSIVE_LIM = 12;
-        self.LOG_LIM = 512;
+        self.QUOTAS = {"passive": 0.65, "incidents": 0.10, "images": 0.07,
+                       "logs": 0.03, "packages": 0.05};
         
-        # check all directories
+        # check all directories, then index the files in them and set up the
+        # storage budget (passive videos are the first to go when it's full)
         self.checkDirectories();
+        self.segments = SegmentIndex(self.passivePath);
+        self.images = SegmentIndex(self.imagePath, ("img_",));
+        self.incidents = SegmentIndex(self.incidentPath, ("inc_",));
+        self.logs = SegmentIndex(self.logPath, ("log_", "config_", "tel_"));
+        self.packages = SegmentIndex(self.packagePath, ("output_",));
+        self.logLock = threading.Lock();
+        self.indexLogNames();
+        self.storage = StorageBudget(self.path);
+        self.storage.addCategory("passive", self.segments, self.passivePath,
+                                 self.QUOTAS["passive"]);
+        self.storage.addCategory("images", self.images, self.imagePath,
+                                 self.QUOTAS["images"]);
+        self.storage.addCategory("logs", self.logs, self.logPath,
+                                 self.QUOTAS["logs"]);
+        self.storage.addCategory("packages", self.packages, self.packagePath,
+                                 self.QUOTAS["packages"]);
+        self.storage.addCategory("incidents", self.incidents, self.incidentPath,
+                                 self.QUOTAS["incidents"], True);
+        self.catalog = MediaCatalog(path + "catalog.db");
+        self.syncCatalog();
+        self.conversionsPending = True;
+        self.packager = Packager(path, path + "package.json");
+        for directory in [self.passivePath, self.incidentPath, self.imagePath, self.logPath]:
+            self.packager.addSource(directory);
+
+        # start the background log writer
+        self.logWriter = LogWriter(lambda channel, when: self.getLogName(
+                                       Filer.makeFileName(channel, when) + ".txt"),
+                                   self.logPath, self.displayLog);
+        self.journal = TelemetryJournal(self.logPath, nameFunc = self.getLogName);
 
 
     # Destructor
     def __del__(self):
+        # write out anything that's still waiting to be logged
+        self.journal.flush();
+        self.logWriter.close();
+        self.catalog.close();
+
         # remove all the .pyc files from the source path
         sourcePath = self.path + "source/";
         if (any(fname.endswith(".pyc") for fname in os.listdir(sourcePath))):
@@ -63,10 +143,40 @@ class Filer:
             os.mkdir(self.passivePath);
         if (not os.path.exists(self.imagePath)):
             os.mkdir(self.imagePath);
+        if (not os.path.exists(self.incidentPath)):
+            os.mkdir(self.incidentPath);
         if (not os.path.exists(self.logPath)):
             os.mkdir(self.logPath);
+        if (not os.path.exists(self.packagePath)):
+            os.mkdir(self.packagePath);
     
     
+    # Rebuilds the index of every output directory (such as after they've been
+    # wiped)
+    def reindex(self):
+        for index in [self.segments, self.images, self.incidents, self.logs, self.packages]:
+            index.build();
+        self.indexLogNames();
+        self.syncCatalog();
+        self.logWriter.reopen();
+
+
+    # Brings the catalog in line with the indexes of what's on disk (adding
+    # files it's missing, and dropping files that are gone)
+    def syncCatalog(self):
+        self.catalog.reconcile("passive", self.segments.sizes, "h264");
+        self.catalog.reconcile("image", self.images.sizes, "jpeg");
+        self.catalog.reconcile("incident", self.incidents.sizes, "h264", True);
+        self.catalog.reconcile("log", self.logs.sizes);
+
+
+    # Returns the number of bytes free on the filesystem holding the dash
+    # cam's files
+    def getFreeSpace(self):
+        stats = os.statvfs(self.path);
+        return stats.f_bavail * stats.f_frsize;
+
+
     # Function that uses the current date-time to generate a name for either a
     # video or an image that will be recorded/captured. The input parameter,
     # "fileType" should be given in the following format:
@@ -74,15 +184,14 @@ class Filer:
     #     1    An image file name
     #     2    A log file name
     #     3    A set-up log file name (used by the Configurer)
+    #     4    An incident clip file name
+    # The name is made from the current date-time (down to the microsecond, so
+    # two files made in quick succession don't collide), unless one is given
     @staticmethod
-    def makeFileName(fileType):
-        now = datetime.datetime.now();
-        name = str(now);
-        name = name[:(str.find(name, ".") + 2)];
-        # replace any spaces with underscores, and periods/colons with dashes
-        name = name.replace(" ", "_");
-        name = name.replace(":", "-");
-        name = name.replace(".", "-");
+    def makeFileName(fileType, now = None):
+        if (now == None):
+            now = datetime.datetime.now();
+        name = now.strftime("%Y-%m-%d_%H-%M-%S-%f");
         
         # add an appropriate prefix and suffix
         if (fileType == 0):
@@ -93,125 +202,311 @@ class Filer:
             name = "log_" + str(now.year) + "-" + str(now.month) + "-" + str(now.day);
         elif (fileType == 3):
             name = "config_" + str(now.year) + "-" + str(now.month) + "-" + str(now.day);
+        elif (fileType == 4):
+            name = "inc_" + name;
         
         # return the name of the file
         return name;
     
 
     # ----------------------- Passive-Recording Files ----------------------- #
-    # Deletes the oldest passive recording from memory to make room for the next
-    def deleteOldestPassive(self):
-        # get the list of files in the passive directory
-        files = os.listdir(self.passivePath);
-
-        # if there's currently only one file, we can assume this might be the
-        # video file currently being taken. Simply return from the function
-        if (len(files) <= 1):
+    # Returns the name for the next passive recording: a video file name (see
+    # makeFileName()) with the recording's sequence number in it
+    def nextVideoName(self):
+        name = Filer.makeFileName(0);
+        return "vid_{s:08d}_".format(s = self.segments.allocate()) + name[4:];
+
+
+    # Returns the name for the next picture, numbered like the passive
+    # recordings (so the oldest is known without trusting the clock)
+    def nextImageName(self):
+        name = Filer.makeFileName(1);
+        return "img_{s:08d}_".format(s = self.images.allocate()) + name[4:];
+
+
+    # Returns the file name for the next incident clip, numbered like the
+    # passive recordings
+    def nextIncidentName(self):
+        name = Filer.makeFileName(4);
+        return "inc_{s:08d}_".format(s = self.incidents.allocate()) + name[4:] + ".h264";
+
+
+    # Returns the numbered name the given day's log (or journal) file is
+    # written under, such as "log_00000007_2020-1-1.txt" for "log_2020-1-1.txt":
+    # the one already on disk, or a new one numbered after every other log
+    # file. (This is called from the log writer's thread, too)
+    def getLogName(self, baseName):
+        with self.logLock:
+            if (baseName not in self.logNames):
+                (prefix, rest) = baseName.split("_", 1);
+                self.logNames[baseName] = "{p}_{s:08d}_{r}".format(p = prefix, s = self.logSeq,
+                                                                   r = rest);
+                self.logSeq += 1;
+            return self.logNames[baseName];
+
+
+    # Helper function that rebuilds 'logNames' from the numbered log files in
+    # the log index, so each day's records keep going to the same file
+    def indexLogNames(self):
+        with self.logLock:
+            self.logNames = {};
+            for fileName in self.logs.sequences:
+                if (SegmentIndex.parseSequence(fileName) != None):
+                    parts = fileName.split("_", 2);
+                    self.logNames[parts[0] + "_" + parts[2]] = fileName;
+            self.logSeq = self.logs.nextSeq;
+
+
+    # Records that the given Video has started recording to the passive directory
+    def videoStarted(self, video):
+        seq = SegmentIndex.parseSequence(video.fileName);
+        if (seq != None):
+            self.segments.add(seq, video.fileName);
+        self.catalog.add(video.fileName, "passive", video.startTime, video.startClock,
+                         None, 0, "h264", "h264", "recording", False, seq);
+
+
+    # Records that the given Video has finished recording, noting its size
+    # (and its duration, in the catalog)
+    def videoClosed(self, video):
+        try:
+            size = os.path.getsize(video.getFullPath());
+        except OSError:
             return;
-        
-        # determine if one should be deleted yet
-        if (len(files) >= self.PASSIVE_LIM and len(files) > 0):
-            remIndex = 0; # the index to remove
-            minTime = os.path.getmtime(self.passivePath + files[0]);
-            
-            # find the file with the earliest creation time
-            for i in range(0, len(files)):                
-                t = os.path.getmtime(self.passivePath + files[i]);                
-                # update the minimum time/remove index
-                if (os.path.isfile(self.passivePath + files[i])
-                    and "vid" in files[i] and t < minTime):
-                    # update the removal index and the minimum time
-                    remIndex = i;
-                    minTime = t;        
-            
-            # remove the oldest file from the directory
-            self.log("Removing Oldest Passive Recording: " + files[remIndex] + "\n");
-            try:
-                os.remove(self.passivePath + files[remIndex]);
-            except OSError as e:
-                self.log("Failed to remove video: %s" % e.strerror)
+        self.segments.setSize(video.fileName, size);
+        self.catalog.finish(video.fileName, video.duration, size);
+        self.conversionsPending = True;
+
+
+    # Records that the given Image has been written to the images directory
+    def imageSaved(self, img):
+        try:
+            size = os.path.getsize(img.getFullPath());
+        except OSError:
+            return;
+        self.images.addNew(img.fileName, size);
+        self.catalog.add(img.fileName, "image", img.captureTime, img.captureClock,
+                         None, size, "jpeg", "jpg");
+
+
+    # Records that an incident clip (of the given size and length, in seconds)
+    # has been written. (It's only just been written, so its footage started
+    # about 'seconds' ago)
+    def incidentSaved(self, clipName, size, seconds = None):
+        self.incidents.addNew(clipName, size);
+        wallStart = None;
+        monoStart = None;
+        if (seconds != None):
+            wallStart = time.time() - seconds;
+            monoStart = time.monotonic() - seconds;
+        self.catalog.add(clipName, "incident", wallStart, monoStart, seconds, size,
+                         "h264", "h264", "raw", True);
+        self.conversionsPending = True;
+
+
+    # ---------------------------- Storage Budget --------------------------- #
+    # Deletes the oldest files of whatever's over its quota, and makes sure the
+    # card has room for 'reserve' more bytes (such as the next passive video)
+    # before it passes its high-water mark. Each deleted file is logged.
+    # Returns a boolean indicating whether or not there's room for 'reserve'
+    def reserveSpace(self, reserve = 0):
+        # bring the log (and journal) files' sizes up to date first
+        written = self.logWriter.popWritten();
+        journalWritten = self.journal.popWritten();
+        for fileName in journalWritten:
+            written[fileName] = written.get(fileName, 0) + journalWritten[fileName];
+        for fileName in written:
+            self.logs.addNew(fileName);
+            self.logs.setSize(fileName, self.logs.getSize(fileName) + written[fileName]);
+            self.catalog.grow(fileName, "log", written[fileName]);
+
+        deleted = self.storage.enforce(reserve);
+        for (category, name, size) in deleted:
+            self.log("Removing oldest " + category + " file: " + name +
+                     " (" + str(size) + " bytes)\n");
+        if (len(deleted) > 0):
+            self.catalog.remove([name for (category, name, size) in deleted]);
+        return self.storage.hasRoom(reserve);
                 
 
     # -------------------- Compression/Conversion Functions ----------------- #
-    # Helper function that creates a .zip file containing all the current .h264,
-    # .mp4, .png, and log .txt files into a zip file at the given path. A light
-    # manager is passed in to have indicator lights display packaging progress
-    def packageOutput(self, zipName, lights):
-        # hold the blue LED to show things are processing
-        lights.setLED([0, 1, 2], False);
-        lights.setLED([2], True);
-        
-        # remove the old .zip, if one exists
-        os.system("rm " + zipName);
-        # use system commands to package all files into a .zip file
-        os.system("zip " + self.path + zipName + " " + self.mediaPath + "*/* " + self.logPath + "*");
+    # Returns the name for a new incremental package, numbered like the
+    # passive recordings. Each increment gets its own archive (in the package
+    # directory, where the oldest are deleted once they're over their quota),
+    # so building one never replaces the files an earlier one holds
+    def nextPackageName(self):
+        stamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S");
+        return "output_{s:08d}_{t}.zip".format(s = self.packages.allocate(), t = stamp);
 
-        # flash the blue and red LEDs to show the zip file was created
-        lights.flashLED([1, 2], 3);
-        lights.setLED([1, 2], False);
 
+    # Helper function that packages the current videos, images and logs into
+    # an archive (a .zip, or a .tar if the name ends in ".tar") at the given
+    # name in the package directory. Media is stored as it is, and only logs
+    # are compressed. If 'incremental' is True, only files added since the last
+    # package are included. A light manager can be passed in to have indicator
+    # lights display packaging progress. If 'destPath' is given, the archive
+    # is streamed straight into that directory (such as on a flash drive)
+    # instead, with nothing staged on the card, and the record of what's been
+    # packaged there is kept alongside it. If 'checksums' is True, the archive
+    # gets a SHA-256 checksum of each member. Returns a boolean indicating
+    # success
+    def packageOutput(self, zipName, lights = None, incremental = False, destPath = None,
+                      checksums = False):
+        # show the package's progress as a bar across the yellow, red and blue
+        # LEDs
+        progress = None;
+        if (lights != None):
+            lights.setLED([0, 1, 2], False);
+            progress = lambda fraction: lights.playPattern(lights.progressBar(fraction, [0, 1, 2]));
+            progress(0.0);
+
+        # make sure the logs on disk are complete first
+        self.journal.flush();
+        self.logWriter.flush();
+        packager = self.packager;
+        inPackages = destPath == None;
+        if (inPackages):
+            destPath = self.packagePath;
+        else:
+            packager = Packager(self.path, destPath + zipName + ".manifest.json");
+            packager.sources = self.packager.sources;
+        packageStart = time.monotonic();
+        try:
+            (files, size) = packager.package(destPath + zipName, incremental, progress,
+                                             checksums);
+        except (IOError, OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+            self.log("Packaging failed: " + str(e) + "\n");
+            if (lights != None):
+                lights.stopPattern("progress");
+                lights.flashLED([1], 3);
+            return False;
+        self.log("Packaged {f} files ({b} bytes) into {n} in {t:.1f} s\n".format(
+                 f = files, b = size, n = destPath + zipName, t = time.monotonic() - packageStart));
+        if (inPackages):
+            # keep the packages within their quota (deleting the oldest)
+            try:
+                self.packages.addNew(zipName, os.path.getsize(destPath + zipName));
+            except OSError:
+                pass;
+            self.reserveSpace();
+
+        # flash the blue and red LEDs to show the package was created
+        if (lights != None):
+            lights.stopPattern("progress");
+            lights.flashLED([1, 2], 3);
+        return True;
 
-    # Function that converts all .h264 videos to .mp4 files, then deletes the
-    # .h264 files. Places the .mp4's in the same location as the .h264's
-    def convertVideos(self, lights):
-        # check to make sure 'gpac' is installed (this has MP4Box)
-        status = os.system("dpkg --get-selections | grep gpac");
-        if (status != 0):
-            os.system("sudo apt-get install gpac");
 
+    # Function that converts all .h264 videos (passive videos and incident
+    # clips) to .mp4 files, then deletes the .h264 files. Places the .mp4's in
+    # the same location as the .h264's
+    def convertVideos(self, lights):
         # turn the blue light on to indicate the pi is busy converting
         lights.setLED([2], True);
 
-        directories = [self.passivePath];
         # iterate through each of the two video directories
-        for i in range(0, len(directories)):
-            # get a list of the files in the directory
-            files = os.listdir(directories[i]);
-
-            # iterate through each file in the directory
-            for j in range(0, len(files)):
+        for (directory, index) in [(self.passivePath, self.segments),
+                                   (self.incidentPath, self.incidents)]:
+            for fileName in sorted(os.listdir(directory)):
                 # if the file is a .h264 file, convert it to .mp4
-                if (".h264" in files[j]):
-                    os.system("MP4Box -add " + directories[i] + files[j] + " " +
-                              directories[i] + files[j].replace(".h264", ".mp4"));
+                if (fileName.endswith(".h264")):
+                    self.convertVideo(directory, fileName, index);
                     # flash the blue LED once to indicate a video was processed
                     lights.flashLED([2], 1);
-                    # remove the .h264 video
-                    os.system("sudo rm " + directories[i] + files[j]);
 
         # flash the blue and red LEDs to show the convertions are complete
         lights.setLED([1, 2], False);
         lights.flashLED([1, 2], 3);
 
+
+    # Converts one .h264 video (in the given directory, and kept in the given
+    # SegmentIndex) to an .mp4, timed by its real duration from the catalog.
+    # Returns a boolean indicating success
+    def convertVideo(self, directory, fileName, index):
+        row = self.catalog.get(fileName);
+        muxer = MP4Muxer();
+        if (row != None):
+            muxer.duration = row["duration"];
+        try:
+            muxer.mux(directory + fileName, directory + fileName[:-len(".h264")] + ".mp4.part");
+        except (IOError, OSError, ValueError) as e:
+            self.log("Couldn't convert " + fileName + ": " + str(e) + "\n");
+            return self.finishConversion(directory, fileName, index, False);
+        return self.finishConversion(directory, fileName, index, True);
+
+
+    # Returns the next video to be converted in the background, as a tuple of
+    # its (directory, file name, SegmentIndex, real duration), or None if
+    # there's nothing left. (The catalog is the queue, so it survives reboots;
+    # the newest videos are converted first, since the oldest are the next to
+    # be deleted)
+    def nextConversion(self):
+        if (not self.conversionsPending):
+            return None;
+        row = self.catalog.nextUnconverted(["passive", "incident"], "h264");
+        if (row == None):
+            self.conversionsPending = False;
+            return None;
+        if (row["kind"] == "incident"):
+            return (self.incidentPath, row["name"], self.incidents, row["duration"]);
+        return (self.passivePath, row["name"], self.segments, row["duration"]);
+
+
+    # Finishes converting a video: if the muxer succeeded, its ".mp4.part"
+    # output takes the place of the .h264 (in the directory, the index and the
+    # catalog). Otherwise, the partial output is deleted and the video is
+    # marked as failed in the catalog. Returns a boolean indicating success
+    def finishConversion(self, directory, fileName, index, success):
+        mp4Name = fileName[:-len(".h264")] + ".mp4";
+        partPath = directory + mp4Name + ".part";
+        # the video may have been deleted (to make room) while it was converted
+        if (success and fileName not in index.sequences):
+            success = False;
+        elif (success):
+            try:
+                os.replace(partPath, directory + mp4Name);
+                os.remove(directory + fileName);
+            except OSError as e:
+                self.log("Couldn't replace " + fileName + ": " + str(e) + "\n");
+                success = False;
+        if (not success):
+            if (os.path.exists(partPath)):
+                os.remove(partPath);
+            self.catalog.setState(fileName, "failed");
+            return False;
+
+        size = os.path.getsize(directory + mp4Name);
+        index.rename(fileName, mp4Name);
+        index.setSize(mp4Name, size);
+        self.catalog.converted(fileName, mp4Name, "mp4", size);
+        return True;
+
     
     
-    # -------------------------- Logging Functions -------------------------- #
-    # Takes the given string and "logs" it. Usually, this means appending it to
-    # the end of the filer's logString. If the "forceWrite" parameter is True,
-    # then whatever is in the logString will immediately be written to the file.
-    def log(self, text, forceWrite = False):
-        self.logString += text;
-        
-        # if display is true, print to console
-        if (self.displayLog):
-            print(text.replace("\n", ""));
-
-        # determine what kind of log file this is
-        logType = 2;
-        if ("config" in self.logString.lower()):
-            logType = 3;
-        
-        # if the log string has exceeded its length, write it to the log file
-        if (len(self.logString) >= self.LOG_LIM or forceWrite):
-            # make a file name and open it for writing
-            fname = Filer.makeFileName(logType);
-            f = open(self.logPath + fname + ".txt", "a+");
-            
-            # write the text and close the file
-            f.write(self.logString);
-            f.close();
-            
-            # reset the log string
-            self.logString = "";
+    # ------------------------------- Uploads ------------------------------- #
+    # Returns a list of (full path, name, kind) tuples for the media that's
+    # ready to be uploaded (finished, and converted if it's a video) but
+    # hasn't been
+    def pendingUploads(self):
+        directories = {"passive": self.passivePath, "incident": self.incidentPath,
+                       "image": self.imagePath};
+        return [(directories[row["kind"]] + row["name"], row["name"], row["kind"])
+                for row in self.catalog.pendingUploads(list(directories), "h264")];
 
 
+    # Records that the file with the given name has been uploaded
+    def fileUploaded(self, name):
+        self.catalog.setUploaded(name);
+
+
+    # -------------------------- Logging Functions -------------------------- #
+    # Takes the given string and "logs" it: it's handed to the background log
+    # writer, to be written to the given channel's log file (or the filer's
+    # logChannel, if none is given). If the "forceWrite" parameter is True, this
+    # waits until everything logged so far has been written to the file.
+    def log(self, text, forceWrite = False, channel = None):
+        if (channel == None):
+            channel = self.logChannel;
+        self.logWriter.write(channel, text);
+        if (forceWrite):
+            self.logWriter.flush();
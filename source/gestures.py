@@ -0,0 +1,150 @@
+import time;
+
+# A class that turns the ButtonManager's press/release events into gestures,
+# so every mode reads the buttons the same way. Durations are measured from
+# the events' own timestamps, so they're exact no matter how often update()
+# is called. The gestures are:
+#   "click"           a button was released before its hold time
+#   "hold"            a button was released after its hold time
+#   "held"            a button has been held down for its hold time (sent once,
+#                     while it's still down, so the user can be shown that
+#                     letting go now will count as a "hold")
+#   "chord"           both buttons have been held down together for the chord
+#                     time (sent once, while they're still down)
+#   "chord-release"   both buttons were down together, and have now both been
+#                     released. (Neither sends a "click" or "hold")
+class GestureRecognizer:
+
+    # GestureRecognizer properties:
+    #   buttons     The ButtonManager the events come from
+    #   holdTimes   An array of the hold time (in seconds) of each button
+    #   chordTime   The time (in seconds) both buttons must be held for a chord
+    #   pressTimes  An array of the monotonic time each button was pressed (or
+    #               None, if it's up)
+    #   ignoring    An array of booleans: whether each button's press came
+    #               before the last reset (so its release is ignored)
+    #   chordStart  The monotonic time both buttons went down together (or
+    #               None, if they haven't since they were last both up)
+    #   sent        A set of the "held"/"chord" gestures already sent for the
+    #               current presses
+
+    # Constructor: takes the ButtonManager, each button's hold time, and the
+    # chord time
+    def __init__(self, buttons, holdTimes = (1.0, 1.0), chordTime = 2.0):
+        self.buttons = buttons;
+        self.holdTimes = list(holdTimes);
+        self.chordTime = chordTime;
+        self.pressTimes = [None] * len(buttons.pins);
+        self.ignoring = [False] * len(buttons.pins);
+        self.chordStart = None;
+        self.sent = set();
+
+
+    # Sets the hold times and chord time (such as when switching modes), and
+    # resets the recognizer
+    def setTimes(self, holdTimes, chordTime):
+        self.holdTimes = list(holdTimes);
+        self.chordTime = chordTime;
+        self.reset();
+
+
+    # Forgets any presses in progress: buttons that are down now are ignored
+    # until they're released (so a button held to leave one mode doesn't
+    # count in the next)
+    def reset(self):
+        self.buttons.popEvents();
+        for i in range(0, len(self.pressTimes)):
+            self.ignoring[i] = self.buttons.states[i];
+            self.pressTimes[i] = None;
+        self.chordStart = None;
+        self.sent = set();
+
+
+    # Returns the time (in seconds) the given button has been held down for
+    # (0 if it's up)
+    def getHoldTime(self, index, now = None):
+        if (self.pressTimes[index] == None):
+            return 0.0;
+        if (now == None):
+            now = time.monotonic();
+        return max(0.0, now - self.pressTimes[index]);
+
+
+    # ---------------------------- Recognizing ---------------------------- #
+    # Reads the events that have come in since the last call, and returns a
+    # list of the Gestures they (and the time that's passed) make, in order
+    def update(self, now = None):
+        self.buttons.poll();
+        gestures = [];
+        for (index, pressed, eventTime) in self.buttons.popEvents():
+            if (pressed):
+                self.press(index, eventTime);
+            else:
+                self.release(index, eventTime, gestures);
+
+        # send "held" and "chord" for anything that's been down long enough
+        if (now == None):
+            now = time.monotonic();
+        if (self.chordStart != None):
+            if ("chord" not in self.sent and all(t != None for t in self.pressTimes) and
+                now - self.chordStart >= self.chordTime):
+                self.sent.add("chord");
+                gestures.append(Gesture("chord", None, now - self.chordStart));
+        else:
+            for i in range(0, len(self.pressTimes)):
+                if (self.pressTimes[i] != None and i not in self.sent and
+                    now - self.pressTimes[i] >= self.holdTimes[i]):
+                    self.sent.add(i);
+                    gestures.append(Gesture("held", i, now - self.pressTimes[i]));
+        return gestures;
+
+
+    # Helper function that handles a button being pressed at the given time
+    def press(self, index, eventTime):
+        self.ignoring[index] = False;
+        self.pressTimes[index] = eventTime;
+        self.sent.discard(index);
+        # both buttons down at once makes a chord
+        if (self.chordStart == None and all(t != None for t in self.pressTimes)):
+            self.chordStart = eventTime;
+
+
+    # Helper function that handles a button being released at the given time,
+    # adding any gesture it completes to the list
+    def release(self, index, eventTime, gestures):
+        pressTime = self.pressTimes[index];
+        self.pressTimes[index] = None;
+        if (self.ignoring[index] or pressTime == None):
+            self.ignoring[index] = False;
+            return;
+        if (self.chordStart != None):
+            # the chord ends once both buttons are up
+            if (all(t == None for t in self.pressTimes)):
+                gestures.append(Gesture("chord-release", None, eventTime - self.chordStart));
+                self.chordStart = None;
+                self.sent = set();
+            return;
+        duration = eventTime - pressTime;
+        kind = "hold" if duration >= self.holdTimes[index] else "click";
+        gestures.append(Gesture(kind, index, duration));
+
+
+# A small class describing one gesture
+class Gesture:
+
+    # Gesture properties:
+    #   kind        The kind of gesture (see GestureRecognizer)
+    #   button      The index of the button (or None, for a chord)
+    #   duration    How long (in seconds) the button(s) were held
+
+    # Constructor: takes the kind, button and duration
+    def __init__(self, kind, button, duration):
+        self.kind = kind;
+        self.button = button;
+        self.duration = duration;
+
+
+    # Returns a string describing the gesture (for the log)
+    def __str__(self):
+        name = {None: "both", 0: "power", 1: "capture"}.get(self.button, str(self.button));
+        return "{k} ({n}, {d:.2f} s)".format(k = self.kind, n = name, d = self.duration);
@@ -0,0 +1,85 @@
+import os;
+
+# A class that watches for a flash drive being plugged in or pulled out. The
+# drive is matched by its filesystem label (or UUID), through the links udev
+# keeps in /dev/disk/by-label (and /dev/disk/by-uuid), and is confirmed in
+# /sys/class/block, so it's found no matter which /dev/sd* it turns up as.
+# Where it's mounted (if it is) is read from /proc/mounts. Every one of these
+# paths is under 'root', so the watcher can be pointed at a fake tree.
+class DriveWatcher:
+
+    # DriveWatcher properties:
+    #   label       The filesystem label of the drive to watch for (or None)
+    #   uuid        The filesystem UUID of the drive to watch for (or None)
+    #   root        The directory the /dev, /sys and /proc paths are under
+    #   device      The name of the drive's block device (such as "sda1") as
+    #               of the last poll(), or None if it wasn't plugged in
+
+    # Constructor: takes the label and/or UUID of the drive, and the root
+    # directory (such as a fake sysfs/devfs tree) to look under
+    def __init__(self, label = None, uuid = None, root = "/"):
+        self.label = label;
+        self.uuid = uuid;
+        self.root = os.path.join(root, "");
+        self.device = None;
+
+
+    # --------------------------- Watching --------------------------- #
+    # Checks whether the drive has been plugged in or pulled out since the
+    # last poll. Returns "added", "removed" or None (nothing changed)
+    def poll(self):
+        device = self.findDevice();
+        if (device == self.device):
+            return None;
+        # a drive that turns up as a different device was pulled out and
+        # plugged back in; treat it as arriving again
+        event = "added" if device != None else "removed";
+        self.device = device;
+        return event;
+
+
+    # Returns the name of the drive's block device (such as "sda1"), or None
+    # if it isn't plugged in
+    def findDevice(self):
+        links = [];
+        if (self.label != None):
+            # udev escapes spaces (and other odd characters) in label links
+            links.append(self.root + "dev/disk/by-label/" + self.label.replace(" ", "\\x20"));
+        if (self.uuid != None):
+            links.append(self.root + "dev/disk/by-uuid/" + self.uuid);
+        for link in links:
+            if (not os.path.lexists(link)):
+                continue;
+            device = os.path.basename(os.path.realpath(link));
+            # make sure the kernel still has the device (a link can outlive it
+            # for a moment when the drive's pulled out)
+            if (os.path.exists(self.root + "sys/class/block/" + device)):
+                return device;
+        return None;
+
+
+    # Returns the path of the drive's block device (such as "/dev/sda1"), or
+    # None if it isn't plugged in
+    def getDevicePath(self):
+        device = self.findDevice();
+        if (device == None):
+            return None;
+        return "/dev/" + device;
+
+
+    # Returns the directory the drive is mounted at (according to
+    # /proc/mounts), or None if it isn't mounted
+    def getMountPoint(self):
+        device = self.findDevice();
+        if (device == None):
+            return None;
+        try:
+            with open(self.root + "proc/mounts", "r") as f:
+                for line in f:
+                    fields = line.split();
+                    if (len(fields) >= 2 and fields[0] == "/dev/" + device):
+                        # spaces (and the like) are escaped as octal in mounts
+                        return fields[1].replace("\\040", " ").replace("\\011", "\t");
+        except (IOError, OSError):
+            pass;
+        return None;
@@ -1,3 +1,7 @@
+import queue;
+import threading;
+import time;
+
 # A class used to represent the information regarding an Image taken by the
 # Raspberry Pi Camera Module v2. Contains file path/name information.
 class Image:
@@ -5,10 +9,21 @@ class Image:
     # Image properties:
     #   fileName    The name of the file the image is saved to
     #   filePath    The path to the directory in which the file is contained
+    #   latency     The time (in seconds) from the start of the capture until
+    #               the image was written to disk (None until it's written)
+    #   lostFrames  The number of recorded video frames lost while the image
+    #               was captured (None if it couldn't be measured)
+    #   captureTime The wall-clock time (seconds since the epoch) the image
+    #               was captured (None until it has been)
+    #   captureClock  The monotonic time the image was captured
     
     def __init__(self, name, path):
         self.fileName = name + ".jpg";
         self.filePath = path;
+        self.captureTime = None;
+        self.captureClock = None;
+        self.latency = None;
+        self.lostFrames = None;
     
 
     # --------------------- Setter Functions ---------------------- #
@@ -24,3 +39,68 @@ class Image:
     def getFullPath(self):
         return self.filePath + self.fileName;
 
+
+# A class that writes captured images to disk on a background thread, so the
+# camera's caller only has to wait for the capture itself. The queue of images
+# waiting to be written is bounded: if it's full, new images are dropped
+# rather than making the caller wait.
+class ImageWriter:
+
+    # ImageWriter properties:
+    #   queue       The queue of (Image, data, capture start, SegmentOutput,
+    #               frame time) tuples waiting to be written
+    #   finished    A list of Image objects that have been written (or failed
+    #               to be), waiting to be reported
+    #   lock        A lock guarding the finished list
+    #   thread      The thread the images are written on
+
+    # ImageWriter constants:
+    #   QUEUE_LIMIT The most images that may be waiting to be written
+
+    # Constructor: starts the writer thread
+    def __init__(self, queueLimit = 4):
+        self.QUEUE_LIMIT = queueLimit;
+        self.queue = queue.Queue(maxsize = self.QUEUE_LIMIT);
+        self.finished = [];
+        self.lock = threading.Lock();
+        self.thread = threading.Thread(target = self.run, name = "images");
+        self.thread.daemon = True;
+        self.thread.start();
+
+
+    # Queues an image's (encoded) data to be written. The time the capture
+    # started is used to measure the image's latency, and the SegmentOutput
+    # being recorded at the time (if any) is used to measure any lost frames.
+    # Returns False (dropping the image) if the queue is full
+    def submit(self, img, data, captureStart, output = None, frameTime = None):
+        try:
+            self.queue.put_nowait((img, data, captureStart, output, frameTime));
+            return True;
+        except queue.Full:
+            return False;
+
+
+    # The writer thread's main function: writes each queued image to disk
+    def run(self):
+        while (True):
+            (img, data, captureStart, output, frameTime) = self.queue.get();
+            try:
+                with open(img.getFullPath(), "wb") as f:
+                    f.write(data);
+                img.latency = time.monotonic() - captureStart;
+            except (IOError, OSError):
+                img.latency = None;
+
+            # any gap in the recording since the capture began is frames lost
+            if (output != None and frameTime != None):
+                img.lostFrames = max(0, int(round(output.maxGap / frameTime)) - 1);
+            with self.lock:
+                self.finished.append(img);
+
+
+    # Returns (and forgets) the list of images that have been written
+    def popFinished(self):
+        with self.lock:
+            finished = self.finished;
+            self.finished = [];
+        return finished;
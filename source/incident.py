@@ -0,0 +1,149 @@
+import queue;
+import threading;
+from collections import deque;
+
+# A class that keeps the last few seconds of encoded video in memory (a
+# circular buffer fed by the same encoder that writes the passive videos), so
+# when something happens the footage from *before* the button was pressed can
+# be saved, along with the next few seconds, to a protected incident file.
+# Clips are written on a background thread, so the main loop never waits on it.
+class IncidentRecorder:
+
+    # IncidentRecorder properties:
+    #   incidentPath    The directory incident clips are saved to
+    #   capacity        The most bytes the circular buffer may hold
+    #   chunks          The circular buffer: a deque of (timestamp, isHeader,
+    #                   data) tuples, one per buffer the encoder wrote
+    #   size            The number of bytes currently in the buffer
+    #   lastTimestamp   The camera timestamp (microseconds) of the newest frame
+    #   lock            A lock guarding the buffer (it's fed from the camera's
+    #                   thread)
+    #   clipQueue       The queue new data is passed along on while a clip's
+    #                   post-roll is being recorded (None otherwise)
+    #   clipEnd         The camera timestamp at which the current clip ends
+    #   finished        A list of (file name, bytes, seconds) tuples describing
+    #                   clips that have been written, waiting to be logged
+
+    # IncidentRecorder constants:
+    #   PRE_SECONDS     The seconds of footage kept from before the trigger
+    #   POST_SECONDS    The seconds of footage recorded after the trigger
+    #   MEMORY_LIMIT    The most memory (in bytes) the buffer may ever use.
+    #                   (The default suits a 1 GB Pi)
+
+    # Constructor: takes the directory to save clips to and the bitrate the
+    # video is encoded at, plus optional pre-/post-roll lengths and memory limit
+    def __init__(self, incidentPath, bitrate, preSeconds = 20.0,
+                 postSeconds = 10.0, memoryLimit = 48 * 1024 * 1024):
+        # create constants
+        self.PRE_SECONDS = preSeconds;
+        self.POST_SECONDS = postSeconds;
+        self.MEMORY_LIMIT = memoryLimit;
+
+        # size the buffer for the pre-roll (with a little room for bitrate
+        # spikes), but never past the memory limit
+        self.capacity = min(self.MEMORY_LIMIT, int(bitrate / 8.0 * preSeconds * 1.25));
+
+        self.incidentPath = incidentPath;
+        self.chunks = deque();
+        self.size = 0;
+        self.lastTimestamp = None;
+        self.lock = threading.Lock();
+        self.clipQueue = None;
+        self.clipEnd = None;
+        self.finished = [];
+
+
+    # --------------------------- Buffering --------------------------- #
+    # Adds a buffer written by the encoder (and the frame it belongs to) to the
+    # circular buffer, dropping the oldest data once it's over capacity. This
+    # is called from the camera's thread, so it must never block
+    def feed(self, data, frame):
+        with self.lock:
+            if (frame != None and frame.timestamp != None):
+                self.lastTimestamp = frame.timestamp;
+            isHeader = frame != None and getattr(frame, "header", False);
+            self.chunks.append((self.lastTimestamp, isHeader, data));
+            self.size += len(data);
+            while (self.size > self.capacity and len(self.chunks) > 1):
+                self.size -= len(self.chunks.popleft()[2]);
+
+            # pass the data along to a clip that's still recording
+            if (self.clipQueue != None):
+                self.clipQueue.put(data);
+                if (self.lastTimestamp != None and self.lastTimestamp >= self.clipEnd):
+                    self.clipQueue.put(None);
+                    self.clipQueue = None;
+
+
+    # ---------------------------- Clips ------------------------------ #
+    # Starts saving an incident clip with the given name: the buffered
+    # pre-roll plus the next POST_SECONDS of footage. Returns right away (the
+    # clip is written on a background thread). Returns False if a clip is
+    # already being recorded, or if there's nothing buffered yet
+    def saveClip(self, clipName):
+        with self.lock:
+            if (self.clipQueue != None or self.lastTimestamp == None):
+                return False;
+
+            # start from the newest header at least PRE_SECONDS old (or the
+            # oldest header still in the buffer), so the clip is decodable
+            target = self.lastTimestamp - self.PRE_SECONDS * 1000000.0;
+            start = None;
+            for i in range(0, len(self.chunks)):
+                (timestamp, isHeader, data) = self.chunks[i];
+                if (isHeader and (start == None or
+                                  (timestamp != None and timestamp <= target))):
+                    start = i;
+                elif (timestamp != None and timestamp > target and start != None):
+                    break;
+            if (start == None):
+                return False;
+            preRoll = [self.chunks[i][2] for i in range(start, len(self.chunks))];
+            startTimestamp = self.chunks[start][0];
+
+            self.clipQueue = queue.Queue();
+            self.clipEnd = self.lastTimestamp + self.POST_SECONDS * 1000000.0;
+            clipQueue = self.clipQueue;
+
+        thread = threading.Thread(target = self.writeClip, name = "incident",
+                                  args = (clipName, preRoll, startTimestamp, clipQueue));
+        thread.daemon = True;
+        thread.start();
+        return True;
+
+
+    # Writes a clip (run on a background thread): the pre-roll first, then
+    # whatever arrives on the clip's queue until the post-roll is over (or the
+    # recording stops feeding it)
+    def writeClip(self, clipName, preRoll, startTimestamp, clipQueue):
+        written = 0;
+        with open(self.incidentPath + clipName, "wb") as f:
+            for data in preRoll:
+                f.write(data);
+                written += len(data);
+            while (True):
+                try:
+                    data = clipQueue.get(timeout = self.POST_SECONDS + 5.0);
+                except queue.Empty:
+                    break;
+                if (data == None):
+                    break;
+                f.write(data);
+                written += len(data);
+
+        # stop feeding the queue if the recording stalled before the end
+        with self.lock:
+            if (self.clipQueue is clipQueue):
+                self.clipQueue = None;
+            seconds = 0.0;
+            if (startTimestamp != None and self.lastTimestamp != None):
+                seconds = (min(self.lastTimestamp, self.clipEnd) - startTimestamp) / 1000000.0;
+            self.finished.append((clipName, written, seconds));
+
+
+    # Returns (and forgets) the list of clips that have finished writing
+    def popFinished(self):
+        with self.lock:
+            finished = self.finished;
+            self.finished = [];
+        return finished;
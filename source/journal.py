@@ -0,0 +1,225 @@
+import os;
+import sys;
+import struct;
+import argparse;
+import datetime;
+
+# A class that records the dash cam's per-tick state (LEDs, buttons, CPU
+# temperature, segment and loop latency) as fixed-width binary records in an
+# append-only journal, one file per day. Records are packed into memory and
+# written out in batches, so the card sees one small write a minute instead of
+# a line of text every second. Run this file to decode a journal.
+class TelemetryJournal:
+
+    # TelemetryJournal properties:
+    #   path        The directory journal files are written to
+    #   nameFunc    A function that maps a day's journal file name to the name
+    #               it's written under (or None, to use it as it is)
+    #   buffer      A bytearray of packed records waiting to be written
+    #   count       The number of records in the buffer
+    #   written     A dictionary mapping journal file names to the bytes
+    #               written to them that haven't been reported yet
+
+    # TelemetryJournal constants:
+    #   HEADER      The struct each journal file starts with: a magic string,
+    #               the format version and the size of each record
+    #   RECORD      The struct each record is packed with:
+    #                 d   wall-clock time (seconds since the epoch)
+    #                 B   LED bitmask (bit i is set if LED i is on)
+    #                 H   power button hold time (tenths of a second)
+    #                 H   capture button hold time (tenths of a second)
+    #                 h   CPU temperature (tenths of a degree Celsius)
+    #                 I   sequence number of the segment being recorded
+    #                 I   longest main loop iteration since the last record
+    #                     (microseconds)
+    #   MAGIC       The magic string at the start of every journal file
+    #   VERSION     The journal format's version
+    #   FLUSH_COUNT The number of records buffered before they're written
+
+    # Constructor: takes the directory to write the journal to, and optionally
+    # a function that takes the name of a day's journal file (see
+    # makeFileName()) and returns the name to write it under
+    def __init__(self, path, flushCount = 60, nameFunc = None):
+        self.HEADER = struct.Struct("<4sBxH");
+        self.RECORD = struct.Struct("<dBHHhII");
+        self.MAGIC = b"DCTJ";
+        self.VERSION = 1;
+        self.FLUSH_COUNT = flushCount;
+
+        self.path = path;
+        self.nameFunc = nameFunc;
+        self.buffer = bytearray();
+        self.count = 0;
+        self.written = {};
+
+
+    # --------------------------- Recording --------------------------- #
+    # Adds a record to the journal (see RECORD). Once FLUSH_COUNT records have
+    # built up, they're written to the day's journal file
+    def append(self, when, leds, powerHeld, captureHeld, temp, segment, latency):
+        self.buffer += self.RECORD.pack(when, leds,
+                                        min(65535, int(powerHeld * 10)),
+                                        min(65535, int(captureHeld * 10)),
+                                        max(-32768, min(32767, int(round(temp * 10)))),
+                                        segment & 0xFFFFFFFF,
+                                        min(0xFFFFFFFF, int(latency * 1000000)));
+        self.count += 1;
+        if (self.count >= self.FLUSH_COUNT):
+            self.flush();
+
+
+    # Writes every buffered record to the day's journal file (writing the file's
+    # header first, if it's new). A torn record at the end of the file (from a
+    # power loss) is cut off first, so the new records stay aligned. If the
+    # write fails, the file is cut back to where it was, and the records are
+    # kept
+    def flush(self):
+        if (self.count == 0):
+            return;
+        fileName = TelemetryJournal.makeFileName(datetime.datetime.now());
+        if (self.nameFunc != None):
+            fileName = self.nameFunc(fileName);
+        fullPath = self.path + fileName;
+        try:
+            with open(fullPath, "ab", buffering = 0) as f:
+                before = os.fstat(f.fileno()).st_size;
+                data = self.buffer;
+                if (before < self.HEADER.size):
+                    # a new file (or one whose header was cut short)
+                    start = 0;
+                    data = self.HEADER.pack(self.MAGIC, self.VERSION,
+                                            self.RECORD.size) + data;
+                else:
+                    start = before - (before - self.HEADER.size) % self.RECORD.size;
+                if (start != before):
+                    f.truncate(start);
+                try:
+                    offset = 0;
+                    while (offset < len(data)):
+                        offset += f.write(data[offset:]);
+                except (IOError, OSError):
+                    # take back any part of the records that made it
+                    f.truncate(start);
+                    raise;
+        except (IOError, OSError):
+            return;
+        self.written[fileName] = self.written.get(fileName, 0) + start + len(data) - before;
+        self.buffer = bytearray();
+        self.count = 0;
+
+
+    # Returns (and forgets) a dictionary of the bytes written to each journal
+    # file since this was last called
+    def popWritten(self):
+        written = self.written;
+        self.written = {};
+        return written;
+
+
+    # Returns the journal file name for the given date
+    @staticmethod
+    def makeFileName(now):
+        return "tel_" + str(now.year) + "-" + str(now.month) + "-" + str(now.day) + ".bin";
+
+
+    # ---------------------------- Decoding ---------------------------- #
+    # Reads a journal file and yields each of its records as a tuple of
+    # (time, leds, power held, capture held, temperature, segment, latency),
+    # converted back to seconds and degrees
+    def read(self, fullPath):
+        with open(fullPath, "rb") as f:
+            header = f.read(self.HEADER.size);
+            if (len(header) < self.HEADER.size):
+                return;
+            (magic, version, recordSize) = self.HEADER.unpack(header);
+            if (magic != self.MAGIC or recordSize != self.RECORD.size):
+                raise ValueError(fullPath + " is not a version " + str(self.VERSION) +
+                                 " telemetry journal");
+            while (True):
+                data = f.read(recordSize * 1024);
+                if (len(data) < recordSize):
+                    return;
+                # a record cut short (by a power loss) is ignored
+                for record in self.RECORD.iter_unpack(data[:len(data) - len(data) % recordSize]):
+                    (when, leds, power, capture, temp, segment, latency) = record;
+                    yield (when, leds, power / 10.0, capture / 10.0, temp / 10.0,
+                           segment, latency / 1000000.0);
+
+
+# Helper function for the CLI that turns a time given on the command line
+# ("YYYY-MM-DD HH:MM[:SS]", or "HH:MM[:SS]" for today) into seconds since the
+# epoch
+def parseTime(text):
+    try:
+        return datetime.datetime.strptime(text, "%Y-%m-%d %H:%M:%S").timestamp();
+    except ValueError:
+        pass;
+    try:
+        return datetime.datetime.strptime(text, "%Y-%m-%d %H:%M").timestamp();
+    except ValueError:
+        pass;
+    for timeFormat in ["%H:%M:%S", "%H:%M"]:
+        try:
+            clock = datetime.datetime.strptime(text, timeFormat).time();
+            return datetime.datetime.combine(datetime.date.today(), clock).timestamp();
+        except ValueError:
+            pass;
+    raise argparse.ArgumentTypeError("can't read time '" + text + "'");
+
+
+# Decodes journal files given on the command line, optionally filtering them by
+# time range and summarizing them per minute
+def main(args):
+    parser = argparse.ArgumentParser(description = "Decode dash cam telemetry journals");
+    parser.add_argument("files", nargs = "+", help = "journal (tel_*.bin) files");
+    parser.add_argument("--start", type = parseTime, help = "only records from this time on");
+    parser.add_argument("--end", type = parseTime, help = "only records before this time");
+    parser.add_argument("--minutes", action = "store_true",
+                        help = "print per-minute summaries instead of every record");
+    options = parser.parse_args(args);
+
+    journal = TelemetryJournal("");
+    summary = None;
+    for fullPath in options.files:
+        for record in journal.read(fullPath):
+            (when, leds, power, capture, temp, segment, latency) = record;
+            if ((options.start != None and when < options.start) or
+                (options.end != None and when >= options.end)):
+                continue;
+            stamp = datetime.datetime.fromtimestamp(when);
+
+            if (not options.minutes):
+                print("{t}  [LED: {l}]  [Button: {p:.1f}|{c:.1f}]  [CPU Temp: {d:.1f}]  "
+                      "[Segment: {s}]  [Loop: {m:.1f} ms]".format(
+                      t = stamp.strftime("%Y-%m-%d %H:%M:%S"),
+                      l = "".join(str((leds >> i) & 1) for i in range(0, 3)), p = power,
+                      c = capture, d = temp, s = segment, m = latency * 1000.0));
+                continue;
+
+            # gather per-minute statistics, printing each minute once it's over
+            minute = stamp.strftime("%Y-%m-%d %H:%M");
+            if (summary == None or summary[0] != minute):
+                printSummary(summary);
+                summary = [minute, 0, 0.0, temp, 0.0, set()];
+            summary[1] += 1;
+            summary[2] += temp;
+            summary[3] = max(summary[3], temp);
+            summary[4] = max(summary[4], latency);
+            summary[5].add(segment);
+    printSummary(summary);
+    return 0;
+
+
+# Helper function for main() that prints one minute's summary
+def printSummary(summary):
+    if (summary == None):
+        return;
+    (minute, count, tempTotal, tempMax, latencyMax, segments) = summary;
+    print("{m}  [Records: {n:3d}]  [CPU Temp: avg {a:.1f}, max {x:.1f}]  "
+          "[Max Loop: {l:.1f} ms]  [Segments: {s}]".format(
+          m = minute, n = count, a = tempTotal / count, x = tempMax,
+          l = latencyMax * 1000.0, s = ",".join(str(s) for s in sorted(segments))));
+
+
+if (__name__ == "__main__"):
+    sys.exit(main(sys.argv[1:]));
@@ -1,85 +1,275 @@
 import RPi.GPIO as GPIO;
 import time;
+import threading;
 
 # A class responsible for managing the LEDs connected to the pi, depending
-# on the current mode of the dash cam.
+# on the current mode of the dash cam. Each LED has a steady state (set with
+# setLED()), and patterns (blinks, a heartbeat, a progress bar...) can be
+# played over the top of it: they're driven by a background thread, so
+# playing one never holds up the caller. Where patterns overlap, the one with
+# the highest priority shows; when it ends, whatever's underneath shows again.
+# A pin is only written when its level actually changes.
 #   LED Order of appearance (in arrays):
 #     0   yellow LED ("running" indicator)
 #     1   red LED ("rolling" indicator)
 #     2   blue LED (not sure yet)
 class LightManager:
-    
+
     # LightManager properties:
     #   pins    An array containing the numbers of the GPIO pins used as output
     #           pins for the LEDs
     #   states  An array containing GPIO.HIGHs and GPIO.LOWs, indicating which
-    #           of the LEDs are on, and which are off, at any given time
-    
-    # Constructor: sets up the GPIO pins
+    #           of the LEDs are on, and which are off (underneath any
+    #           patterns), at any given time
+    #   written An array of the levels last written to each pin (or None)
+    #   patterns  A list of the LightPatterns playing
+    #   condition A threading.Condition guarding the above, which wakes the
+    #           pattern thread when there's something new to play
+    #   stopping  Whether or not the pattern thread has been asked to stop
+    #   thread  The pattern thread
+
+    # LightManager constants:
+    #   FLASH_TIME  The time (in seconds) of each half of a flash
+
+    # Constructor: sets up the GPIO pins, and starts the pattern thread
     def __init__(self):
+        self.FLASH_TIME = 0.075;
+
         # set up pin numbers and initial states
         self.pins = [18, 24, 27];
         self.states = [GPIO.LOW, GPIO.LOW, GPIO.LOW];
-        
+        self.written = [None, None, None];
+        self.patterns = [];
+        self.condition = threading.Condition();
+        self.stopping = False;
+
         # set up GPIO layout/settings
         GPIO.setmode(GPIO.BCM);
         GPIO.setwarnings(False);
-        
+
         # set up the GPIO pins to be output pins, and toggle each pin
         for i in range(0, len(self.pins)):
             GPIO.setup(self.pins[i], GPIO.OUT);
             self.setLED([i], self.states[i] == GPIO.HIGH);
 
-    
-    # Destructor: resets the GPIO pins
+        self.thread = threading.Thread(target = self.run, name = "lights");
+        self.thread.daemon = True;
+        self.thread.start();
+
+
+    # Destructor: stops the pattern thread and resets the GPIO pins
     def __del__(self):
+        with self.condition:
+            self.stopping = True;
+            self.condition.notify_all();
+        if (self.thread.is_alive() and self.thread != threading.current_thread()):
+            self.thread.join(1.0);
         # clean up
         GPIO.cleanup();
-    
-    
+
+
     # ---------------------------- LED Managing ----------------------------- #
     # Function that sets the LEDs at the given indexes to the given state
-    # (state = True (ON), or False (OFF))
+    # (state = True (ON), or False (OFF)). Any pattern playing on an LED
+    # stays on top of its new state
     def setLED(self, indexes, state):
         # translate the state to GPIO-terms
         if (state): state = GPIO.HIGH;
         else: state = GPIO.LOW;
 
-        # iterate through each index
-        for i in range(0, len(indexes)):
-            # make sure the index is within bounds
-            if (indexes[i] > -1 and indexes[i] < len(self.pins)):
-                # update the LED's state
-                self.states[indexes[i]] = state;
-                # toggle the GPIO pin
-                GPIO.output(self.pins[indexes[i]], state);
-    
-    
+        with self.condition:
+            # iterate through each index
+            for i in range(0, len(indexes)):
+                # make sure the index is within bounds
+                if (indexes[i] > -1 and indexes[i] < len(self.pins)):
+                    # update the LED's state
+                    self.states[indexes[i]] = state;
+            # update the GPIO pins
+            self.render(time.monotonic());
+
+
     # Returns a true or false for the given LED index, indicating if the LED
-    # is ON or not.
+    # is ON or not (underneath any patterns).
     def getLED(self, index):
         # make sure the index is within bounds
         if (index > -1 and index < len(self.pins)):
             return self.states[index] == GPIO.HIGH;
-        return false;
-    
-    
-    # Given the index of the LED to flash, and the number of flashes to
-    # perform, this flashes the LED, using time.sleep() to separate
-    # the LED toggles
-    def flashLED(self, indexes, flashes):
-        # save the states of the LEDs before flashing
-        oldStates = self.states;
-
-        for i in range(0, (flashes * 2)):
-            time.sleep(0.075);
-            # activate all indexes
-            for j in range(0, len(indexes)):
-                self.setLED([indexes[j]], not self.getLED(indexes[j]));
-
-        # turn the LEDs back to their old states
+        return False;
+
+
+    # Given the indexes of the LEDs to flash, and the number of flashes to
+    # perform, this flashes the LEDs (toggling them from their state, and
+    # back). This returns right away; the returned LightPattern can be passed
+    # to stopPattern() to stop it early
+    def flashLED(self, indexes, flashes, priority = 1):
+        return self.playPattern(self.blink(indexes, flashes, priority));
+
+
+    # ------------------------------ Patterns ------------------------------- #
+    # Starts playing the given LightPattern (replacing any other pattern with
+    # the same name). Returns right away, returning the pattern
+    def playPattern(self, pattern):
+        with self.condition:
+            if (pattern.name != None):
+                self.patterns = [p for p in self.patterns if p.name != pattern.name];
+            pattern.start = time.monotonic();
+            self.patterns.append(pattern);
+            self.condition.notify_all();
+        return pattern;
+
+
+    # Stops the given LightPattern (or every pattern with the given name)
+    def stopPattern(self, pattern):
+        with self.condition:
+            self.patterns = [p for p in self.patterns if p != pattern and p.name != pattern];
+            self.render(time.monotonic());
+            self.condition.notify_all();
+
+
+    # Waits (up to 'timeout' seconds, if given) for every pattern that ends
+    # on its own to finish playing. Returns False on a timeout
+    def waitIdle(self, timeout = None):
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not any(not p.repeat for p in self.patterns), timeout);
+
+
+    # Returns a LightPattern that flashes the given LEDs (toggling them from
+    # their state, and back) the given number of times
+    def blink(self, indexes, flashes, priority = 1):
+        frames = [(LightPattern.TOGGLE, self.FLASH_TIME), (None, self.FLASH_TIME)] * flashes;
+        return LightPattern(dict((i, frames) for i in indexes), priority);
+
+
+    # Returns a LightPattern that "beats" the given LEDs (two quick pulses,
+    # then a pause) until it's stopped
+    def heartbeat(self, indexes, priority = 0, name = "heartbeat"):
+        frames = [(True, 0.1), (False, 0.1), (True, 0.1), (False, 0.7)];
+        return LightPattern(dict((i, frames) for i in indexes), priority, True, name);
+
+
+    # Returns a LightPattern that shows a fraction (0.0 to 1.0) as a bar
+    # across the given LEDs, in order: the LEDs the fraction has passed are
+    # on, the one it's partway through blinks, and the rest are off. (Play it
+    # again with a new fraction to move the bar along)
+    def progressBar(self, fraction, indexes, priority = 0, name = "progress"):
+        lit = max(0.0, min(1.0, fraction)) * len(indexes);
+        frames = {};
         for i in range(0, len(indexes)):
-            self.setLED([indexes[i]], oldStates[indexes[i]] == GPIO.HIGH);
+            if (i + 1 <= lit):
+                frames[indexes[i]] = [(True, 1.0)];
+            elif (i < lit):
+                frames[indexes[i]] = [(True, 0.25), (False, 0.25)];
+            else:
+                frames[indexes[i]] = [(False, 1.0)];
+        return LightPattern(frames, priority, True, name);
+
+
+    # ---------------------------- Pattern Thread ---------------------------- #
+    # The pattern thread's main function: keeps the pins up to date with the
+    # patterns playing, sleeping until the next one changes (or a new one is
+    # played)
+    def run(self):
+        with self.condition:
+            while (not self.stopping):
+                now = time.monotonic();
+                count = len(self.patterns);
+                self.patterns = [p for p in self.patterns if not p.isFinished(now)];
+                if (len(self.patterns) != count):
+                    # let anyone waiting for the patterns to finish know
+                    self.condition.notify_all();
+                self.render(now);
+                wait = None;
+                for pattern in self.patterns:
+                    change = pattern.getNextChange(now);
+                    if (wait == None or change < wait):
+                        wait = change;
+                self.condition.wait(wait);
+
+
+    # Helper function that writes each pin's level (from its state and the
+    # patterns playing on it) at the given time, skipping pins whose level
+    # hasn't changed. The condition must be held
+    def render(self, now):
+        for i in range(0, len(self.pins)):
+            state = self.states[i] == GPIO.HIGH;
+            top = None;
+            for pattern in self.patterns:
+                if (i in pattern.frames and not pattern.isFinished(now) and
+                    (top == None or pattern.priority >= top.priority)):
+                    top = pattern;
+            if (top != None):
+                state = top.getState(i, now, state);
+            level = GPIO.HIGH if state else GPIO.LOW;
+            if (level != self.written[i]):
+                GPIO.output(self.pins[i], level);
+                self.written[i] = level;
+
+
+# A class describing a pattern to play on the LEDs: for each LED, a list of
+# frames, each a (state, seconds) tuple, where the state is True (ON), False
+# (OFF), None (the LED's state underneath shows) or TOGGLE (the opposite of
+# the LED's state underneath).
+class LightPattern:
+
+    # A frame state: the opposite of the LED's state underneath
+    TOGGLE = "toggle";
+
+    # LightPattern properties:
+    #   frames      A dictionary mapping LED indexes to their lists of frames
+    #   priority    The pattern's priority (the highest shows over the others)
+    #   repeat      Whether the frames loop until the pattern's stopped, or
+    #               play once
+    #   name        The pattern's name (a pattern replaces any playing with the
+    #               same name), or None
+    #   start       The monotonic time the pattern started playing
+
+    # Constructor: takes the frames, priority, whether or not to repeat, and
+    # the (optional) name
+    def __init__(self, frames, priority = 0, repeat = False, name = None):
+        self.frames = frames;
+        self.priority = priority;
+        self.repeat = repeat;
+        self.name = name;
+        self.start = 0.0;
+
+
+    # Returns the state (True or False) of the given LED at the given time,
+    # given its state underneath
+    def getState(self, index, now, state):
+        (frame, remaining) = self.findFrame(self.frames[index], now - self.start);
+        if (frame == None or frame[0] == None):
+            return state;
+        if (frame[0] == self.TOGGLE):
+            return not state;
+        return frame[0];
+
+
+    # Returns a boolean indicating whether or not the pattern has finished
+    # playing at the given time
+    def isFinished(self, now):
+        if (self.repeat):
+            return False;
+        elapsed = now - self.start;
+        return all(elapsed >= sum(f[1] for f in frames) for frames in self.frames.values());
+
 
+    # Returns the time (in seconds) from the given time until any of the
+    # pattern's LEDs changes
+    def getNextChange(self, now):
+        changes = [self.findFrame(frames, now - self.start)[1] for frames in self.frames.values()];
+        return max(0.0, min(changes));
 
 
+    # Helper function that returns a tuple of the (frame, seconds left in it)
+    # the given frames are on after 'elapsed' seconds. The frame is None once
+    # they've all played
+    def findFrame(self, frames, elapsed):
+        total = sum(f[1] for f in frames);
+        if (self.repeat and total > 0):
+            elapsed %= total;
+        for frame in frames:
+            if (elapsed < frame[1]):
+                return (frame, frame[1] - elapsed);
+            elapsed -= frame[1];
+        return (None, float("inf"));
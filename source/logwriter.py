@@ -0,0 +1,239 @@
+import queue;
+import threading;
+import time;
+import datetime;
+
+# A class that writes log records to disk on a background thread, so whoever
+# logs never waits on the SD card. Records are put on a queue along with the
+# channel (log file type) they belong to; the writer thread batches them up
+# and writes them out once enough text has built up (or enough time has
+# passed), keeping each channel's file open between writes, and moving on to
+# a new file when the day changes.
+class LogWriter:
+
+    # LogWriter properties:
+    #   nameFunc    A function that takes a channel and a datetime, and returns
+    #               the name of the log file those records belong in
+    #   logPath     The directory log files are written to
+    #   echo        Whether or not records are also printed to the console
+    #   queue       The queue of (channel, datetime, text) records (or
+    #               threading.Event objects, which request a flush)
+    #   handles     A dictionary mapping file names to their open files
+    #   current     A dictionary mapping each channel to the name of the file
+    #               it's currently writing to
+    #   pending     A dictionary mapping file names to the text waiting to be
+    #               written to them
+    #   pendingSize The number of characters waiting to be written
+    #   written     A dictionary mapping file names to the number of bytes
+    #               written to them that haven't been reported yet
+    #   dropped     A dictionary mapping file names to the number of their
+    #               lines dropped (to stay under MAX_PENDING) that haven't been
+    #               noted in the file yet
+    #   retryDelay  The time (in seconds) to wait before trying again after a
+    #               failed write (doubled after each failure), or 0
+    #   retryTime   The monotonic time before which no write is tried
+    #   lock        A lock guarding the 'written' dictionary
+    #   thread      The writer thread
+
+    # LogWriter constants:
+    #   FLUSH_SIZE      The number of characters that may build up before
+    #                   they're written
+    #   FLUSH_INTERVAL  The longest (in seconds) a record may wait to be written
+    #   MAX_PENDING     The most characters kept waiting while the files can't
+    #                   be written to (such as when the card is full). Past
+    #                   it, the oldest lines are dropped
+    #   RETRY_MIN       The time (in seconds) waited after the first failed
+    #                   write before trying again
+    #   RETRY_MAX       The longest (in seconds) waited between tries
+    #   REOPEN          A record that makes the writer close its files, so
+    #                   they're opened fresh (such as after logs are wiped)
+
+    # Constructor: takes the function used to name log files and the directory
+    # they go in, and starts the writer thread
+    def __init__(self, nameFunc, logPath, echo = True):
+        self.FLUSH_SIZE = 4096;
+        self.FLUSH_INTERVAL = 5.0;
+        self.MAX_PENDING = 256 * 1024;
+        self.RETRY_MIN = 1.0;
+        self.RETRY_MAX = 60.0;
+        self.REOPEN = "reopen";
+
+        self.nameFunc = nameFunc;
+        self.logPath = logPath;
+        self.echo = echo;
+        self.queue = queue.Queue();
+        self.handles = {};
+        self.current = {};
+        self.pending = {};
+        self.pendingSize = 0;
+        self.written = {};
+        self.dropped = {};
+        self.retryDelay = 0.0;
+        self.retryTime = 0.0;
+        self.lock = threading.Lock();
+        self.thread = threading.Thread(target = self.run, name = "logwriter");
+        self.thread.daemon = True;
+        self.thread.start();
+
+
+    # --------------------------- Logging ----------------------------- #
+    # Queues the given text to be written to the given channel's log. This
+    # never waits on the disk
+    def write(self, channel, text):
+        self.queue.put((channel, datetime.datetime.now(), text));
+
+
+    # Asks the writer thread to write out everything it's holding, and waits
+    # (up to 'timeout' seconds) for it to finish. Returns False on a timeout
+    def flush(self, timeout = 2.0):
+        done = threading.Event();
+        self.queue.put(done);
+        return done.wait(timeout);
+
+
+    # Returns (and forgets) a dictionary of the bytes written to each log file
+    # since this was last called
+    def popWritten(self):
+        with self.lock:
+            written = self.written;
+            self.written = {};
+        return written;
+
+
+    # Asks the writer to close its files and open them again when it's next
+    # written to (such as after the log directory has been wiped)
+    def reopen(self):
+        self.queue.put(self.REOPEN);
+
+
+    # Flushes the log and closes its files
+    def close(self):
+        self.flush();
+        self.queue.put(None);
+
+
+    # ------------------------- Writer Thread ------------------------- #
+    # The writer thread's main function: collects records, writing them out
+    # whenever enough have built up or enough time has passed
+    def run(self):
+        lastFlush = time.monotonic();
+        while (True):
+            timeout = max(0.0, max(lastFlush + self.FLUSH_INTERVAL, self.retryTime) -
+                               time.monotonic());
+            try:
+                record = self.queue.get(timeout = timeout);
+            except queue.Empty:
+                record = False;
+
+            # None means the writer is closing
+            if (record == None):
+                self.writePending();
+                self.closeFiles();
+                return;
+
+            if (record == self.REOPEN):
+                self.closeFiles();
+                continue;
+
+            # an Event is a flush request
+            if (isinstance(record, threading.Event)):
+                self.writePending();
+                lastFlush = time.monotonic();
+                record.set();
+                continue;
+
+            if (record != False):
+                (channel, when, text) = record;
+                if (self.echo):
+                    print(text.replace("\n", ""));
+                fileName = self.nameFunc(channel, when);
+                self.current[channel] = fileName;
+                self.pending[fileName] = self.pending.get(fileName, "") + text;
+                self.pendingSize += len(text);
+                if (self.pendingSize > self.MAX_PENDING):
+                    self.dropOldest();
+
+            # (after a failed write, nothing's tried again until retryTime)
+            now = time.monotonic();
+            if ((self.pendingSize >= self.FLUSH_SIZE or now - lastFlush >= self.FLUSH_INTERVAL)
+                and now >= self.retryTime):
+                self.writePending();
+                lastFlush = time.monotonic();
+
+
+    # Writes everything that's waiting to its log file. A file that can't be
+    # written to (such as when the card is full) keeps the text that didn't
+    # make it for next time, and further writes are held off (for longer after
+    # each failure). Files no channel is using anymore (from a previous day)
+    # are closed
+    def writePending(self):
+        # note any lines that were dropped, where they would have been
+        for fileName in self.dropped:
+            note = "({n} log lines dropped: the log couldn't be written)\n".format(
+                   n = self.dropped[fileName]);
+            self.pending[fileName] = note + self.pending.get(fileName, "");
+        self.dropped = {};
+
+        failed = {};
+        for fileName in self.pending:
+            data = self.pending[fileName].encode("utf-8");
+            offset = 0;
+            try:
+                if (fileName not in self.handles):
+                    self.handles[fileName] = open(self.logPath + fileName, "ab", buffering = 0);
+                # (unbuffered, so a write that fails partway says how much of
+                # the text made it, and only the rest is tried again)
+                while (offset < len(data)):
+                    offset += self.handles[fileName].write(data[offset:]);
+            except (IOError, OSError):
+                # keep the rest of the text, and open the file fresh next time
+                failed[fileName] = data[offset:].decode("utf-8", "ignore");
+                self.closeFile(fileName);
+            if (offset > 0):
+                with self.lock:
+                    self.written[fileName] = self.written.get(fileName, 0) + offset;
+
+        self.pending = failed;
+        self.pendingSize = sum(len(text) for text in failed.values());
+        if (len(failed) > 0):
+            self.retryDelay = min(self.RETRY_MAX, max(self.RETRY_MIN, self.retryDelay * 2));
+            self.retryTime = time.monotonic() + self.retryDelay;
+        else:
+            self.retryDelay = 0.0;
+            self.retryTime = 0.0;
+
+        # close the files that have been rotated away from
+        for fileName in list(self.handles):
+            if (fileName not in self.current.values()):
+                self.closeFile(fileName);
+
+
+    # Helper function that drops the oldest lines waiting to be written
+    # (from whichever file has the most waiting) until there are no more than
+    # MAX_PENDING characters, counting the lines dropped
+    def dropOldest(self):
+        while (self.pendingSize > self.MAX_PENDING):
+            fileName = max(self.pending, key = lambda name: len(self.pending[name]));
+            text = self.pending[fileName];
+            cut = text.find("\n", len(text) - (self.MAX_PENDING - (self.pendingSize - len(text))));
+            if (cut < 0):
+                cut = len(text) - 1;
+            self.dropped[fileName] = self.dropped.get(fileName, 0) + text.count("\n", 0, cut + 1);
+            self.pending[fileName] = text[cut + 1:];
+            self.pendingSize -= cut + 1;
+
+
+    # Helper function that closes the file with the given name (if it's open)
+    def closeFile(self, fileName):
+        f = self.handles.pop(fileName, None);
+        if (f != None):
+            try:
+                f.close();
+            except (IOError, OSError):
+                pass;
+
+
+    # Helper function that closes every open file
+    def closeFiles(self):
+        for fileName in list(self.handles):
+            self.closeFile(fileName);
@@ -0,0 +1,248 @@
+import threading;
+from http.server import HTTPServer, BaseHTTPRequestHandler;
+
+# A set of classes used to keep timing histograms, counters and gauges for the
+# dash cam's loops, and to publish them (in the Prometheus text format) on a
+# loopback HTTP endpoint, so a stalling box can be looked at without pulling
+# its SD card. The module-level REGISTRY is shared by every mode.
+
+
+# A metric that only ever goes up (such as a count of overruns)
+class Counter:
+
+    # Counter properties:
+    #   value       The counter's current value
+
+    def __init__(self):
+        self.value = 0;
+
+
+    # Adds the given amount (1 by default) to the counter
+    def inc(self, amount = 1):
+        self.value += amount;
+
+
+    # Returns the lines of text used to render the counter
+    def render(self, name, labels):
+        return [name + labels + " " + str(self.value)];
+
+
+# A metric holding a single value that can go up or down. If it's given a
+# function, that function is called to get the value whenever it's rendered
+class Gauge:
+
+    # Gauge properties:
+    #   value       The gauge's current value
+    #   func        A function returning the gauge's value (or None)
+
+    def __init__(self, func = None):
+        self.value = 0;
+        self.func = func;
+
+
+    # Sets the gauge's value
+    def set(self, value):
+        self.value = value;
+
+
+    # Returns the lines of text used to render the gauge
+    def render(self, name, labels):
+        value = self.value;
+        if (self.func != None):
+            try:
+                value = self.func();
+            except Exception:
+                return [];
+        return [name + labels + " " + str(value)];
+
+
+# A metric that sorts observed values (usually durations, in seconds) into
+# cumulative buckets, keeping their sum and count
+class Histogram:
+
+    # Histogram properties:
+    #   buckets     The upper bounds of each bucket, in increasing order
+    #   counts      The number of observations that fell in each bucket
+    #   total       The sum of every observed value
+    #   count       The number of observations
+
+    def __init__(self, buckets):
+        self.buckets = buckets;
+        self.counts = [0] * len(buckets);
+        self.total = 0.0;
+        self.count = 0;
+
+
+    # Records one observed value
+    def observe(self, value):
+        for i in range(0, len(self.buckets)):
+            if (value <= self.buckets[i]):
+                self.counts[i] += 1;
+                break;
+        self.total += value;
+        self.count += 1;
+
+
+    # Returns the lines of text used to render the histogram
+    def render(self, name, labels):
+        # the bucket label goes after any other labels
+        if (labels == ""):
+            prefix = "{";
+        else:
+            prefix = labels[:-1] + ",";
+
+        lines = [];
+        cumulative = 0;
+        for i in range(0, len(self.buckets)):
+            cumulative += self.counts[i];
+            lines.append(name + "_bucket" + prefix + "le=\"" + str(self.buckets[i]) +
+                         "\"} " + str(cumulative));
+        lines.append(name + "_bucket" + prefix + "le=\"+Inf\"} " + str(self.count));
+        lines.append(name + "_sum" + labels + " " + repr(self.total));
+        lines.append(name + "_count" + labels + " " + str(self.count));
+        return lines;
+
+
+# A class that keeps track of every metric (by name and labels) and renders
+# them all in the Prometheus text format
+class MetricsRegistry:
+
+    # MetricsRegistry properties:
+    #   families    A dictionary mapping each metric name to a tuple of its
+    #               (type, help text, {label string: metric object})
+    #   names       The metric names, in the order they were created
+    #   lock        A lock held while creating or rendering metrics
+
+    # MetricsRegistry constants:
+    #   BUCKETS     The default histogram buckets (in seconds). They're bunched
+    #               around the dash cam's 0.125 second tick rate
+
+    def __init__(self):
+        self.families = {};
+        self.names = [];
+        self.lock = threading.Lock();
+        self.BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                        0.1, 0.125, 0.25, 0.5, 1.0, 2.5, 5.0];
+
+
+    # ------------------------- Metric Creation ------------------------- #
+    # Returns the counter with the given name and labels (a dictionary),
+    # creating it if it doesn't exist yet
+    def counter(self, name, helpText, labels = {}):
+        return self.getMetric("counter", name, helpText, labels, Counter);
+
+
+    # Returns the gauge with the given name and labels, creating it if it
+    # doesn't exist yet. (If a function is given, it provides the gauge's value)
+    def gauge(self, name, helpText, labels = {}, func = None):
+        gauge = self.getMetric("gauge", name, helpText, labels, Gauge);
+        if (func != None):
+            gauge.func = func;
+        return gauge;
+
+
+    # Returns the histogram with the given name and labels, creating it if it
+    # doesn't exist yet
+    def histogram(self, name, helpText, labels = {}, buckets = None):
+        if (buckets == None):
+            buckets = self.BUCKETS;
+        return self.getMetric("histogram", name, helpText, labels,
+                              lambda: Histogram(buckets));
+
+
+    # Helper function that finds (or creates, using 'factory') the metric of
+    # the given type, name and labels
+    def getMetric(self, metricType, name, helpText, labels, factory):
+        labelString = "";
+        if (len(labels) > 0):
+            labelString = "{" + ",".join(key + "=\"" + str(labels[key]) + "\""
+                                         for key in sorted(labels)) + "}";
+        with self.lock:
+            if (name not in self.families):
+                self.families[name] = (metricType, helpText, {});
+                self.names.append(name);
+            metrics = self.families[name][2];
+            if (labelString not in metrics):
+                metrics[labelString] = factory();
+            return metrics[labelString];
+
+
+    # ---------------------------- Rendering ---------------------------- #
+    # Returns every metric, rendered in the Prometheus text format
+    def render(self):
+        lines = [];
+        with self.lock:
+            for name in self.names:
+                (metricType, helpText, metrics) = self.families[name];
+                lines.append("# HELP " + name + " " + helpText);
+                lines.append("# TYPE " + name + " " + metricType);
+                for labelString in metrics:
+                    lines += metrics[labelString].render(name, labelString);
+        return "\n".join(lines) + "\n";
+
+
+# The request handler used by the MetricsServer: answers GET /metrics
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if (self.path != "/metrics"):
+            self.send_error(404);
+            return;
+        body = self.server.registry.render().encode("utf-8");
+        self.send_response(200);
+        self.send_header("Content-Type", "text/plain; version=0.0.4");
+        self.send_header("Content-Length", str(len(body)));
+        self.end_headers();
+        self.wfile.write(body);
+
+
+    # Keeps every scrape from being printed to the console
+    def log_message(self, format, *args):
+        return;
+
+
+# A class that serves a MetricsRegistry over HTTP, on the loopback interface
+# only, from a background thread
+class MetricsServer:
+
+    # MetricsServer properties:
+    #   registry    The MetricsRegistry being served
+    #   port        The port the server listens on
+    #   server      The HTTPServer (or None if the server isn't running)
+    #   thread      The thread the server runs on
+
+    def __init__(self, registry, port = 9477):
+        self.registry = registry;
+        self.port = port;
+        self.server = None;
+        self.thread = None;
+
+
+    # Starts the server (if it isn't already running). Returns a boolean
+    # indicating whether or not the server is running
+    def start(self):
+        if (self.server != None):
+            return True;
+        try:
+            self.server = HTTPServer(("127.0.0.1", self.port), MetricsHandler);
+        except (IOError, OSError):
+            return False;
+        self.server.registry = self.registry;
+        self.thread = threading.Thread(target = self.server.serve_forever,
+                                       name = "metrics");
+        self.thread.daemon = True;
+        self.thread.start();
+        return True;
+
+
+    # Stops the server
+    def stop(self):
+        if (self.server != None):
+            self.server.shutdown();
+            self.server.server_close();
+            self.server = None;
+
+
+# the registry (and server) shared by every part of the dash cam
+REGISTRY = MetricsRegistry();
+SERVER = MetricsServer(REGISTRY);
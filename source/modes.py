@@ -0,0 +1,137 @@
+import time;
+from filer import Filer;
+from dumper import Dumper;
+from lights import LightManager;
+from buttons import ButtonManager;
+from gestures import GestureRecognizer;
+from shutdown import shutdown_pi;
+import metrics;
+
+# A class that runs the dash cam as one state machine, moving between its
+# modes ("config", "output", "connect", "recording" and "shutdown") in one
+# process. It owns the hardware (GPIO, through the light and button managers,
+# and the camera) and sets it up once: every mode uses the same objects, so
+# switching modes (even from recording back to config) never re-initializes
+# the GPIO pins or reopens the camera, and takes milliseconds.
+# Each mode is a function that runs until it's time to switch, and returns the
+# name of the next mode (or None, to end the program). The config, output and
+# connect modes are the Configurer's; recording and shutdown are defined here.
+class ModeMachine:
+
+    # ModeMachine properties:
+    #   bootTimer   The BootTimer timing the startup phases
+    #   warmer      The CameraWarmer opening the camera in the background
+    #   filer       The Filer object used to write logs/manage files
+    #   lights      The LightManager used for toggling LEDs
+    #   buttons     The ButtonManager used for user input
+    #   gestures    The GestureRecognizer every mode reads the buttons through
+    #   dumper      The Dumper object used to dump files to a flash drive
+    #   metrics     The MetricsRegistry mode switch times are kept in
+    #   camera      The DashCam, once a mode has needed it (or None)
+    #   controller  The Controller that runs the recording mode, once it's
+    #               been entered (or None)
+    #   modes       A dictionary mapping each mode's name to its function
+    #   mode        The name of the mode running (or None)
+    #   previous    The name of the mode that ran before it (or None)
+    #   switchStart The monotonic time the last mode's function returned
+
+    # Constructor: takes the BootTimer timing the startup, and the
+    # CameraWarmer opening the camera, and sets up the hardware
+    def __init__(self, bootTimer, warmer):
+        self.bootTimer = bootTimer;
+        self.warmer = warmer;
+        self.bootTimer.mark("imports");
+        # create the filer, light manager, button manager, and dumper
+        self.filer = Filer();
+        self.bootTimer.mark("filer");
+        self.lights = LightManager();
+        self.buttons = ButtonManager();
+        self.gestures = GestureRecognizer(self.buttons);
+        self.dumper = Dumper("dashdrive");
+        self.bootTimer.mark("gpio");
+        self.camera = None;
+        self.controller = None;
+
+        # set up the metrics, and publish them on the loopback endpoint
+        self.metrics = metrics.REGISTRY;
+        metrics.SERVER.start();
+
+        self.modes = {};
+        self.mode = None;
+        self.previous = None;
+        self.switchStart = time.monotonic();
+        self.addMode("recording", self.mainRecording);
+        self.addMode("shutdown", self.mainShutdown);
+
+
+    # Adds a mode with the given name, run by the given function
+    def addMode(self, name, func):
+        self.modes[name] = func;
+
+
+    # ------------------------------ Running ------------------------------ #
+    # Runs the modes, starting with the given one, until a mode returns None
+    def run(self, mode):
+        while (mode != None):
+            if (mode not in self.modes):
+                self.filer.log("Unknown mode: " + str(mode) + "\n");
+                return;
+            self.previous = self.mode;
+            self.mode = mode;
+            mode = self.modes[mode]();
+            self.switchStart = time.monotonic();
+
+
+    # Called by a mode once it's set up and about to start its loop: logs how
+    # long the switch from the previous mode took (from when its function
+    # returned), and returns it
+    def enterMode(self):
+        seconds = time.monotonic() - self.switchStart;
+        self.metrics.histogram("mode_switch_seconds",
+            "Time from leaving one mode until the next is running",
+            {"mode": self.mode}).observe(seconds);
+        if (self.previous != None):
+            self.filer.log("[modes]  {p} -> {m} in {t:.1f} ms\n".format(
+                           p = self.previous, m = self.mode, t = seconds * 1000.0));
+        return seconds;
+
+
+    # Returns the camera, waiting for the CameraWarmer to open it if this is
+    # the first time it's needed
+    def getCamera(self):
+        if (self.camera == None):
+            self.camera = self.warmer.getCamera();
+            self.bootTimer.mark("camera wait");
+            self.filer.log("Camera opened in {t:.2f} s\n".format(t = self.warmer.readyTime),
+                           False, self.filer.SESSION_LOG);
+        return self.camera;
+
+
+    # ------------------------------- Modes ------------------------------- #
+    # Recording Mode main function: runs the dash cam (creating the Controller
+    # with the shared hardware the first time) until it's stopped. Returns
+    # "config" if the power button was held, and "shutdown" otherwise
+    def mainRecording(self):
+        if (self.controller == None):
+            # create the controller, handing it the camera (opened while the
+            # config window was up), and the filer, lights, buttons and
+            # dumper that are already set up
+            from controller import Controller;
+            camera = self.getCamera();
+            self.controller = Controller(camera, self.filer, self.lights, self.buttons,
+                                         self.bootTimer, self.dumper, self.gestures);
+        terminateCode = self.controller.main(self.enterMode);
+        if (terminateCode == 2):
+            return "config";
+        return "shutdown";
+
+
+    # Shutdown Mode main function: flashes the lights, cleans up the GPIO pins
+    # and the camera, and shuts down the Pi. Returns None (ending the program)
+    def mainShutdown(self):
+        self.enterMode();
+        objects = [self.buttons];
+        if (self.camera != None):
+            objects.append(self.camera);
+        shutdown_pi(self.lights, objects);
+        return None;
@@ -0,0 +1,388 @@
+import os;
+import sys;
+import struct;
+import argparse;
+from array import array;
+
+# A class that converts the raw H.264 (Annex-B) streams written by the camera
+# into .mp4 files, without any outside tools. The stream is read once, in
+# large chunks: each NAL unit is found by its start code, the SPS and PPS are
+# kept for the file's header, and every other NAL unit is written straight
+# into the .mp4's media data (length-prefixed), grouped into one sample per
+# frame. Only each frame's size and whether it's a key frame are kept in
+# memory, so memory use doesn't grow with the length of the video; the sample
+# tables are written at the end. (The camera's encoder doesn't use B-frames,
+# so frames are decoded in the order they're shown)
+class MP4Muxer:
+
+    # MP4Muxer properties:
+    #   framerate   The framerate the video was recorded at, used to time the
+    #               frames (unless a duration is given)
+    #   duration    The video's real length (in seconds), or None. If given,
+    #               the frames are spread evenly over it
+    #   sps         The first sequence parameter set NAL unit found (or None)
+    #   pps         The first picture parameter set NAL unit found (or None)
+    #   sizes       An array of each sample's size (in bytes)
+    #   keys        An array of the (1-based) numbers of the key frame samples
+    #   chunks      An array of the file offsets of each chunk of samples
+
+    # MP4Muxer constants:
+    #   TIMESCALE       The number of time units per second in the video track
+    #   READ_SIZE       The number of bytes read from the stream at a time
+    #   CHUNK_SAMPLES   The number of samples in each chunk of the media data
+    #   START_CODE      The 3-byte start code that begins each NAL unit
+
+    # Constructor: takes the framerate (and optionally the real duration) of
+    # the videos to be converted
+    def __init__(self, framerate = 30, duration = None):
+        self.TIMESCALE = 90000;
+        self.READ_SIZE = 1024 * 1024;
+        self.CHUNK_SAMPLES = 30;
+        self.START_CODE = b"\x00\x00\x01";
+
+        self.framerate = framerate;
+        self.duration = duration;
+
+
+    # ----------------------------- Muxing ----------------------------- #
+    # Converts the H.264 stream at 'inPath' to an .mp4 at 'outPath'. Returns
+    # the number of frames written. Raises a ValueError if the stream has no
+    # SPS/PPS or frames
+    def mux(self, inPath, outPath):
+        self.sps = None;
+        self.pps = None;
+        self.sizes = array("I");
+        self.keys = array("I");
+        self.chunks = array("Q");
+
+        with open(inPath, "rb") as src, open(outPath, "wb") as out:
+            out.write(self.box(b"ftyp", b"isom" + struct.pack(">I", 512) +
+                               b"isomiso2avc1mp41"));
+            # the media data's size isn't known until the end, so a 64-bit
+            # size field is left to be filled in
+            mdatStart = out.tell();
+            out.write(struct.pack(">I4sQ", 1, b"mdat", 0));
+
+            sampleSize = 0;
+            sampleKey = False;
+            sampleHasFrame = False;
+            for nal in self.readNals(src):
+                nalType = nal[0] & 0x1F;
+                isSlice = nalType >= 1 and nalType <= 5;
+
+                # a new frame begins with the first slice of a picture, or
+                # with anything that isn't a slice, once a slice has been seen
+                if (sampleHasFrame and (not isSlice or (len(nal) > 1 and nal[1] & 0x80))):
+                    self.addSample(out, sampleSize, sampleKey);
+                    sampleSize = 0;
+                    sampleKey = False;
+                    sampleHasFrame = False;
+
+                # parameter sets go in the header; delimiters aren't needed
+                if (nalType == 7):
+                    if (self.sps == None):
+                        self.sps = nal;
+                    continue;
+                if (nalType == 8):
+                    if (self.pps == None):
+                        self.pps = nal;
+                    continue;
+                if (nalType == 9 or nalType == 10 or nalType == 11):
+                    continue;
+
+                if (sampleSize == 0 and len(self.sizes) % self.CHUNK_SAMPLES == 0):
+                    self.chunks.append(out.tell());
+                out.write(struct.pack(">I", len(nal)));
+                out.write(nal);
+                sampleSize += 4 + len(nal);
+                if (isSlice):
+                    sampleHasFrame = True;
+                    sampleKey = sampleKey or nalType == 5;
+            if (sampleHasFrame):
+                self.addSample(out, sampleSize, sampleKey);
+            elif (sampleSize > 0):
+                # drop trailing data that isn't part of a frame
+                out.truncate(out.tell() - sampleSize);
+                out.seek(0, os.SEEK_END);
+                if (len(self.chunks) > 0 and self.chunks[-1] >= out.tell()):
+                    self.chunks.pop();
+
+            if (self.sps == None or self.pps == None or len(self.sizes) == 0):
+                raise ValueError(inPath + " has no SPS/PPS or frames");
+
+            # fill in the media data's size, then write the header at the end
+            mdatEnd = out.tell();
+            out.seek(mdatStart + 8);
+            out.write(struct.pack(">Q", mdatEnd - mdatStart));
+            out.seek(mdatEnd);
+            out.write(self.makeMoov());
+        return len(self.sizes);
+
+
+    # Helper function that records a finished sample
+    def addSample(self, out, size, isKey):
+        self.sizes.append(size);
+        if (isKey):
+            self.keys.append(len(self.sizes));
+
+
+    # Yields each NAL unit (without its start code) in the given H.264 file,
+    # reading it in READ_SIZE pieces
+    def readNals(self, src):
+        buf = bytearray();
+        start = None;
+        searchFrom = 0;
+        while (True):
+            data = src.read(self.READ_SIZE);
+            if (data):
+                buf += data;
+            i = buf.find(self.START_CODE, searchFrom);
+            while (i >= 0):
+                if (start != None):
+                    # the zero before a 4-byte start code isn't part of the NAL
+                    nal = bytes(buf[start:i]).rstrip(b"\x00");
+                    if (len(nal) > 0):
+                        yield nal;
+                start = i + 3;
+                i = buf.find(self.START_CODE, start);
+            if (not data):
+                break;
+
+            # forget what's been used, keeping whatever could be the start of
+            # a start code split across two reads
+            if (start != None):
+                del buf[:start];
+                start = 0;
+                searchFrom = max(0, len(buf) - 2);
+            else:
+                del buf[:max(0, len(buf) - 2)];
+                searchFrom = 0;
+        if (start != None and start < len(buf)):
+            nal = bytes(buf[start:]).rstrip(b"\x00");
+            if (len(nal) > 0):
+                yield nal;
+
+
+    # --------------------------- MP4 Boxes ---------------------------- #
+    # Returns the 'moov' box: the movie's header and its one video track's
+    # sample tables
+    def makeMoov(self):
+        count = len(self.sizes);
+        # time each sample: spread over the real duration if it's known,
+        # otherwise one frame interval apiece
+        if (self.duration != None and self.duration > 0):
+            delta = max(1, int(round(self.duration * self.TIMESCALE / count)));
+        else:
+            delta = max(1, int(round(self.TIMESCALE / float(self.framerate))));
+        mediaDuration = delta * count;
+        movieDuration = mediaDuration * 1000 // self.TIMESCALE;
+        info = SPSInfo(self.sps);
+        (width, height) = info.getSize();
+
+        matrix = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000);
+        mvhd = self.fullBox(b"mvhd", 0, 0, struct.pack(">IIII", 0, 0, 1000, movieDuration) +
+                            struct.pack(">IH", 0x10000, 0x100) + bytes(10) + matrix +
+                            bytes(24) + struct.pack(">I", 2));
+        tkhd = self.fullBox(b"tkhd", 0, 3, struct.pack(">IIIII", 0, 0, 1, 0, movieDuration) +
+                            bytes(8) + struct.pack(">hhhH", 0, 0, 0, 0) + matrix +
+                            struct.pack(">II", width << 16, height << 16));
+        mdhd = self.fullBox(b"mdhd", 0, 0, struct.pack(">IIII", 0, 0, self.TIMESCALE,
+                                                       mediaDuration) +
+                            struct.pack(">HH", 0x55C4, 0));
+        hdlr = self.fullBox(b"hdlr", 0, 0, struct.pack(">I4s", 0, b"vide") + bytes(12) +
+                            b"VideoHandler\x00");
+        vmhd = self.fullBox(b"vmhd", 0, 1, bytes(8));
+        dinf = self.box(b"dinf", self.fullBox(b"dref", 0, 0, struct.pack(">I", 1) +
+                                              self.fullBox(b"url ", 0, 1, b"")));
+        stbl = self.box(b"stbl", self.makeStsd(info, width, height) +
+                        self.fullBox(b"stts", 0, 0, struct.pack(">III", 1, count, delta)) +
+                        self.fullBox(b"stss", 0, 0, struct.pack(">I", len(self.keys)) +
+                                     self.bigEndian(self.keys, "I")) +
+                        self.makeStsc() +
+                        self.fullBox(b"stsz", 0, 0, struct.pack(">II", 0, count) +
+                                     self.bigEndian(self.sizes, "I")) +
+                        self.makeChunkOffsets());
+        minf = self.box(b"minf", vmhd + dinf + stbl);
+        mdia = self.box(b"mdia", mdhd + hdlr + minf);
+        trak = self.box(b"trak", tkhd + mdia);
+        return self.box(b"moov", mvhd + trak);
+
+
+    # Returns the 'stsd' box, describing the video's format (with the SPS and
+    # PPS in its 'avcC' box). Takes the SPSInfo (already read by getSize())
+    # and the picture's size
+    def makeStsd(self, info, width, height):
+        avcC = (struct.pack(">BBBBBB", 1, self.sps[1], self.sps[2], self.sps[3], 0xFF, 0xE1) +
+                struct.pack(">H", len(self.sps)) + self.sps +
+                struct.pack(">BH", 1, len(self.pps)) + self.pps);
+        if (self.sps[1] in (100, 110, 122, 144)):
+            avcC += struct.pack(">BBBB", 0xFC | info.chromaFormat, 0xF8 | info.lumaDepth,
+                                0xF8 | info.chromaDepth, 0);
+        avc1 = (bytes(6) + struct.pack(">H", 1) + bytes(16) +
+                struct.pack(">HHIIIH", width, height, 0x480000, 0x480000, 0, 1) +
+                bytes(32) + struct.pack(">Hh", 0x18, -1) + self.box(b"avcC", avcC));
+        return self.fullBox(b"stsd", 0, 0, struct.pack(">I", 1) + self.box(b"avc1", avc1));
+
+
+    # Returns the 'stsc' box, mapping samples to chunks (every chunk has
+    # CHUNK_SAMPLES samples, except maybe the last)
+    def makeStsc(self):
+        entries = [(1, min(self.CHUNK_SAMPLES, len(self.sizes)))];
+        remainder = len(self.sizes) % self.CHUNK_SAMPLES;
+        if (len(self.chunks) > 1 and remainder != 0):
+            entries.append((len(self.chunks), remainder));
+        data = struct.pack(">I", len(entries));
+        for (firstChunk, samples) in entries:
+            data += struct.pack(">III", firstChunk, samples, 1);
+        return self.fullBox(b"stsc", 0, 0, data);
+
+
+    # Returns the box of chunk offsets ('stco', or 'co64' for files over 4 GB)
+    def makeChunkOffsets(self):
+        if (len(self.chunks) > 0 and self.chunks[-1] > 0xFFFFFFFF):
+            return self.fullBox(b"co64", 0, 0, struct.pack(">I", len(self.chunks)) +
+                                self.bigEndian(self.chunks, "Q"));
+        return self.fullBox(b"stco", 0, 0, struct.pack(">I", len(self.chunks)) +
+                            self.bigEndian(array("I", self.chunks), "I"));
+
+
+    # Helper function that returns a box of the given type holding the data
+    def box(self, boxType, data):
+        return struct.pack(">I4s", 8 + len(data), boxType) + data;
+
+
+    # Helper function that returns a "full" box (one with a version and flags)
+    def fullBox(self, boxType, version, flags, data):
+        return self.box(boxType, struct.pack(">I", (version << 24) | flags) + data);
+
+
+    # Helper function that returns the bytes of an array of integers, big-endian
+    def bigEndian(self, values, typecode):
+        values = array(typecode, values);
+        if (sys.byteorder == "little"):
+            values.byteswap();
+        return values.tobytes();
+
+
+# A small helper class that reads the fields of an SPS the muxer needs: the
+# picture's size and the chroma format/bit depths
+class SPSInfo:
+
+    # SPSInfo properties:
+    #   data            The SPS's payload, with emulation prevention bytes removed
+    #   bit             The position (in bits) of the next bit to read
+    #   chromaFormat    The chroma_format_idc
+    #   lumaDepth       bit_depth_luma_minus8
+    #   chromaDepth     bit_depth_chroma_minus8
+
+    # Constructor: takes the SPS NAL unit (including its header byte)
+    def __init__(self, nal):
+        self.data = bytes(nal[1:]).replace(b"\x00\x00\x03", b"\x00\x00");
+        self.bit = 0;
+        self.chromaFormat = 1;
+        self.lumaDepth = 0;
+        self.chromaDepth = 0;
+
+
+    # Returns the (width, height) of the pictures, after cropping
+    def getSize(self):
+        self.bit = 0;
+        profile = self.readBits(8);
+        self.readBits(16);                  # constraint flags, level
+        self.readUE();                      # seq_parameter_set_id
+        if (profile in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)):
+            self.chromaFormat = self.readUE();
+            if (self.chromaFormat == 3):
+                self.readBits(1);           # separate_colour_plane_flag
+            self.lumaDepth = self.readUE();
+            self.chromaDepth = self.readUE();
+            self.readBits(1);               # qpprime_y_zero_transform_bypass_flag
+            if (self.readBits(1)):          # seq_scaling_matrix_present_flag
+                for i in range(0, 8 if self.chromaFormat != 3 else 12):
+                    if (self.readBits(1)):
+                        self.skipScalingList(16 if i < 6 else 64);
+        self.readUE();                      # log2_max_frame_num_minus4
+        pocType = self.readUE();
+        if (pocType == 0):
+            self.readUE();                  # log2_max_pic_order_cnt_lsb_minus4
+        elif (pocType == 1):
+            self.readBits(1);
+            self.readSE();
+            self.readSE();
+            for i in range(0, self.readUE()):
+                self.readSE();
+        self.readUE();                      # max_num_ref_frames
+        self.readBits(1);                   # gaps_in_frame_num_value_allowed_flag
+        widthMbs = self.readUE() + 1;
+        heightMapUnits = self.readUE() + 1;
+        frameMbsOnly = self.readBits(1);
+        if (not frameMbsOnly):
+            self.readBits(1);               # mb_adaptive_frame_field_flag
+        self.readBits(1);                   # direct_8x8_inference_flag
+        width = widthMbs * 16;
+        height = (2 - frameMbsOnly) * heightMapUnits * 16;
+        if (self.readBits(1)):              # frame_cropping_flag
+            cropUnitX = 1 if self.chromaFormat == 0 or self.chromaFormat == 3 else 2;
+            cropUnitY = (1 if self.chromaFormat != 1 else 2) * (2 - frameMbsOnly);
+            if (self.chromaFormat == 0):
+                cropUnitY = 2 - frameMbsOnly;
+            (left, right, top, bottom) = (self.readUE(), self.readUE(),
+                                          self.readUE(), self.readUE());
+            width -= (left + right) * cropUnitX;
+            height -= (top + bottom) * cropUnitY;
+        return (width, height);
+
+
+    # Helper function that reads the given number of bits as an integer
+    def readBits(self, count):
+        value = 0;
+        for i in range(0, count):
+            byte = self.data[self.bit >> 3] if (self.bit >> 3) < len(self.data) else 0;
+            value = (value << 1) | ((byte >> (7 - (self.bit & 7))) & 1);
+            self.bit += 1;
+        return value;
+
+
+    # Helper function that reads an unsigned Exp-Golomb code
+    def readUE(self):
+        zeros = 0;
+        while (self.readBits(1) == 0 and zeros < 32):
+            zeros += 1;
+        return (1 << zeros) - 1 + self.readBits(zeros);
+
+
+    # Helper function that reads a signed Exp-Golomb code
+    def readSE(self):
+        value = self.readUE();
+        if (value & 1):
+            return (value + 1) // 2;
+        return -(value // 2);
+
+
+    # Helper function that skips over a scaling list of the given size
+    def skipScalingList(self, size):
+        last = 8;
+        nextScale = 8;
+        for i in range(0, size):
+            if (nextScale != 0):
+                nextScale = (last + self.readSE() + 256) % 256;
+            last = nextScale if nextScale != 0 else last;
+
+
+# Converts the .h264 file given on the command line to an .mp4
+def main(args):
+    parser = argparse.ArgumentParser(description = "Convert a raw H.264 stream to an .mp4");
+    parser.add_argument("input", help = "raw H.264 (Annex-B) file");
+    parser.add_argument("output", help = ".mp4 file to write");
+    parser.add_argument("--framerate", type = float, default = 30.0,
+                        help = "the video's framerate (default 30)");
+    parser.add_argument("--duration", type = float,
+                        help = "the video's real length in seconds (overrides the framerate)");
+    options = parser.parse_args(args);
+    frames = MP4Muxer(options.framerate, options.duration).mux(options.input, options.output);
+    print("Wrote {f} frames to {o}".format(f = frames, o = options.output));
+    return 0;
+
+
+if (__name__ == "__main__"):
+    sys.exit(main(sys.argv[1:]));
@@ -0,0 +1,55 @@
+# A script that benchmarks the built-in .mp4 muxer (mp4mux.py) against MP4Box
+# on a recorded segment (such as a 10-minute, 1600x900 passive video). Each
+# converter is run in its own process, and its time, throughput and peak
+# memory use (RSS) are printed. Usage:
+#   python3 mux_bench.py <segment.h264> [--framerate 30] [--runs 3]
+
+import os;
+import sys;
+import time;
+import shutil;
+import argparse;
+import subprocess;
+
+# Runs the given command in its own process, returning a tuple of its
+# (exit status, seconds taken, peak RSS in kilobytes)
+def measure(command):
+    start = time.monotonic();
+    process = subprocess.Popen(command, stdout = subprocess.DEVNULL,
+                               stderr = subprocess.DEVNULL);
+    (pid, status, usage) = os.wait4(process.pid, 0);
+    return (status, time.monotonic() - start, usage.ru_maxrss);
+
+
+parser = argparse.ArgumentParser(description = "Benchmark the .mp4 muxer against MP4Box");
+parser.add_argument("segment", help = "raw H.264 segment to convert");
+parser.add_argument("--framerate", default = "30", help = "the segment's framerate");
+parser.add_argument("--runs", type = int, default = 3, help = "runs of each converter");
+options = parser.parse_args();
+
+segmentSize = os.path.getsize(options.segment);
+sourcePath = os.path.dirname(os.path.abspath(__file__)) + "/";
+outPath = "/tmp/mux_bench.mp4";
+converters = [("mp4mux", [sys.executable, sourcePath + "mp4mux.py", options.segment,
+                          outPath, "--framerate", options.framerate])];
+if (shutil.which("MP4Box") != None):
+    converters.append(("MP4Box", ["MP4Box", "-fps", options.framerate, "-add",
+                                  options.segment, "-new", outPath]));
+else:
+    print("MP4Box isn't installed; only benchmarking mp4mux");
+
+print("Segment: {s} ({b:.1f} MB)".format(s = options.segment, b = segmentSize / 1000000.0));
+for (name, command) in converters:
+    for run in range(0, options.runs):
+        # drop the segment from the page cache (if allowed), so each run reads
+        # it from the card
+        os.system("sync; echo 1 | sudo -n tee /proc/sys/vm/drop_caches > /dev/null 2>&1");
+        (status, seconds, rss) = measure(command);
+        outSize = os.path.getsize(outPath) if os.path.exists(outPath) else 0;
+        print("{n:8s} run {r}: {t:7.2f} s  {m:7.1f} MB/s  peak RSS {k:7.1f} MB  "
+              "output {o:.1f} MB{e}".format(
+              n = name, r = run + 1, t = seconds, m = segmentSize / 1000000.0 / seconds,
+              k = rss / 1024.0, o = outSize / 1000000.0,
+              e = "" if status == 0 else "  (FAILED: status " + str(status) + ")"));
+        if (os.path.exists(outPath)):
+            os.remove(outPath);
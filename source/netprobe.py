@@ -0,0 +1,176 @@
+import os;
+import time;
+import socket;
+import threading;
+import urllib.parse;
+
+# A class that keeps track of whether the Pi can reach a host (the internet,
+# by default, or a server such as the upload server), as cheaply as possible. First the network interfaces' link state is read from
+# /sys/class/net, then the default route from /proc/net/route; only if both
+# are there is a short TCP connection tried (to a host that's always up). A
+# good result is trusted for a while, and while the network's unreachable the
+# connection attempts back off exponentially, so with the link down a check
+# is just a couple of small file reads. Listeners are called whenever the Pi
+# goes online or offline. The /sys and /proc paths are under 'root', so the
+# prober can be pointed at a fake tree.
+class ConnectivityProber:
+
+    # ConnectivityProber properties:
+    #   host        The host a TCP connection is tried to
+    #   port        The port the TCP connection is tried on
+    #   root        The directory the /sys and /proc paths are under
+    #   online      Whether or not the Pi was online when last checked (None
+    #               until the first check)
+    #   nextProbe   The monotonic time the next TCP connection may be tried
+    #   backoff     The time (in seconds) to wait after the next failed try
+    #   listeners   A list of functions called with True/False when the Pi
+    #               goes online/offline
+    #   lock        A lock held while checking (so checks from different
+    #               threads don't overlap)
+    #   stopping    A threading.Event set when the background thread stops
+    #   thread      The background thread checking periodically (or None)
+
+    # ConnectivityProber constants:
+    #   TIMEOUT         The time (in seconds) a TCP connection may take
+    #   TTL             The time (in seconds) a good result is trusted
+    #   MIN_BACKOFF     The time (in seconds) waited after the first failure
+    #   MAX_BACKOFF     The longest time (in seconds) waited between tries
+
+    # Constructor: takes the host and port to try connecting to, and the root
+    # directory (such as a fake sysfs/procfs tree) to look under
+    def __init__(self, host = "1.1.1.1", port = 53, root = "/"):
+        self.TIMEOUT = 0.5;
+        self.TTL = 30.0;
+        self.MIN_BACKOFF = 2.0;
+        self.MAX_BACKOFF = 300.0;
+
+        self.host = host;
+        self.port = port;
+        self.root = os.path.join(root, "");
+        self.online = None;
+        self.nextProbe = 0.0;
+        self.backoff = self.MIN_BACKOFF;
+        self.listeners = [];
+        self.lock = threading.Lock();
+        self.stopping = threading.Event();
+        self.thread = None;
+
+
+    # Returns a prober that checks whether the server at the given URL can be
+    # reached (on the URL's port, or the scheme's default port)
+    @staticmethod
+    def forUrl(url, root = "/"):
+        parts = urllib.parse.urlsplit(url);
+        port = parts.port;
+        if (port == None):
+            port = 443 if parts.scheme == "https" else 80;
+        return ConnectivityProber(parts.hostname, port, root);
+
+
+    # Adds a function to be called with True (or False) whenever the Pi goes
+    # online (or offline). It's called from whichever thread is checking
+    def addListener(self, listener):
+        self.listeners.append(listener);
+
+
+    # ---------------------------- Checking ---------------------------- #
+    # Returns a boolean indicating whether or not the Pi is online, probing
+    # the network only as much as it needs to
+    def check(self):
+        with self.lock:
+            now = time.monotonic();
+            if (not self.hasLink() or not self.hasDefaultRoute()):
+                # no network at all: try connecting as soon as there is one
+                self.nextProbe = now;
+                self.backoff = self.MIN_BACKOFF;
+                online = False;
+            elif (now < self.nextProbe):
+                online = bool(self.online);
+            else:
+                online = self.probe();
+                if (online):
+                    self.nextProbe = now + self.TTL;
+                    self.backoff = self.MIN_BACKOFF;
+                else:
+                    self.nextProbe = now + self.backoff;
+                    self.backoff = min(self.backoff * 2, self.MAX_BACKOFF);
+            changed = online != self.online;
+            self.online = online;
+        if (changed):
+            for listener in self.listeners:
+                listener(online);
+        return online;
+
+
+    # Returns a boolean indicating whether or not any network interface
+    # (other than loopback) has its link up
+    def hasLink(self):
+        netPath = self.root + "sys/class/net/";
+        try:
+            interfaces = os.listdir(netPath);
+        except OSError:
+            return False;
+        for interface in interfaces:
+            if (interface == "lo"):
+                continue;
+            try:
+                with open(netPath + interface + "/operstate", "r") as f:
+                    if (f.read().strip() == "up"):
+                        return True;
+            except (IOError, OSError):
+                pass;
+        return False;
+
+
+    # Returns a boolean indicating whether or not there's a default route
+    # (one to 0.0.0.0/0 that's up)
+    def hasDefaultRoute(self):
+        try:
+            with open(self.root + "proc/net/route", "r") as f:
+                f.readline();
+                for line in f:
+                    fields = line.split();
+                    if (len(fields) >= 8 and fields[1] == "00000000" and
+                        fields[7] == "00000000" and int(fields[3], 16) & 0x1):
+                        return True;
+        except (IOError, OSError, ValueError):
+            pass;
+        return False;
+
+
+    # Returns a boolean indicating whether or not a TCP connection to the
+    # host can be made (within TIMEOUT)
+    def probe(self):
+        try:
+            connection = socket.create_connection((self.host, self.port), self.TIMEOUT);
+            connection.close();
+            return True;
+        except (OSError, socket.timeout):
+            return False;
+
+
+    # ------------------------- Background Thread ------------------------- #
+    # Starts checking on a background thread, every 'interval' seconds, so
+    # listeners hear about changes without anyone else having to check
+    def start(self, interval = 1.0):
+        if (self.thread != None):
+            return;
+        self.stopping.clear();
+        self.thread = threading.Thread(target = self.run, args = (interval,), name = "netprobe");
+        self.thread.daemon = True;
+        self.thread.start();
+
+
+    # The background thread's main function
+    def run(self, interval):
+        while (not self.stopping.is_set()):
+            self.check();
+            self.stopping.wait(interval);
+
+
+    # Stops the background thread
+    def stop(self):
+        self.stopping.set();
+        if (self.thread != None):
+            self.thread.join(self.TIMEOUT * 2);
+            self.thread = None;
@@ -0,0 +1,90 @@
+import time;
+import datetime;
+
+# A class that draws the text shown over the camera's video and pictures. The
+# text is built from a template of named fields (the time, the segment number,
+# the CPU temperature, an optional speed...). Every property set on the camera
+# goes through its firmware, so the style is only pushed once, and the text
+# is only written when it's actually different from what's already shown.
+class OverlayRenderer:
+
+    # OverlayRenderer properties:
+    #   picam       The PiCamera object the overlay is drawn on
+    #   template    The format string the overlay text is built from. Each
+    #               field is named in braces (such as "{time}")
+    #   fields      A dictionary of the (already formatted) field values
+    #   text        The text currently shown on the camera (or None)
+    #   dirty       Whether or not a field has changed since the text was built
+    #   lastSecond  The second (since the epoch) the "time" field was built for
+    #   writes      The number of times the text has been written to the camera
+    #   writeCount  The Counter the writes are added to (or None)
+
+    # OverlayRenderer constants:
+    #   TIME_FORMAT The strftime format used for the "time" field
+
+    # Constructor: takes the PiCamera and an optional template
+    def __init__(self, picam, template = "{time}  {temp}  #{segment}{speed}",
+                 registry = None):
+        self.TIME_FORMAT = "%Y-%m-%d, %H:%M:%S";
+
+        self.picam = picam;
+        self.template = template;
+        self.fields = {"time": "", "segment": "", "temp": "", "speed": ""};
+        self.text = None;
+        self.dirty = True;
+        self.lastSecond = None;
+        self.writes = 0;
+        self.writeCount = None;
+        if (registry != None):
+            self.writeCount = registry.counter("dashcam_overlay_writes_total",
+                "Times the overlay text was written to the camera");
+
+
+    # Pushes the overlay's style (colors and text size) to the camera. This
+    # only needs to happen once
+    def applyStyle(self, background, foreground, textSize = 15):
+        self.picam.annotate_background = background;
+        self.picam.annotate_foreground = foreground;
+        self.picam.annotate_text_size = textSize;
+
+
+    # Sets the (already formatted) value of one of the template's fields
+    def setField(self, name, value):
+        value = str(value);
+        if (self.fields.get(name) != value):
+            self.fields[name] = value;
+            self.dirty = True;
+
+
+    # Sets the optional "speed" field (in miles per hour). Passing None (when
+    # there's no speed source, such as a GPS) hides it
+    def setSpeed(self, mph):
+        if (mph == None):
+            self.setField("speed", "");
+        else:
+            self.setField("speed", "  {s:.0f} mph".format(s = mph));
+
+
+    # Brings the overlay up to date: the "time" field is only rebuilt when the
+    # second changes, the text is only rebuilt when a field changes, and the
+    # camera is only touched when the text is different. Returns a boolean
+    # indicating whether or not the camera's text was written
+    def update(self):
+        second = int(time.time());
+        if (second != self.lastSecond):
+            self.lastSecond = second;
+            self.setField("time", datetime.datetime.fromtimestamp(second).strftime(self.TIME_FORMAT));
+        if (not self.dirty):
+            return False;
+
+        # rebuild the text, and only write it if it changed
+        self.dirty = False;
+        text = self.template.format(**self.fields);
+        if (text == self.text):
+            return False;
+        self.text = text;
+        self.picam.annotate_text = text;
+        self.writes += 1;
+        if (self.writeCount != None):
+            self.writeCount.inc();
+        return True;
@@ -14,3 +14,4 @@ os.system("zip ../code.zip ./*.py");
 # flash the blue light to indicate the zip file was created
 lights.flashLED([2], 5);
 lights.setLED([2], False);
+lights.waitIdle(2.0);
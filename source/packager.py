@@ -0,0 +1,322 @@
+import io;
+import os;
+import sys;
+import json;
+import time;
+import hashlib;
+import argparse;
+import zipfile;
+import tarfile;
+
+# A class that packages the dash cam's output (media and logs) into a single
+# .zip (or .tar) archive. Videos and pictures are already compressed, so
+# they're stored as they are; only text logs are compressed. File data is
+# streamed through in large chunks, so packaging takes about as long as
+# reading the files. A manifest of what was packaged is kept, so an
+# incremental package can hold only the files added (or changed) since the
+# last one. The archive can be written straight onto another drive (such as
+# a flash drive), in large sequential writes, with nothing staged on the SD
+# card, and can carry a SHA-256 checksum of every member, so it can be
+# checked (see verify()) wherever it ends up.
+class Packager:
+
+    # Packager properties:
+    #   basePath        The directory the archive's member names are relative to
+    #   sources         A list of the directories whose files are packaged
+    #   manifestPath    The path of the manifest of packaged files: a JSON
+    #                   dictionary mapping member names to [size, mtime]
+
+    # Packager constants:
+    #   CHUNK_SIZE      The number of bytes copied at a time
+    #   WRITE_SIZE      The size of the buffer the archive is written through
+    #                   (so the drive sees large, sequential writes)
+    #   CHECKSUM_NAME   The name of the archive member listing each member's
+    #                   SHA-256 checksum (in the format sha256sum reads)
+    #   COMPRESS_TYPES  The file extensions that are compressed. (Everything
+    #                   else is stored)
+    #   PROGRESS_STEPS  The number of times progress is reported over a package
+
+    # Constructor: takes the directory member names are made relative to, and
+    # the path of the manifest
+    def __init__(self, basePath, manifestPath):
+        self.CHUNK_SIZE = 1024 * 1024;
+        self.WRITE_SIZE = 8 * 1024 * 1024;
+        self.CHECKSUM_NAME = "SHA256SUMS";
+        self.COMPRESS_TYPES = (".txt",);
+        self.PROGRESS_STEPS = 20;
+
+        self.basePath = basePath;
+        self.sources = [];
+        self.manifestPath = manifestPath;
+
+
+    # Adds a directory whose files should be packaged
+    def addSource(self, directory):
+        self.sources.append(directory);
+
+
+    # ---------------------------- Packaging ---------------------------- #
+    # Writes the given archive (a .tar if its name ends in ".tar", otherwise a
+    # .zip). If 'incremental' is True, only files that weren't in the last
+    # package (or have changed since) are included. The archive is written
+    # under a temporary name, and only replaces an older one once it's
+    # complete (and flushed to its drive). 'progress' is an optional function
+    # that's passed the fraction (0.0 to 1.0) of the bytes packaged so far. If
+    # 'checksums' is True, a CHECKSUM_NAME member is added to the end of the
+    # archive. Returns a tuple of the (files, bytes) packaged
+    def package(self, archivePath, incremental = False, progress = None, checksums = False):
+        files = self.listFiles();
+        manifest = {};
+        if (incremental):
+            manifest = self.loadManifest();
+        todo = [f for f in files if manifest.get(f[1]) != [f[2], f[3]]];
+
+        tempPath = archivePath + ".part";
+        sums = [] if checksums else None;
+        try:
+            with open(tempPath, "wb", buffering = self.WRITE_SIZE) as out:
+                if (archivePath.endswith(".tar")):
+                    totalBytes = self.writeTar(out, todo, progress, sums);
+                else:
+                    totalBytes = self.writeZip(out, todo, progress, sums);
+                out.flush();
+                os.fsync(out.fileno());
+            os.replace(tempPath, archivePath);
+        except Exception:
+            if (os.path.exists(tempPath)):
+                os.remove(tempPath);
+            raise;
+
+        # remember what's been packaged (forgetting files that are gone)
+        present = set(f[1] for f in files);
+        manifest = dict((name, manifest[name]) for name in manifest if name in present);
+        for (fullPath, name, size, mtime) in todo:
+            manifest[name] = [size, mtime];
+        self.saveManifest(manifest);
+        return (len(todo), totalBytes);
+
+
+    # Helper function that writes the given files to a .zip archive (in the
+    # file 'out'), storing everything but the COMPRESS_TYPES. If 'sums' is a
+    # list, each member's checksum line is added to it, and they're all
+    # written to the end of the archive. Returns the number of bytes packaged
+    def writeZip(self, out, files, progress, sums):
+        tracker = ProgressTracker(files, progress, self.PROGRESS_STEPS);
+        with zipfile.ZipFile(out, "w", allowZip64 = True) as archive:
+            for (fullPath, name, size, mtime) in files:
+                info = zipfile.ZipInfo(name, time.localtime(mtime)[0:6]);
+                info.external_attr = 0o644 << 16;
+                info.compress_type = zipfile.ZIP_STORED;
+                if (name.endswith(self.COMPRESS_TYPES)):
+                    info.compress_type = zipfile.ZIP_DEFLATED;
+                hasher = hashlib.sha256() if sums != None else None;
+                with open(fullPath, "rb") as src:
+                    with archive.open(info, "w", force_zip64 = size >= 0x7FFFFFFF) as dst:
+                        while (True):
+                            chunk = src.read(self.CHUNK_SIZE);
+                            if (not chunk):
+                                break;
+                            dst.write(chunk);
+                            if (hasher != None):
+                                hasher.update(chunk);
+                            tracker.add(len(chunk));
+                if (hasher != None):
+                    sums.append(hasher.hexdigest() + "  " + name + "\n");
+            if (sums != None):
+                archive.writestr(self.CHECKSUM_NAME, "".join(sums), zipfile.ZIP_DEFLATED);
+        return tracker.done;
+
+
+    # Helper function that writes the given files to an (uncompressed) .tar
+    # archive (in the file 'out'). Checksums are added as in writeZip().
+    # Returns the number of bytes packaged
+    def writeTar(self, out, files, progress, sums):
+        tracker = ProgressTracker(files, progress, self.PROGRESS_STEPS);
+        with tarfile.open(fileobj = out, mode = "w", format = tarfile.PAX_FORMAT,
+                          bufsize = self.CHUNK_SIZE) as archive:
+            archive.copybufsize = self.CHUNK_SIZE;
+            for (fullPath, name, size, mtime) in files:
+                hasher = hashlib.sha256() if sums != None else None;
+                with open(fullPath, "rb") as src:
+                    info = archive.gettarinfo(arcname = name, fileobj = src);
+                    archive.addfile(info, HashingReader(src, hasher, tracker));
+                if (hasher != None):
+                    sums.append(hasher.hexdigest() + "  " + name + "\n");
+            if (sums != None):
+                data = "".join(sums).encode("utf-8");
+                info = tarfile.TarInfo(self.CHECKSUM_NAME);
+                info.size = len(data);
+                info.mtime = time.time();
+                info.mode = 0o644;
+                archive.addfile(info, io.BytesIO(data));
+        return tracker.done;
+
+
+    # ---------------------------- Verifying ---------------------------- #
+    # Checks an archive written with checksums: every member listed in its
+    # CHECKSUM_NAME member is read back and its checksum compared (and a .zip's
+    # CRCs are checked along the way). Returns a tuple of the (number of
+    # members checked, list of the names of members that are missing or
+    # don't match). Raises an error if the archive can't be read at all, or
+    # has no checksums
+    def verify(self, archivePath):
+        bad = [];
+        checked = 0;
+        if (archivePath.endswith(".tar")):
+            with tarfile.open(archivePath, "r") as archive:
+                expected = self.parseChecksums(archive.extractfile(self.CHECKSUM_NAME).read());
+                for info in archive:
+                    if (info.name in expected):
+                        actual = self.hashFile(archive.extractfile(info));
+                        if (actual != expected.pop(info.name)):
+                            bad.append(info.name);
+                        checked += 1;
+        else:
+            with zipfile.ZipFile(archivePath, "r") as archive:
+                expected = self.parseChecksums(archive.read(self.CHECKSUM_NAME));
+                for info in archive.infolist():
+                    if (info.filename in expected):
+                        try:
+                            with archive.open(info) as f:
+                                actual = self.hashFile(f);
+                        except zipfile.BadZipFile:
+                            actual = None;
+                        if (actual != expected.pop(info.filename)):
+                            bad.append(info.filename);
+                        checked += 1;
+        # anything left over is listed, but missing from the archive
+        return (checked, bad + sorted(expected));
+
+
+    # ----------------------------- Helpers ----------------------------- #
+    # Returns a list of (full path, member name, size, mtime) tuples for every
+    # file in the sources, in name order
+    def listFiles(self):
+        files = [];
+        for directory in self.sources:
+            if (not os.path.isdir(directory)):
+                continue;
+            for entry in os.scandir(directory):
+                if (entry.is_file() and not entry.name.endswith(".part")):
+                    stats = entry.stat();
+                    name = os.path.relpath(entry.path, self.basePath).replace(os.sep, "/");
+                    files.append((entry.path, name, stats.st_size, int(stats.st_mtime)));
+        files.sort(key = lambda f: f[1]);
+        return files;
+
+
+    # Returns the SHA-256 hex digest of everything read from the file 'f'
+    def hashFile(self, f):
+        hasher = hashlib.sha256();
+        while (True):
+            chunk = f.read(self.CHUNK_SIZE);
+            if (not chunk):
+                break;
+            hasher.update(chunk);
+        return hasher.hexdigest();
+
+
+    # Returns a dictionary mapping member names to checksums, parsed from the
+    # contents of a CHECKSUM_NAME member
+    def parseChecksums(self, data):
+        sums = {};
+        for line in data.decode("utf-8").splitlines():
+            if ("  " in line):
+                (digest, name) = line.split("  ", 1);
+                sums[name] = digest;
+        return sums;
+
+
+    # Returns the manifest of the last package (or an empty one)
+    def loadManifest(self):
+        try:
+            with open(self.manifestPath, "r") as f:
+                return json.load(f);
+        except (IOError, OSError, ValueError):
+            return {};
+
+
+    # Saves the manifest (replacing the old one only once it's written)
+    def saveManifest(self, manifest):
+        with open(self.manifestPath + ".part", "w") as f:
+            json.dump(manifest, f);
+        os.replace(self.manifestPath + ".part", self.manifestPath);
+
+
+# A small helper class that wraps a file being read, passing everything read
+# from it to a hash (if there is one) and counting it as packaged
+class HashingReader:
+
+    # HashingReader properties:
+    #   f           The file being read
+    #   hasher      The hashlib object updated with the data read (or None)
+    #   tracker     The ProgressTracker the data read is counted in
+
+    # Constructor: takes the file, the hash and the progress tracker
+    def __init__(self, f, hasher, tracker):
+        self.f = f;
+        self.hasher = hasher;
+        self.tracker = tracker;
+
+
+    # Reads (up to) 'size' bytes from the file
+    def read(self, size = -1):
+        data = self.f.read(size);
+        if (self.hasher != None):
+            self.hasher.update(data);
+        self.tracker.add(len(data));
+        return data;
+
+
+# A small helper class that counts the bytes packaged, calling a progress
+# function each time another step's worth is done
+class ProgressTracker:
+
+    # ProgressTracker properties:
+    #   total       The number of bytes to be packaged
+    #   done        The number of bytes packaged so far
+    #   progress    The function passed the fraction packaged (or None)
+    #   steps       The number of times the function is called over the package
+    #   step        The last step the function was called for
+
+    # Constructor: takes the files being packaged, the progress function and
+    # the number of steps
+    def __init__(self, files, progress, steps):
+        self.total = max(1, sum(f[2] for f in files));
+        self.done = 0;
+        self.progress = progress;
+        self.steps = steps;
+        self.step = 0;
+
+
+    # Adds to the bytes packaged, reporting progress if another step was done
+    def add(self, count):
+        self.done += count;
+        step = min(self.steps, int(self.done * self.steps / self.total));
+        if (step > self.step and self.progress != None):
+            self.step = step;
+            self.progress(float(step) / self.steps);
+
+
+# ------------------------------ Command Line ------------------------------ #
+# Checks a package (such as one dumped onto a flash drive) against its
+# checksums
+def main(args):
+    parser = argparse.ArgumentParser(description = "Verify a dash cam package's checksums");
+    parser.add_argument("archive", help = "package to check (.zip or .tar)");
+    options = parser.parse_args(args);
+
+    packager = Packager(os.path.dirname(os.path.abspath(options.archive)), os.devnull);
+    try:
+        (checked, bad) = packager.verify(options.archive);
+    except (IOError, OSError, KeyError, zipfile.BadZipFile, tarfile.TarError) as e:
+        print("Couldn't verify " + options.archive + ": " + str(e));
+        return 2;
+    for name in bad:
+        print("FAILED: " + name);
+    print("{c} members checked, {b} failed".format(c = checked, b = len(bad)));
+    return 0 if len(bad) == 0 else 1;
+
+
+if (__name__ == "__main__"):
+    sys.exit(main(sys.argv[1:]));
@@ -0,0 +1,125 @@
+import os;
+import sys;
+import signal;
+import shutil;
+import subprocess;
+
+# A class that converts finished videos to .mp4 in the background while the
+# dash cam keeps recording. Each conversion runs the muxer (mp4mux.py) in its
+# own process, at the lowest CPU and I/O priority, and on top of that the
+# process is only let run for a share of each short cycle (it's stopped with
+# SIGSTOP the rest of the time), so it never takes more than its CPU budget.
+# It can also be held stopped entirely (such as when the CPU is hot, or the
+# main loop is running late). update() is meant to be called at a fixed rate,
+# such as once per tick of the main loop.
+class RemuxWorker:
+
+    # RemuxWorker properties:
+    #   muxerPath   The path of the muxer script
+    #   prefix      The command the muxer is run under (nice/ionice)
+    #   process     The Popen object of the running conversion (or None)
+    #   job         The job (a tuple, see start()) being converted (or None)
+    #   slot        The current slot of the duty cycle
+    #   running     Whether or not the process is currently let run
+    #   backedOff   Whether or not the worker is being held stopped
+
+    # RemuxWorker constants:
+    #   BUDGET      The share of each cycle (0.0 to 1.0) the conversion may run
+    #   SLOTS       The number of update() calls in each cycle
+
+    # Constructor: takes the CPU budget and the number of update() calls each
+    # cycle is divided into
+    def __init__(self, budget = 0.25, slots = 8):
+        self.BUDGET = budget;
+        self.SLOTS = slots;
+
+        self.muxerPath = os.path.dirname(os.path.abspath(__file__)) + "/mp4mux.py";
+        self.prefix = [];
+        if (shutil.which("nice") != None):
+            self.prefix += ["nice", "-n", "19"];
+        if (shutil.which("ionice") != None):
+            self.prefix += ["ionice", "-c", "3"];
+        self.process = None;
+        self.job = None;
+        self.slot = 0;
+        self.running = True;
+        self.backedOff = False;
+
+
+    # --------------------------- Converting --------------------------- #
+    # Starts converting a job: a tuple of the (directory, file name, ...,
+    # duration) of a .h264 video. (Anything between the name and the duration
+    # is kept for whoever finishes the job). The .mp4 is written to the same
+    # directory, with ".part" on the end of its name. Returns False if the
+    # muxer couldn't be started
+    def start(self, job):
+        directory = job[0];
+        fileName = job[1];
+        duration = job[-1];
+        outPath = directory + fileName[:-len(".h264")] + ".mp4.part";
+        command = self.prefix + [sys.executable, self.muxerPath, directory + fileName, outPath];
+        if (duration != None):
+            command += ["--duration", str(duration)];
+        try:
+            self.process = subprocess.Popen(command, stdout = subprocess.DEVNULL,
+                                            stderr = subprocess.DEVNULL);
+        except OSError:
+            return False;
+        self.job = job;
+        self.slot = 0;
+        self.running = True;
+        return True;
+
+
+    # Runs one slot of the duty cycle: the conversion is let run for the first
+    # BUDGET share of the cycle's slots (unless 'backOff' is True), and is
+    # stopped for the rest. Returns a tuple of the (job, success) of a
+    # conversion that's just finished, or None
+    def update(self, backOff = False):
+        if (self.process == None):
+            return None;
+        status = self.process.poll();
+        if (status != None):
+            job = self.job;
+            self.process = None;
+            self.job = None;
+            return (job, status == 0);
+
+        self.backedOff = backOff;
+        self.slot = (self.slot + 1) % self.SLOTS;
+        self.setRunning(not backOff and self.slot < max(1, int(self.SLOTS * self.BUDGET)));
+        return None;
+
+
+    # Returns a boolean indicating whether or not a conversion is in progress
+    def isBusy(self):
+        return self.process != None;
+
+
+    # Stops (kills) the conversion in progress, if there is one, deleting its
+    # partial output. Returns the job that was stopped (or None)
+    def stop(self):
+        if (self.process == None):
+            return None;
+        job = self.job;
+        self.setRunning(True);
+        self.process.kill();
+        self.process.wait();
+        outPath = job[0] + job[1][:-len(".h264")] + ".mp4.part";
+        if (os.path.exists(outPath)):
+            os.remove(outPath);
+        self.process = None;
+        self.job = None;
+        return job;
+
+
+    # Helper function that lets the conversion process run (SIGCONT) or stops
+    # it (SIGSTOP), signalling it only when that changes
+    def setRunning(self, running):
+        if (running == self.running or self.process == None):
+            return;
+        try:
+            self.process.send_signal(signal.SIGCONT if running else signal.SIGSTOP);
+            self.running = running;
+        except OSError:
+            pass;
@@ -0,0 +1,176 @@
+import heapq;
+import time;
+
+# A class representing one recurring job ("duty") run by the Scheduler. Each
+# duty has its own period, and its deadlines are always computed from the time
+# it was first scheduled (origin + count * period), so a late run never pushes
+# the following deadlines back.
+class Duty:
+
+    # Duty properties:
+    #   name          A short name used to identify the duty in logs
+    #   period        The time (in seconds) between two deadlines of the duty
+    #   callback      The function that's called when the duty is due. It's
+    #                 passed the Duty object itself
+    #   origin        The monotonic time of the duty's first deadline
+    #   count         The number of deadlines that have been consumed so far
+    #   deadline      The monotonic time at which the duty is next due
+    #   runs          The number of times the callback has been run
+    #   overruns      The number of deadlines that were skipped because the
+    #                 duty (or a duty before it) ran past them
+    #   lastJitter    How late (in seconds) the most recent run started
+    #   maxJitter     The latest any run has started
+    #   totalJitter   The sum of every run's lateness (used to get the mean)
+    #   lastDuration  How long (in seconds) the most recent callback took
+    #   maxDuration   The longest any callback has taken
+    #   timings       The Histogram the callback's durations are observed in
+    #                 (or None)
+    #   lateness      The Histogram the duty's jitter is observed in (or None)
+    #   missed        The Counter the duty's overruns are added to (or None)
+
+    # Constructor: takes the duty's name, period, callback and first deadline
+    def __init__(self, name, period, callback, origin):
+        self.name = name;
+        self.period = float(period);
+        self.callback = callback;
+        self.origin = origin;
+        self.count = 0;
+        self.deadline = origin;
+
+        # set up the timing statistics
+        self.runs = 0;
+        self.overruns = 0;
+        self.lastJitter = 0.0;
+        self.maxJitter = 0.0;
+        self.totalJitter = 0.0;
+        self.lastDuration = 0.0;
+        self.maxDuration = 0.0;
+        self.timings = None;
+        self.lateness = None;
+        self.missed = None;
+
+
+    # Moves the duty's deadline to the next slot after the given time. If the
+    # duty ran so late that one or more slots have already passed, they're
+    # skipped and counted as overruns. The number skipped is returned
+    def advance(self, now):
+        skipped = 0;
+        self.count += 1;
+        self.deadline = self.origin + self.count * self.period;
+        if (self.deadline <= now):
+            skipped = int((now - self.deadline) / self.period) + 1;
+            self.count += skipped;
+            self.overruns += skipped;
+            self.deadline = self.origin + self.count * self.period;
+        return skipped;
+
+
+    # Returns the average lateness (in seconds) of the duty's runs
+    def meanJitter(self):
+        if (self.runs == 0):
+            return 0.0;
+        return self.totalJitter / self.runs;
+
+
+# A class that runs a set of Duty objects against a monotonic clock. The owner
+# calls runPending() to run everything that's due, then sleeps for the time it
+# returns, so the loop only wakes up when the next duty is actually due.
+class Scheduler:
+
+    # Scheduler properties:
+    #   clock       The function used to read the current (monotonic) time
+    #   duties      A list of every Duty that's been added, in order
+    #   queue       A heap of (deadline, order, Duty) tuples, used to find the
+    #               next due duty. Duties due at the same time run in the order
+    #               they were added
+    #   registry    The MetricsRegistry each duty's timings are published to
+    #               (or None)
+    #   prefix      The prefix given to the names of the duties' metrics
+
+    # Constructor: takes an optional clock function (time.monotonic by default)
+    # and an optional MetricsRegistry (with a prefix for the metric names)
+    def __init__(self, clock = time.monotonic, registry = None, prefix = "dashcam"):
+        self.clock = clock;
+        self.duties = [];
+        self.queue = [];
+        self.registry = registry;
+        self.prefix = prefix;
+
+
+    # ------------------------ Duty Managing ------------------------ #
+    # Creates a new duty with the given name, period and callback, and adds it
+    # to the schedule. The first run happens after 'delay' seconds (right away,
+    # by default). The new Duty object is returned
+    def addDuty(self, name, period, callback, delay = 0.0):
+        duty = Duty(name, period, callback, self.clock() + delay);
+        if (self.registry != None):
+            labels = {"duty": name};
+            duty.timings = self.registry.histogram(self.prefix + "_duty_seconds",
+                "Time taken by each run of a scheduler duty", labels);
+            duty.lateness = self.registry.histogram(self.prefix + "_duty_jitter_seconds",
+                "How late each run of a scheduler duty started", labels);
+            duty.missed = self.registry.counter(self.prefix + "_duty_overruns_total",
+                "Deadlines a scheduler duty skipped because it ran late", labels);
+        heapq.heappush(self.queue, (duty.deadline, len(self.duties), duty));
+        self.duties.append(duty);
+        return duty;
+
+
+    # Returns the duty with the given name (or None if there isn't one)
+    def getDuty(self, name):
+        for duty in self.duties:
+            if (duty.name == name):
+                return duty;
+        return None;
+
+
+    # ------------------------- Running Duties ------------------------ #
+    # Runs every duty whose deadline has passed (earliest deadline first), and
+    # returns the time (in seconds) until the next duty is due
+    def runPending(self):
+        now = self.clock();
+        while (len(self.queue) > 0 and self.queue[0][0] <= now):
+            deadline, order, duty = heapq.heappop(self.queue);
+
+            # record how late the duty is starting
+            duty.lastJitter = now - deadline;
+            duty.totalJitter += duty.lastJitter;
+            duty.maxJitter = max(duty.maxJitter, duty.lastJitter);
+
+            # run the duty and record how long it took
+            duty.callback(duty);
+            duty.runs += 1;
+            now = self.clock();
+            duty.lastDuration = now - (deadline + duty.lastJitter);
+            duty.maxDuration = max(duty.maxDuration, duty.lastDuration);
+
+            # move on to the duty's next deadline and put it back in the queue
+            skipped = duty.advance(now);
+            if (duty.timings != None):
+                duty.timings.observe(duty.lastDuration);
+                duty.lateness.observe(duty.lastJitter);
+                duty.missed.inc(skipped);
+            heapq.heappush(self.queue, (duty.deadline, order, duty));
+
+        return self.timeUntilNext();
+
+
+    # Returns the time (in seconds) until the next duty is due. (0 is returned
+    # if a duty is already overdue)
+    def timeUntilNext(self):
+        if (len(self.queue) == 0):
+            return 0.0;
+        return max(0.0, self.queue[0][0] - self.clock());
+
+
+    # --------------------- Helper Functions ---------------------- #
+    # Returns a short string summarizing the timing of every duty (how late
+    # each one runs, how long it takes and how many deadlines it's missed)
+    def getStats(self):
+        stats = "";
+        for duty in self.duties:
+            stats += "[{n}: jitter {j1:.1f}/{j2:.1f} ms, took {d:.1f} ms, overruns {o}]  ".format(
+                     n = duty.name, j1 = duty.meanJitter() * 1000.0,
+                     j2 = duty.maxJitter * 1000.0,
+                     d = duty.maxDuration * 1000.0, o = duty.overruns);
+        return stats.strip();
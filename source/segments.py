@@ -0,0 +1,169 @@
+import os;
+from collections import deque;
+
+# A class that keeps an in-memory index of the passive video segments on disk,
+# ordered by a sequence number that's written into each segment's file name.
+# The directory is only scanned once (when the index is built); after that the
+# index is updated as segments are started and deleted, so finding the oldest
+# segment costs the same no matter how many there are. (File times aren't used
+# for ordering, since the Pi's clock jumps when it syncs). The index also keeps
+# each file's size, and is used the same way for the other media directories
+# (images, incidents and logs), whose file names are numbered the same way.
+# (Files without a number are numbered in memory as they're added.)
+class SegmentIndex:
+
+    # SegmentIndex properties:
+    #   path        The directory holding the segments
+    #   prefixes    A tuple of the prefixes the indexed file names start with
+    #   order       A deque of sequence numbers, oldest first. (Numbers of
+    #               segments that were removed early are skipped lazily)
+    #   names       A dictionary mapping sequence numbers to file names
+    #   sequences   A dictionary mapping file names to sequence numbers
+    #   sizes       A dictionary mapping file names to their sizes (in bytes)
+    #   totalBytes  The sum of every indexed file's size
+    #   nextSeq     The sequence number the next segment will be given
+
+    # Constructor: takes the directory holding the segments (and optionally,
+    # the file name prefixes to index), and builds the index from it
+    def __init__(self, path, prefixes = ("vid_",)):
+        self.path = path;
+        self.prefixes = tuple(prefixes);
+        self.build();
+
+
+    # ------------------------- Building ------------------------- #
+    # (Re)builds the index with a single pass over the directory. Segments
+    # named with a sequence number are ordered by it; any older segments
+    # without one are ordered by their modification times, before the rest
+    def build(self):
+        self.order = deque();
+        self.names = {};
+        self.sequences = {};
+        self.sizes = {};
+        self.totalBytes = 0;
+        self.nextSeq = 0;
+
+        numbered = [];
+        legacy = [];
+        if (os.path.isdir(self.path)):
+            for entry in os.scandir(self.path):
+                if (not entry.name.startswith(self.prefixes) or not entry.is_file()):
+                    continue;
+                stats = entry.stat();
+                seq = SegmentIndex.parseSequence(entry.name);
+                if (seq == None):
+                    legacy.append((stats.st_mtime, entry.name, stats.st_size));
+                else:
+                    numbered.append((seq, entry.name, stats.st_size));
+
+        # legacy segments get negative numbers, so they're always the oldest
+        legacy.sort();
+        for i in range(0, len(legacy)):
+            numbered.append((i - len(legacy), legacy[i][1], legacy[i][2]));
+        numbered.sort();
+        for (seq, name, size) in numbered:
+            self.add(seq, name, size);
+
+
+    # Returns the sequence number in the given segment file name (such as
+    # "vid_00000042_2020-01-01_12-00-00-0.h264"), or None if it doesn't have one
+    @staticmethod
+    def parseSequence(fileName):
+        parts = fileName.split("_");
+        if (len(parts) < 3 or not parts[1].isdigit()):
+            return None;
+        return int(parts[1]);
+
+
+    # ------------------------- Updating ------------------------- #
+    # Returns the sequence number for a new segment (and moves on to the next)
+    def allocate(self):
+        seq = self.nextSeq;
+        self.nextSeq += 1;
+        return seq;
+
+
+    # Adds the segment with the given sequence number, file name and size to
+    # the index. (Segments are expected to be added in sequence order)
+    def add(self, seq, fileName, size = 0):
+        if (len(self.order) > 0 and seq < self.order[-1]):
+            # out of order: put it in its place (this is rare, and slower)
+            items = sorted(list(self.order) + [seq]);
+            self.order = deque(items);
+        else:
+            self.order.append(seq);
+        self.names[seq] = fileName;
+        self.sequences[fileName] = seq;
+        self.sizes[fileName] = size;
+        self.totalBytes += size;
+        self.nextSeq = max(self.nextSeq, seq + 1, 0);
+
+
+    # Adds a file to the index, in the place of the sequence number in its
+    # name (one allocated with allocate()). A file whose name has no sequence
+    # number (or a taken one) is added as the newest
+    def addNew(self, fileName, size = 0):
+        if (fileName in self.sequences):
+            return;
+        seq = SegmentIndex.parseSequence(fileName);
+        if (seq == None or seq in self.names):
+            seq = self.allocate();
+        self.add(seq, fileName, size);
+
+
+    # Updates the recorded size of a file in the index
+    def setSize(self, fileName, size):
+        if (fileName in self.sizes):
+            self.totalBytes += size - self.sizes[fileName];
+            self.sizes[fileName] = size;
+
+
+    # Changes the file name of a segment in the index (such as after it's been
+    # converted to a different format)
+    def rename(self, oldName, newName):
+        seq = self.sequences.pop(oldName, None);
+        if (seq != None):
+            self.names[seq] = newName;
+            self.sequences[newName] = seq;
+            self.sizes[newName] = self.sizes.pop(oldName);
+
+
+    # Removes the segment with the given file name from the index
+    def remove(self, fileName):
+        seq = self.sequences.pop(fileName, None);
+        if (seq != None):
+            del self.names[seq];
+            self.totalBytes -= self.sizes.pop(fileName);
+
+
+    # Removes the oldest segment from the index and returns its file name (or
+    # None if the index is empty)
+    def popOldest(self):
+        while (len(self.order) > 0):
+            seq = self.order.popleft();
+            if (seq in self.names):
+                name = self.names.pop(seq);
+                del self.sequences[name];
+                self.totalBytes -= self.sizes.pop(name);
+                return name;
+        return None;
+
+
+    # ------------------------- Querying ------------------------- #
+    # Returns the number of segments in the index
+    def count(self):
+        return len(self.names);
+
+
+    # Returns the recorded size of a file in the index (0 if it isn't indexed)
+    def getSize(self, fileName):
+        return self.sizes.get(fileName, 0);
+
+
+    # Returns the file name of the oldest segment (or None if there isn't one)
+    def oldest(self):
+        while (len(self.order) > 0 and self.order[0] not in self.names):
+            self.order.popleft();
+        if (len(self.order) == 0):
+            return None;
+        return self.names[self.order[0]];
@@ -4,13 +4,16 @@ import os;
 # A function that takes in an array of objects, forcefully calls their
 # destructors, then shuts down the Raspberry Pi. It's also passed a
 # LightManager object, which is used to flash lights. This also has
-# its destructor called, so the GPIO pins are cleaned up
+# its destructor called (once the flashes have finished), so the GPIO pins
+# are cleaned up
 def shutdown_pi(lights, objects):
-    # flash LEDs
+    # flash LEDs, one after the other
     lights.setLED([0, 1, 2], False);
     for i in range(0, 3):
         lights.flashLED([i], 1);
+        lights.waitIdle(1.0);
     lights.flashLED([0, 1, 2], 1);
+    lights.waitIdle(1.0);
 
     # call each object's destructor
     lights.__del__();
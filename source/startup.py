@@ -0,0 +1,94 @@
+import time;
+import threading;
+
+# A class that times each phase of the dash cam's startup (imports, setting
+# up the files, the config window, opening the camera...), so the time from
+# power-on to the first recorded frame can be logged and kept short.
+class BootTimer:
+
+    # BootTimer properties:
+    #   start       The monotonic time the timer was created
+    #   last        The monotonic time the last phase ended
+    #   phases      A list of (name, seconds) tuples, one per finished phase
+
+    # Constructor: starts timing
+    def __init__(self):
+        self.start = time.monotonic();
+        self.last = self.start;
+        self.phases = [];
+
+
+    # Marks the end of a phase with the given name. Returns how long (in
+    # seconds) the phase took
+    def mark(self, name):
+        now = time.monotonic();
+        seconds = now - self.last;
+        self.phases.append((name, seconds));
+        self.last = now;
+        return seconds;
+
+
+    # Returns the number of seconds since the Pi booted (or None, if it can't
+    # be read)
+    def getUptime(self):
+        try:
+            with open("/proc/uptime", "r") as f:
+                return float(f.read().split()[0]);
+        except (IOError, OSError, ValueError, IndexError):
+            return None;
+
+
+    # Returns a string listing each phase's time, the total since the timer
+    # started, and the Pi's uptime
+    def getSummary(self):
+        summary = "  ".join("[{n}: {t:.0f} ms]".format(n = name, t = seconds * 1000.0)
+                            for (name, seconds) in self.phases);
+        summary += "  [Total: {t:.2f} s]".format(t = time.monotonic() - self.start);
+        uptime = self.getUptime();
+        if (uptime != None):
+            summary += "  [Uptime: {u:.2f} s]".format(u = uptime);
+        return summary;
+
+
+# A class that opens the camera (importing picamera along the way, which is
+# slow) and lets it warm up on a background thread, so it's ready to record
+# the moment the config window closes.
+class CameraWarmer:
+
+    # CameraWarmer properties:
+    #   camera      The DashCam, once it's been opened (or None)
+    #   error       The exception raised while opening it (or None)
+    #   readyTime   How long (in seconds) the camera took to open
+    #   thread      The thread the camera is opened on
+
+    # Constructor: starts opening the camera
+    def __init__(self):
+        self.camera = None;
+        self.error = None;
+        self.readyTime = None;
+        self.thread = threading.Thread(target = self.run, name = "camera-warmup");
+        self.thread.daemon = True;
+        self.thread.start();
+
+
+    # The thread's main function: imports and opens the camera, and starts it
+    # warming up
+    def run(self):
+        start = time.monotonic();
+        try:
+            from dashcam import DashCam;
+            camera = DashCam();
+            camera.warmUp();
+            self.camera = camera;
+        except Exception as e:
+            self.error = e;
+        self.readyTime = time.monotonic() - start;
+
+
+    # Waits for the camera to be opened, and returns it. If opening it failed,
+    # the exception is raised here
+    def getCamera(self):
+        self.thread.join();
+        if (self.error != None):
+            raise self.error;
+        return self.camera;
@@ -0,0 +1,111 @@
+import os;
+
+# A class that keeps the dash cam's card from filling up. Each kind of output
+# (passive videos, incident clips, images and logs) is given a quota, a share
+# of the card's capacity, and the card as a whole is kept between a high- and
+# low-water mark. When something is over its limit, its oldest files are
+# deleted (using each directory's SegmentIndex, so no directory walks are
+# needed). Space for the next segment can also be reserved ahead of time.
+class StorageBudget:
+
+    # StorageBudget properties:
+    #   path        A path on the filesystem being managed
+    #   categories  A list of dictionaries, one per kind of output, holding its
+    #               "name", "index" (SegmentIndex), "directory", "quota" (a
+    #               fraction of the card's capacity) and "protected" flag (if
+    #               True, its files are only deleted to keep it under its own
+    #               quota, never to make room for anything else)
+
+    # StorageBudget constants:
+    #   HIGH_WATER  The fraction of the card that may be used before files
+    #               start being deleted
+    #   LOW_WATER   The fraction of the card files are deleted down to, once
+    #               the high-water mark has been passed
+
+    # Constructor: takes a path on the filesystem to manage
+    def __init__(self, path, highWater = 0.90, lowWater = 0.85):
+        self.HIGH_WATER = highWater;
+        self.LOW_WATER = lowWater;
+        self.path = path;
+        self.categories = [];
+
+
+    # Adds a kind of output to the budget: its name, the SegmentIndex of its
+    # files, the directory they're in, and its quota. Categories added first
+    # are the first to be trimmed when the whole card is too full
+    def addCategory(self, name, index, directory, quota, protected = False):
+        self.categories.append({"name": name, "index": index, "directory": directory,
+                                "quota": quota, "protected": protected});
+
+
+    # Returns a tuple of the card's (total, free) bytes
+    def getUsage(self):
+        stats = os.statvfs(self.path);
+        return (stats.f_blocks * stats.f_frsize, stats.f_bavail * stats.f_frsize);
+
+
+    # ---------------------------- Enforcing ---------------------------- #
+    # Deletes files until every category is within its quota, and the card
+    # has room for 'reserve' more bytes without passing the high-water mark.
+    # (If it would, files are deleted down to the low-water mark, so this
+    # doesn't have to happen again right away). Returns a list of the
+    # (category name, file name, bytes) of each file deleted
+    def enforce(self, reserve = 0):
+        deleted = [];
+        (total, free) = self.getUsage();
+
+        # first, keep each category within its own quota
+        for category in self.categories:
+            while (category["index"].totalBytes > category["quota"] * total):
+                if (not self.deleteOldest(category, deleted)):
+                    break;
+
+        # then make sure the whole card has room for what's coming
+        (total, free) = self.getUsage();
+        if (total - free + reserve > self.HIGH_WATER * total):
+            while (total - free + reserve > self.LOW_WATER * total):
+                category = self.getMostOverQuota(total);
+                if (category == None or not self.deleteOldest(category, deleted)):
+                    break;
+                (total, free) = self.getUsage();
+        return deleted;
+
+
+    # Returns a boolean indicating whether or not the card has room for
+    # 'reserve' more bytes without passing the high-water mark
+    def hasRoom(self, reserve = 0):
+        (total, free) = self.getUsage();
+        return total - free + reserve <= self.HIGH_WATER * total;
+
+
+    # Helper function that returns the unprotected category using the most of
+    # its quota, and with something left to delete (or None)
+    def getMostOverQuota(self, total):
+        best = None;
+        bestShare = -1.0;
+        for category in self.categories:
+            if (category["protected"] or category["index"].count() <= 1):
+                continue;
+            share = category["index"].totalBytes / max(1.0, category["quota"] * total);
+            if (share > bestShare):
+                best = category;
+                bestShare = share;
+        return best;
+
+
+    # Helper function that deletes the oldest file in the given category,
+    # adding it to the 'deleted' list. The newest file (which may still be
+    # being written) is never deleted. Returns False if nothing was deleted
+    def deleteOldest(self, category, deleted):
+        index = category["index"];
+        if (index.count() <= 1):
+            return False;
+        name = index.oldest();
+        size = index.getSize(name);
+        index.popOldest();
+        try:
+            os.remove(category["directory"] + name);
+        except OSError:
+            pass;
+        deleted.append((category["name"], name, size));
+        return True;
@@ -0,0 +1,197 @@
+import glob;
+import time;
+from collections import deque;
+
+# A class that reads the Pi's temperature straight from the kernel's thermal
+# zones in sysfs (no shell commands), keeping a ring buffer of the most recent
+# readings so a smoothed value and a trend can be worked out.
+class ThermalSampler:
+
+    # ThermalSampler properties:
+    #   zones       A list of open file handles, one per thermal zone's "temp"
+    #               file. (Each is re-read from the start on every sample)
+    #   readings    A ring buffer of (monotonic time, temperature) tuples
+    #   smoothed    An exponential moving average of the readings (or None if
+    #               nothing has been read yet)
+    #   latest      The most recent reading (or None)
+
+    # ThermalSampler constants:
+    #   ZONE_GLOB   The pattern used to find the thermal zones' temp files
+    #   SAMPLES     The number of readings kept in the ring buffer
+    #   ALPHA       The weight given to each new reading in the moving average
+
+    # Constructor: takes an optional glob pattern for the zone files (useful
+    # when pointing the sampler at a fake sysfs tree)
+    def __init__(self, zoneGlob = "/sys/class/thermal/thermal_zone*/temp"):
+        # create constants
+        self.ZONE_GLOB = zoneGlob;
+        self.SAMPLES = 60;
+        self.ALPHA = 0.2;
+
+        self.readings = deque(maxlen = self.SAMPLES);
+        self.smoothed = None;
+        self.latest = None;
+
+        # open every zone once, so sampling is just a seek and a read
+        self.zones = [];
+        for path in sorted(glob.glob(self.ZONE_GLOB)):
+            try:
+                self.zones.append(open(path, "r"));
+            except (IOError, OSError):
+                pass;
+
+
+    # Destructor: closes the zone files
+    def __del__(self):
+        for zone in self.zones:
+            zone.close();
+
+
+    # ----------------------- Sampling ------------------------ #
+    # Reads every thermal zone and records the hottest one (in degrees Celsius)
+    # in the ring buffer. The reading is returned (None if no zone could be read)
+    def sample(self):
+        temp = None;
+        for zone in self.zones:
+            try:
+                zone.seek(0);
+                # the kernel reports millidegrees
+                zoneTemp = int(zone.read().strip()) / 1000.0;
+            except (IOError, OSError, ValueError):
+                continue;
+            if (temp == None or zoneTemp > temp):
+                temp = zoneTemp;
+
+        if (temp == None):
+            return None;
+
+        # update the ring buffer and the moving average
+        self.latest = temp;
+        self.readings.append((time.monotonic(), temp));
+        if (self.smoothed == None):
+            self.smoothed = temp;
+        else:
+            self.smoothed += self.ALPHA * (temp - self.smoothed);
+        return temp;
+
+
+    # Returns the temperature's trend, in degrees per minute, using a least-
+    # squares fit over the readings in the ring buffer (0 if there aren't
+    # enough readings to tell)
+    def getTrend(self):
+        if (len(self.readings) < 2):
+            return 0.0;
+
+        # fit a line through (time, temperature)
+        t0 = self.readings[0][0];
+        count = len(self.readings);
+        meanT = sum(r[0] - t0 for r in self.readings) / count;
+        meanC = sum(r[1] for r in self.readings) / count;
+        num = 0.0;
+        den = 0.0;
+        for (t, c) in self.readings:
+            num += (t - t0 - meanT) * (c - meanC);
+            den += (t - t0 - meanT) ** 2;
+        if (den == 0.0):
+            return 0.0;
+        return (num / den) * 60.0;
+
+
+# A class that decides how the dash cam should respond to the temperature.
+# Rather than shutting down as soon as the CPU gets hot, it steps the camera
+# down through cheaper recording profiles (lower framerate, then resolution,
+# then bitrate), and only asks for a shutdown once the cheapest profile still
+# can't keep the temperature down.
+class ThermalGovernor:
+
+    # ThermalGovernor properties:
+    #   profiles    A list of recording profiles (dictionaries holding a
+    #               "resolution", "framerate" and "bitrate"), from the normal
+    #               one (index 0) to the cheapest
+    #   level       The index of the profile currently in use
+    #   lastChange  The monotonic time the level last changed
+
+    # ThermalGovernor constants:
+    #   THROTTLE_TEMP   The smoothed temperature above which the governor
+    #                   steps down to the next profile
+    #   RECOVER_TEMP    The smoothed temperature below which the governor
+    #                   steps back up to the previous profile
+    #   SHUTDOWN_TEMP   The smoothed temperature at which the cheapest profile
+    #                   is considered a failure, and a shutdown is requested
+    #   CRITICAL_TEMP   A raw reading that causes an immediate shutdown
+    #   HOLD_TIME       The time (in seconds) the governor waits after changing
+    #                   levels before changing again, so a change has time to
+    #                   take effect
+    #   STEPS           The (framerate, resolution, bitrate) scale factors each
+    #                   level applies to the normal profile
+
+    # Constructor: takes the camera's normal recording profile
+    def __init__(self, profile):
+        # create constants
+        self.THROTTLE_TEMP = 75.0;
+        self.RECOVER_TEMP = 68.0;
+        self.SHUTDOWN_TEMP = 80.0;
+        self.CRITICAL_TEMP = 85.0;
+        self.HOLD_TIME = 30.0;
+        self.STEPS = [(1.0, 1.0, 1.0), (0.66, 1.0, 0.75), (0.5, 0.8, 0.5),
+                      (0.33, 0.6, 0.3)];
+
+        # build a profile for each level
+        self.profiles = [];
+        for (rateScale, sizeScale, bitScale) in self.STEPS:
+            (width, height) = profile["resolution"];
+            # keep scaled resolutions aligned to the encoder's macroblocks
+            if (sizeScale < 1.0):
+                width = int(width * sizeScale) // 32 * 32;
+                height = int(height * sizeScale) // 16 * 16;
+            self.profiles.append({
+                "resolution": (width, height),
+                "framerate": max(1, int(round(profile["framerate"] * rateScale))),
+                "bitrate": int(profile["bitrate"] * bitScale)});
+        # the first level is always the untouched profile
+        self.profiles[0] = dict(profile);
+
+        self.level = 0;
+        self.lastChange = time.monotonic();
+
+
+    # Looks at the sampler's latest and smoothed temperatures and returns what
+    # the dash cam should do, as one of these strings:
+    #   "none"       Nothing needs to change
+    #   "throttle"   Switch to the (cheaper) profile in getProfile()
+    #   "recover"    Switch back to the (better) profile in getProfile()
+    #   "shutdown"   Throttling isn't enough: shut the pi down
+    def update(self, sampler):
+        if (sampler.latest == None):
+            return "none";
+
+        # a critical reading can't wait for the average to catch up
+        if (sampler.latest >= self.CRITICAL_TEMP):
+            return "shutdown";
+
+        now = time.monotonic();
+        settled = now - self.lastChange >= self.HOLD_TIME;
+        temp = sampler.smoothed;
+
+        # too hot: step down (or give up if there's nothing left to step down to)
+        if (temp >= self.THROTTLE_TEMP):
+            if (self.level == len(self.profiles) - 1):
+                if (temp >= self.SHUTDOWN_TEMP and settled):
+                    return "shutdown";
+                return "none";
+            # step down right away the first time, or if it's still rising
+            if (settled or (self.level == 0 and sampler.getTrend() > 0.0)):
+                self.level += 1;
+                self.lastChange = now;
+                return "throttle";
+        # cooled down: step back up
+        elif (temp <= self.RECOVER_TEMP and self.level > 0 and settled):
+            self.level -= 1;
+            self.lastChange = now;
+            return "recover";
+        return "none";
+
+
+    # Returns the recording profile for the governor's current level
+    def getProfile(self):
+        return self.profiles[self.level];
@@ -0,0 +1,139 @@
+# A script that runs a stand-in upload server for the dash cam's UploadQueue
+# (see uploader.py for the protocol), for testing uploads on a laptop or
+# another Pi. Each file is written to <directory>/<kind>/<name>.part as its
+# chunks arrive (checking each chunk's checksum), and renamed once it's
+# complete. To test resuming, it can be told to drop some requests without
+# answering them. Usage:
+#   python3 upload_server.py <directory> [--port 8080] [--drop 0.1]
+
+import os;
+import json;
+import random;
+import hashlib;
+import argparse;
+import threading;
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer;
+
+# A lock held while a file's chunks are stored (so two requests for the same
+# file can't interleave)
+storeLock = threading.Lock();
+
+
+# The request handler: GET returns how much of a file the server has, and PUT
+# stores a chunk of it
+class UploadHandler(BaseHTTPRequestHandler):
+
+    # Returns the name of the file the request is for, or None if the name
+    # isn't allowed
+    def getName(self):
+        if (not self.path.startswith("/uploads/")):
+            return None;
+        name = self.path[len("/uploads/"):];
+        if (name == "" or "/" in name or name.startswith(".")):
+            return None;
+        return name;
+
+
+    # Returns the number of bytes the server has of the named file (looking
+    # under every kind, since a GET doesn't say), or None if it has none
+    def getOffset(self, name):
+        for kind in os.listdir(options.directory):
+            directory = os.path.join(options.directory, kind);
+            for path in (os.path.join(directory, name), os.path.join(directory, name + ".part")):
+                if (os.path.isfile(path)):
+                    return os.path.getsize(path);
+        return None;
+
+
+    # Sends a JSON response
+    def reply(self, status, body = None):
+        data = json.dumps(body if body != None else {}).encode("utf-8");
+        self.send_response(status);
+        self.send_header("Content-Type", "application/json");
+        self.send_header("Content-Length", str(len(data)));
+        self.end_headers();
+        self.wfile.write(data);
+
+
+    # Returns True (and drops the connection) if this request should be
+    # dropped, to test resuming
+    def shouldDrop(self):
+        if (random.random() < options.drop):
+            self.close_connection = True;
+            return True;
+        return False;
+
+
+    def do_GET(self):
+        name = self.getName();
+        if (name == None):
+            self.reply(400, {"error": "bad name"});
+            return;
+        offset = self.getOffset(name);
+        if (offset == None):
+            self.reply(404, {"offset": 0});
+        else:
+            self.reply(200, {"offset": offset});
+
+
+    def do_PUT(self):
+        length = int(self.headers.get("Content-Length", "0"));
+        data = self.rfile.read(length);
+        if (self.shouldDrop()):
+            return;
+        name = self.getName();
+        kind = self.headers.get("X-Kind", "other");
+        try:
+            (span, total) = self.headers["Content-Range"].split(" ", 1)[1].split("/");
+            (start, end) = [int(n) for n in span.split("-")];
+            total = int(total);
+        except (KeyError, IndexError, ValueError, AttributeError):
+            name = None;
+        if (name == None or not kind.isalnum() or end - start + 1 != len(data) or
+            end >= total):
+            self.reply(400, {"error": "bad request"});
+            return;
+        if (hashlib.sha256(data).hexdigest() != self.headers.get("X-Chunk-SHA256")):
+            self.reply(422, {"error": "checksum mismatch"});
+            return;
+
+        fullPath = os.path.join(options.directory, kind, name);
+        partPath = fullPath + ".part";
+        with storeLock:
+            offset = self.getOffset(name) or 0;
+            if (os.path.isfile(fullPath) or start != offset):
+                self.reply(409, {"offset": offset});
+                return;
+            if (not os.path.isdir(os.path.dirname(partPath))):
+                os.makedirs(os.path.dirname(partPath));
+            with open(partPath, "ab") as f:
+                f.write(data);
+            offset = end + 1;
+            if (offset == total):
+                os.replace(partPath, fullPath);
+                print("Received " + fullPath);
+        if (self.shouldDrop()):
+            return;
+        self.reply(200, {"offset": offset});
+
+
+    # Only logs errors
+    def log_message(self, format, *args):
+        pass;
+
+
+parser = argparse.ArgumentParser(description = "Run a stand-in dash cam upload server");
+parser.add_argument("directory", help = "directory to store uploads in");
+parser.add_argument("--port", type = int, default = 8080, help = "port to listen on");
+parser.add_argument("--drop", type = float, default = 0.0,
+                    help = "fraction of requests to drop without answering");
+options = parser.parse_args();
+if (not os.path.isdir(options.directory)):
+    os.makedirs(options.directory);
+
+server = ThreadingHTTPServer(("", options.port), UploadHandler);
+print("Serving uploads into {d} on port {p}".format(d = options.directory, p = options.port));
+try:
+    server.serve_forever();
+except KeyboardInterrupt:
+    pass;
@@ -0,0 +1,280 @@
+import os;
+import time;
+import queue;
+import hashlib;
+import threading;
+import subprocess;
+try:
+    import requests;
+except ImportError:
+    requests = None;
+
+# A class that uploads finished media (incident clips, pictures and passive
+# videos) to a server over Wi-Fi, on a background thread, so recording never
+# waits on the network. Files are queued in priority order (incidents first)
+# and sent in fixed-size chunks over one pooled HTTP session, each chunk with
+# a SHA-256 checksum the server checks. The server keeps track of how much of
+# each file it has (see upload_server.py), so an upload that's cut off (such
+# as by driving out of range) resumes from the last chunk it acknowledged.
+# Uploads only run while the Pi is on the home Wi-Fi network (which is only
+# looked into once a ConnectivityProber, if there is one, says the Pi is
+# online), and can be held to a bandwidth cap.
+#
+# The protocol, for a file 'name' of 'total' bytes:
+#   GET <url>uploads/<name>         -> {"offset": bytes the server has}
+#   PUT <url>uploads/<name>         with a chunk of the file as the body, and
+#       Content-Range: bytes <start>-<end>/<total>
+#       X-Chunk-SHA256: <hex digest of the chunk>
+#       X-Kind: <kind of media>
+#     -> 200 {"offset": ...}        chunk stored
+#     -> 409 {"offset": ...}        the server has a different amount; resume
+#                                   from its offset
+#     -> 422                        the checksum didn't match; resend
+class UploadQueue:
+
+    # UploadQueue properties:
+    #   url         The base URL of the upload server (ending in "/")
+    #   homeSSID    The name of the Wi-Fi network uploads run on (or None, for
+    #               any network)
+    #   rate        The most bytes uploaded per second (or None, for no limit)
+    #   queue       A PriorityQueue of (priority, order, path, name, kind)
+    #               tuples: the files waiting to be uploaded
+    #   queued      A set of the names of the files queued (or uploading)
+    #   finished    A list of the names of files uploaded since popFinished()
+    #               was last called
+    #   order       A counter that keeps files of the same priority in the
+    #               order they were added
+    #   online      Whether or not the Pi was on the home network when last
+    #               checked
+    #   connected   Whether or not the prober last said the Pi is online
+    #               (always True without a prober)
+    #   wake        A threading.Event set to wake the upload thread when the
+    #               Pi goes online (or the queue is stopped)
+    #   lock        A lock guarding 'queued' and 'finished'
+    #   stopping    A threading.Event set when the queue is stopped
+    #   thread      The upload thread (or None, if it was never started)
+    #   nextTime    The monotonic time the bandwidth cap allows the next chunk
+
+    # UploadQueue constants:
+    #   CHUNK_SIZE      The number of bytes sent in each chunk
+    #   PRIORITIES      A dictionary mapping each kind of media to its priority
+    #                   (lower goes first)
+    #   TIMEOUT         The time (in seconds) a request may take before the
+    #                   upload is given up on (until next time)
+    #   RETRY_DELAY     The time (in seconds) to wait after a failed upload
+    #   CHECK_RATE      The time interval (in seconds) at which the Wi-Fi
+    #                   network is checked, while uploads aren't running
+    #   CHUNK_RETRIES   The number of times a chunk is resent if its checksum
+    #                   doesn't match
+
+    # Constructor: takes the server's base URL, the home Wi-Fi network's name
+    # (or None), the bandwidth cap (in bytes per second, or None), and the
+    # ConnectivityProber to listen to (or None), and starts the upload thread
+    def __init__(self, url, homeSSID = None, rate = None, prober = None):
+        self.CHUNK_SIZE = 1024 * 1024;
+        self.PRIORITIES = {"incident": 0, "image": 1, "passive": 2};
+        self.TIMEOUT = 10.0;
+        self.RETRY_DELAY = 30.0;
+        self.CHECK_RATE = 30.0;
+        self.CHUNK_RETRIES = 3;
+
+        self.url = url;
+        self.homeSSID = homeSSID;
+        self.rate = rate;
+        self.queue = queue.PriorityQueue();
+        self.queued = set();
+        self.finished = [];
+        self.order = 0;
+        self.online = False;
+        self.connected = prober == None;
+        self.wake = threading.Event();
+        if (prober != None):
+            prober.addListener(self.networkChanged);
+        self.lock = threading.Lock();
+        self.stopping = threading.Event();
+        self.nextTime = 0.0;
+        self.thread = None;
+        self.start();
+
+
+    # ----------------------------- Queueing ----------------------------- #
+    # Queues the file at 'path' (named 'name', of the given kind) to be
+    # uploaded, unless it's already queued. Returns False if it was
+    def add(self, path, name, kind):
+        with self.lock:
+            if (name in self.queued):
+                return False;
+            self.queued.add(name);
+            self.order += 1;
+            order = self.order;
+        self.queue.put((self.PRIORITIES.get(kind, len(self.PRIORITIES)), order, path, name, kind));
+        return True;
+
+
+    # Returns (and forgets) a list of the names of the files uploaded since
+    # this was last called. (They can only be queued again after this)
+    def popFinished(self):
+        with self.lock:
+            finished = self.finished;
+            self.finished = [];
+            self.queued.difference_update(finished);
+        return finished;
+
+
+    # Starts the upload thread (again, after stop()), unless it's running or
+    # requests isn't installed
+    def start(self):
+        self.stopping.clear();
+        if (requests == None or (self.thread != None and self.thread.is_alive())):
+            return;
+        self.thread = threading.Thread(target = self.run, name = "uploader");
+        self.thread.daemon = True;
+        self.thread.start();
+
+
+    # Stops the upload thread (an upload in progress is picked up where it
+    # left off next time), waiting up to 'timeout' seconds for it
+    def stop(self, timeout = 2.0):
+        self.stopping.set();
+        self.wake.set();
+        if (self.thread != None and self.thread.is_alive()):
+            self.thread.join(timeout);
+
+
+    # The prober's listener: wakes the upload thread when the Pi goes online,
+    # and holds uploads when it goes offline
+    def networkChanged(self, online):
+        self.connected = online;
+        if (not online):
+            self.online = False;
+        self.wake.set();
+
+
+    # --------------------------- Upload Thread --------------------------- #
+    # The upload thread's main function: waits until the Pi is on the home
+    # network, then uploads whatever's queued, most important first
+    def run(self):
+        session = requests.Session();
+        lastCheck = None;
+        while (not self.stopping.is_set()):
+            if (not self.online):
+                # only look at which network it is once the Pi is online
+                if (self.connected and (lastCheck == None or
+                                        time.monotonic() - lastCheck >= self.CHECK_RATE)):
+                    self.online = self.isHome();
+                    lastCheck = time.monotonic();
+                if (not self.online):
+                    self.wake.wait(self.CHECK_RATE);
+                    if (self.wake.is_set()):
+                        # the network changed: look again right away
+                        self.wake.clear();
+                        lastCheck = None;
+                    continue;
+
+            try:
+                job = self.queue.get(timeout = 1.0);
+            except queue.Empty:
+                continue;
+            (priority, order, path, name, kind) = job;
+            try:
+                done = self.upload(session, path, name, kind, priority);
+            except (requests.RequestException, ValueError, KeyError):
+                # the network (or server) went away: try again later
+                self.queue.put(job);
+                self.online = False;
+                lastCheck = None;
+                self.stopping.wait(self.RETRY_DELAY);
+                continue;
+            except (IOError, OSError):
+                # the file's gone (such as deleted to make room): forget it
+                with self.lock:
+                    self.queued.discard(name);
+                continue;
+
+            if (done == False):
+                # put back for something more important (or for stopping)
+                self.queue.put(job);
+            elif (done):
+                with self.lock:
+                    self.finished.append(name);
+            # (a file the server refused stays in 'queued', so it isn't
+            # queued again until the next session)
+        session.close();
+
+
+    # Helper function that uploads one file, starting from however much the
+    # server already has. Returns True once it's all uploaded, False if it
+    # was put aside (for a more important file, or because the queue is
+    # stopping), and None if the server wouldn't take it (or it's empty).
+    # Raises an error if the file or the network failed
+    def upload(self, session, path, name, kind, priority):
+        fileUrl = self.url + "uploads/" + name;
+        with open(path, "rb") as f:
+            total = os.fstat(f.fileno()).st_size;
+            if (total == 0):
+                return None;
+            response = session.get(fileUrl, timeout = self.TIMEOUT);
+            offset = 0;
+            if (response.status_code == 200):
+                offset = int(response.json()["offset"]);
+            elif (response.status_code != 404):
+                response.raise_for_status();
+
+            retries = 0;
+            while (offset < total):
+                if (self.stopping.is_set() or self.hasHigherPriority(priority)):
+                    return False;
+                f.seek(offset);
+                chunk = f.read(self.CHUNK_SIZE);
+                end = offset + len(chunk) - 1;
+                headers = {"Content-Range": "bytes {s}-{e}/{t}".format(s = offset, e = end,
+                                                                        t = total),
+                           "X-Chunk-SHA256": hashlib.sha256(chunk).hexdigest(),
+                           "X-Kind": kind};
+                response = session.put(fileUrl, data = chunk, headers = headers,
+                                       timeout = self.TIMEOUT);
+                self.throttle(len(chunk));
+                if (response.status_code == 422 and retries < self.CHUNK_RETRIES):
+                    retries += 1;
+                    continue;
+                if (response.status_code >= 400 and response.status_code < 500 and
+                    response.status_code != 409):
+                    return None;
+                if (response.status_code not in (200, 409)):
+                    raise requests.HTTPError("Unexpected response " + str(response.status_code),
+                                             response = response);
+                retries = 0;
+                offset = int(response.json()["offset"]);
+        return True;
+
+
+    # Helper function that returns a boolean indicating whether or not a file
+    # more important than the given priority is waiting
+    def hasHigherPriority(self, priority):
+        with self.queue.mutex:
+            return len(self.queue.queue) > 0 and self.queue.queue[0][0] < priority;
+
+
+    # Helper function that waits long enough, after 'count' bytes were sent,
+    # to keep the upload to the bandwidth cap
+    def throttle(self, count):
+        if (self.rate == None):
+            return;
+        now = time.monotonic();
+        self.nextTime = max(self.nextTime, now) + count / float(self.rate);
+        self.stopping.wait(self.nextTime - now);
+
+
+    # Helper function that returns a boolean indicating whether or not the Pi
+    # is on the home Wi-Fi network (or on any network, if there's no home
+    # network set)
+    def isHome(self):
+        try:
+            ssid = subprocess.run(["iwgetid", "-r"], stdout = subprocess.PIPE,
+                                  stderr = subprocess.DEVNULL, timeout = 2.0).stdout;
+        except (OSError, subprocess.SubprocessError):
+            return self.homeSSID == None;
+        ssid = ssid.decode("utf-8", "replace").strip();
+        if (self.homeSSID == None):
+            return True;
+        return ssid == self.homeSSID;
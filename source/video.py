@@ -1,3 +1,5 @@
+import time;
+
 # A class that represents a Video object. Contains the various properties needed
 # to identify where the video is, what it's called, and its duration.
 class Video:
@@ -5,13 +7,19 @@ class Video:
     # Video Properties:
     #   fileName    The name of the video file
     #   filePath    The location of the video file's directory
-    #   duration    The length of the video (in seconds)
+    #   duration    The length of the video (in seconds), measured from its
+    #               frames' timestamps once it's finished (None until then)
+    #   startTime   The wall-clock time (seconds since the epoch) the video
+    #               started recording (None until it has)
+    #   startClock  The monotonic time the video started recording
     
     # Constructor with optional file name + path arguments
     def __init__(self, name = "", path = ""):
         self.fileName = name + ".h264";
         self.filePath = path;
-        self.duration = 0.0;
+        self.duration = None;
+        self.startTime = None;
+        self.startClock = None;
     
 
     # --------------------- Setter Functions ---------------------- #
@@ -19,6 +27,12 @@ class Video:
     # extension to the end of the string
     def setFileName(self, newName):
         self.fileName = newName + ".h264";
+
+
+    # Notes the current time as the time the video started recording
+    def markStarted(self):
+        self.startTime = time.time();
+        self.startClock = time.monotonic();
         
 
     # --------------------- Helper Functions ---------------------- #
@@ -26,3 +40,67 @@ class Video:
     # form the full path to which the file is located at. The string is returned
     def getFullPath(self):
         return self.filePath + self.fileName;
+
+
+# A file-like object that the camera records a video segment into. Along with
+# writing the data, it remembers the timestamps of the first and last frames
+# written to it, so the gap between two consecutive segments can be measured.
+class SegmentOutput:
+
+    # SegmentOutput properties:
+    #   file            The open file the segment's data is written to
+    #   frameSource     A function returning the encoder's latest PiVideoFrame
+    #                   (or None)
+    #   firstTimestamp  The camera timestamp (in microseconds) of the first
+    #                   frame written to the segment (None until there is one)
+    #   lastTimestamp   The camera timestamp of the last frame written
+    #   bytesWritten    The number of bytes written to the segment
+    #   maxGap          The longest time (in microseconds) between two
+    #                   consecutive frames since resetMaxGap() was last called
+    #   listener        A function that's also passed every buffer written,
+    #                   along with its frame (or None)
+
+    # Constructor: takes the path of the file to write, the function that
+    # gives the encoder's latest frame, and an optional listener function
+    def __init__(self, path, frameSource, listener = None):
+        self.file = open(path, "wb");
+        self.frameSource = frameSource;
+        self.listener = listener;
+        self.firstTimestamp = None;
+        self.lastTimestamp = None;
+        self.bytesWritten = 0;
+        self.maxGap = 0;
+
+
+    # Writes the given data to the file, noting the timestamp of the frame it
+    # belongs to
+    def write(self, data):
+        self.file.write(data);
+        self.bytesWritten += len(data);
+
+        # header buffers don't carry a timestamp, so they're skipped
+        frame = self.frameSource();
+        if (frame != None and frame.timestamp != None):
+            if (self.firstTimestamp == None):
+                self.firstTimestamp = frame.timestamp;
+            elif (frame.timestamp - self.lastTimestamp > self.maxGap):
+                self.maxGap = frame.timestamp - self.lastTimestamp;
+            self.lastTimestamp = frame.timestamp;
+        if (self.listener != None):
+            self.listener(data, frame);
+        return len(data);
+
+
+    # Forgets the longest gap seen between frames, so a new one can be measured
+    def resetMaxGap(self):
+        self.maxGap = 0;
+
+
+    # Flushes the file
+    def flush(self):
+        self.file.flush();
+
+
+    # Closes the file
+    def close(self):
+        self.file.close();